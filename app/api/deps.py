@@ -1,3 +1,4 @@
+from functools import lru_cache
 from fastapi import Depends, Request
 from app.services.openai_service import OpenAIService
 from app.services.anthropic_service import AnthropicService
@@ -10,7 +11,11 @@ from app.core.agents.vision_agent import VisionAgent
 from app.core.workflows.paper_generation_workflow import PaperGenerationWorkflow
 
 
+# 服务与无状态的 Agent 使用 lru_cache 作为进程级单例，在请求之间复用底层 HTTP 客户端及其连接池；
+# 通用 Agent 内部保存会话历史，仍按请求创建，避免历史在用户之间共享并无限增长
+
 # 依赖注入：OpenAI 服务实例
+@lru_cache(maxsize=1)
 def get_openai_service() -> OpenAIService:
     """获取 OpenAI 服务实例"""
     return OpenAIService()
@@ -23,36 +28,42 @@ def get_agent(openai_service: OpenAIService = Depends(get_openai_service)) -> Ag
 
 
 # 依赖注入：Paper Overview Agent 实例
+@lru_cache(maxsize=1)
 def get_paper_overview_agent(openai_service: OpenAIService = Depends(get_openai_service)) -> PaperOverviewAgent:
     """获取 Paper Overview Agent 实例"""
     return PaperOverviewAgent(openai_service)
 
 
 # 依赖注入：LaTeX Paper Generator Agent 实例
+@lru_cache(maxsize=1)
 def get_latex_paper_generator_agent(openai_service: OpenAIService = Depends(get_openai_service)) -> LaTeXPaperGeneratorAgent:
     """获取 LaTeX Paper Generator Agent 实例"""
     return LaTeXPaperGeneratorAgent(openai_service)
 
 
 # 依赖注入：Requirement Checklist Agent 实例
+@lru_cache(maxsize=1)
 def get_requirement_checklist_agent(openai_service: OpenAIService = Depends(get_openai_service)) -> RequirementChecklistAgent:
     """获取 Requirement Checklist Agent 实例"""
     return RequirementChecklistAgent(openai_service)
 
 
 # 依赖注入：Anthropic 服务实例
+@lru_cache(maxsize=1)
 def get_anthropic_service() -> AnthropicService:
     """获取 Anthropic 服务实例"""
     return AnthropicService()
 
 
 # 依赖注入：Vision Agent 实例
+@lru_cache(maxsize=1)
 def get_vision_agent(anthropic_service: AnthropicService = Depends(get_anthropic_service)) -> VisionAgent:
     """获取 Vision Agent 实例"""
     return VisionAgent(anthropic_service)
 
 
 # 依赖注入：Paper Generation Workflow 实例
+@lru_cache(maxsize=1)
 def get_paper_generation_workflow(
     paper_overview_agent: PaperOverviewAgent = Depends(get_paper_overview_agent),
     latex_paper_agent: LaTeXPaperGeneratorAgent = Depends(get_latex_paper_generator_agent),
@@ -9,11 +9,15 @@ from app.core.security import decode_access_token
 security = HTTPBearer()
 
 
-async def get_current_user(
+def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ) -> User:
-    """获取当前登录用户"""
+    """
+    获取当前登录用户
+    
+    使用同步 def 声明：该依赖执行同步的数据库查询，由 FastAPI 放入线程池执行，避免阻塞事件循环
+    """
     token = credentials.credentials
     payload = decode_access_token(token)
     
@@ -1,17 +1,40 @@
 """管理员API端点"""
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+import asyncio
+import uuid
+from collections import Counter
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy import exists, insert, lambda_stmt, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from pydantic import BaseModel
-from app.db.database import get_db
+from pydantic import BaseModel, ConfigDict, Field
+from app.db.async_database import get_async_db
 from app.db.models import User
 from app.core.security import get_password_hash
 from app.api.deps_auth import get_current_admin_user
 from app.config.settings import settings
+from app.utils.cache import cache
 from app.utils.logger import logger
 
 router = APIRouter()
 
+# 依赖对象在导入时构建一次，各端点共享
+DB = Depends(get_async_db)
+ADMIN = Depends(get_current_admin_user)
+
+# 批量导入时通过 COPY 写入的列；token_balance 等只有 Python 端默认值，需要显式写入
+_BULK_USER_COLUMNS = (
+    "id", "username", "password_hash", "is_admin", "is_active",
+    "user_type", "token_balance", "max_concurrent_workflows",
+)
+_DEFAULT_TOKEN_BALANCE = User.__table__.c.token_balance.default.arg
+_DEFAULT_MAX_CONCURRENT_WORKFLOWS = User.__table__.c.max_concurrent_workflows.default.arg
+
+# 用户列表/详情的短 TTL 缓存（管理后台会高频轮询），任何写操作后立即失效
+_USERS_CACHE_TTL = 2
+_USERS_LIST_CACHE_KEY = "users:list:v1"
+_USER_DETAIL_CACHE_KEY = "users:detail:v1:{}"
+
 
 class UserCreate(BaseModel):
     username: str
@@ -34,6 +57,8 @@ class MaxConcurrentWorkflowsUpdate(BaseModel):
 
 
 class UserResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True, frozen=True, revalidate_instances="never", defer_build=False)
+    
     id: str
     username: str
     is_admin: bool
@@ -41,22 +66,65 @@ class UserResponse(BaseModel):
     user_type: str
     token_balance: int
     max_concurrent_workflows: int
-    created_at: str
-    
-    class Config:
-        from_attributes = True
+    # 直接取数据库渲染好的 ISO 字符串（User.created_at_iso）
+    created_at: str = Field(validation_alias="created_at_iso")
+
+
+# INSERT/UPDATE ... RETURNING 构建 UserResponse 所需的列；created_at_iso 是 column_property，
+# RETURNING User 实体时不会带回，需显式列出，否则校验时会在 AsyncSession 上触发懒加载
+_USER_RESPONSE_COLUMNS = (
+    User.id, User.username, User.is_admin, User.is_active, User.user_type,
+    User.token_balance, User.max_concurrent_workflows, User.created_at_iso,
+)
+
+
+def _invalidate_users_cache(*user_ids: str) -> None:
+    """写操作后失效用户列表及相关用户详情缓存"""
+    cache.delete(_USERS_LIST_CACHE_KEY, *(_USER_DETAIL_CACHE_KEY.format(user_id) for user_id in user_ids))
+
+
+async def _get_user_by_id(db: AsyncSession, user_id: str):
+    """按主键查询用户（lambda_stmt 缓存编译后的 SQL，user_id 作为绑定参数）"""
+    stmt = lambda_stmt(lambda: select(User).where(User.id == user_id))
+    return (await db.execute(stmt)).scalar_one_or_none()
+
+
+async def _username_exists(db: AsyncSession, username: str) -> bool:
+    """检查用户名是否已存在（lambda_stmt 缓存编译后的 EXISTS 查询）"""
+    stmt = lambda_stmt(lambda: select(exists().where(User.username == username)))
+    return bool((await db.execute(stmt)).scalar())
+
+
+def _json_response(content: bytes) -> Response:
+    """返回已序列化的 JSON 响应"""
+    return Response(content=content, media_type="application/json")
+
+
+async def _update_user_returning(db: AsyncSession, user_id: str, values: dict) -> UserResponse:
+    """
+    使用 UPDATE ... RETURNING 更新用户并直接构建响应
+
+    RETURNING 直接带回响应所需的列（含数据库渲染的 created_at_iso），因此无需在提交后再 refresh；
+    响应在 commit 之前构建，不依赖会话中已加载的 User 对象。
+    """
+    result = await db.execute(
+        update(User).where(User.id == user_id).values(**values).returning(*_USER_RESPONSE_COLUMNS)
+    )
+    response = UserResponse.model_validate(result.one())
+    await db.commit()
+    _invalidate_users_cache(user_id)
+    return response
 
 
 @router.post("/users", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def create_user(
     user_data: UserCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin_user)
+    db: AsyncSession = DB,
+    current_user: User = ADMIN
 ):
     """创建新用户"""
     # 检查用户名是否已存在
-    existing_user = db.query(User).filter(User.username == user_data.username).first()
-    if existing_user:
+    if await _username_exists(db, user_data.username):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="用户名已存在"
@@ -69,88 +137,140 @@ async def create_user(
             detail="user_type必须是'frontend'或'backend'"
         )
     
-    # 创建新用户
-    new_user = User(
-        username=user_data.username,
-        password_hash=get_password_hash(user_data.password),
-        is_admin=False,
-        is_active=True,
-        user_type=user_data.user_type
+    # 创建新用户（INSERT ... RETURNING 一次取回 id、created_at_iso 等默认值）
+    result = await db.execute(
+        insert(User).values(
+            username=user_data.username,
+            password_hash=get_password_hash(user_data.password),
+            is_admin=False,
+            is_active=True,
+            user_type=user_data.user_type
+        ).returning(*_USER_RESPONSE_COLUMNS)
     )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    response = UserResponse.model_validate(result.one())
+    await db.commit()
+    _invalidate_users_cache()
     
     logger.info(f"管理员 {current_user.username} 创建了新用户: {user_data.username}")
     
-    return UserResponse(
-        id=new_user.id,
-        username=new_user.username,
-        is_admin=new_user.is_admin,
-        is_active=new_user.is_active,
-        user_type=new_user.user_type,
-        token_balance=new_user.token_balance,
-        max_concurrent_workflows=new_user.max_concurrent_workflows,
-        created_at=new_user.created_at.isoformat()
+    return response
+
+
+@router.post("/users/bulk", response_model=List[UserResponse], status_code=status.HTTP_201_CREATED)
+async def bulk_create_users(
+    users_data: List[UserCreate],
+    db: AsyncSession = DB,
+    current_user: User = ADMIN
+):
+    """
+    批量创建用户
+    
+    使用 PostgreSQL COPY 一次性写入所有用户，比逐行 INSERT 快得多，适用于初始化批量开通账号。
+    任一用户校验失败则整批不写入。
+    """
+    if not users_data:
+        return []
+    
+    # 验证user_type
+    for user_data in users_data:
+        if user_data.user_type not in ["frontend", "backend"]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="user_type必须是'frontend'或'backend'"
+            )
+    
+    # 检查批次内及数据库中的重复用户名
+    usernames = [user_data.username for user_data in users_data]
+    duplicated = {name for name, count in Counter(usernames).items() if count > 1}
+    existing = (await db.execute(
+        select(User.username).where(User.username.in_(usernames))
+    )).scalars().all()
+    duplicated.update(existing)
+    if duplicated:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"用户名已存在: {', '.join(sorted(duplicated))}"
+        )
+    
+    # 密码哈希是 CPU 密集操作，放到线程中执行，避免阻塞事件循环
+    password_hashes = await asyncio.to_thread(
+        lambda: [get_password_hash(user_data.password) for user_data in users_data]
+    )
+    
+    user_ids = [str(uuid.uuid4()) for _ in users_data]
+    records = [
+        (
+            user_id, user_data.username, password_hash, False, True,
+            user_data.user_type, _DEFAULT_TOKEN_BALANCE, _DEFAULT_MAX_CONCURRENT_WORKFLOWS,
+        )
+        for user_id, user_data, password_hash in zip(user_ids, users_data, password_hashes)
+    ]
+    
+    # 通过底层 asyncpg 连接执行 COPY，与会话处于同一事务中
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        User.__tablename__, records=records, columns=_BULK_USER_COLUMNS
     )
+    await db.commit()
+    _invalidate_users_cache()
+    
+    # 取回 created_at 等服务端默认值
+    users = (await db.execute(select(User).where(User.id.in_(user_ids)))).scalars().all()
+    
+    logger.info(f"管理员 {current_user.username} 批量创建了 {len(records)} 个用户")
+    
+    return [UserResponse.model_validate(user) for user in users]
 
 
 @router.get("/users", response_model=List[UserResponse])
 async def list_users(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin_user)
+    db: AsyncSession = DB,
+    current_user: User = ADMIN
 ):
     """列出所有用户"""
-    users = db.query(User).all()
-    return [
-        UserResponse(
-            id=user.id,
-            username=user.username,
-            is_admin=user.is_admin,
-            is_active=user.is_active,
-            user_type=user.user_type,
-            token_balance=user.token_balance,
-            max_concurrent_workflows=user.max_concurrent_workflows,
-            created_at=user.created_at.isoformat()
-        )
-        for user in users
-    ]
+    cached = cache.get(_USERS_LIST_CACHE_KEY)
+    if cached is not None:
+        return _json_response(cached)
+    
+    users = (await db.execute(select(User))).scalars().all()
+    content = orjson.dumps([UserResponse.model_validate(user).model_dump(mode="json") for user in users])
+    cache.set(_USERS_LIST_CACHE_KEY, content, _USERS_CACHE_TTL)
+    return _json_response(content)
 
 
 @router.get("/users/{user_id}", response_model=UserResponse)
 async def get_user(
     user_id: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin_user)
+    db: AsyncSession = DB,
+    current_user: User = ADMIN
 ):
     """获取用户信息"""
-    user = db.query(User).filter(User.id == user_id).first()
+    cache_key = _USER_DETAIL_CACHE_KEY.format(user_id)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return _json_response(cached)
+    
+    user = await _get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="用户不存在"
         )
-    return UserResponse(
-        id=user.id,
-        username=user.username,
-        is_admin=user.is_admin,
-        is_active=user.is_active,
-        user_type=user.user_type,
-        token_balance=user.token_balance,
-        max_concurrent_workflows=user.max_concurrent_workflows,
-        created_at=user.created_at.isoformat()
-    )
+    content = UserResponse.model_validate(user).model_dump_json().encode("utf-8")
+    cache.set(cache_key, content, _USERS_CACHE_TTL)
+    return _json_response(content)
 
 
 @router.put("/users/{user_id}", response_model=UserResponse)
 async def update_user(
     user_id: str,
     user_data: UserUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin_user)
+    db: AsyncSession = DB,
+    current_user: User = ADMIN
 ):
     """更新用户信息"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await _get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -164,13 +284,15 @@ async def update_user(
             detail="不能修改超级管理员"
         )
     
+    values = {}
+    
     # 更新密码
     if user_data.password is not None:
-        user.password_hash = get_password_hash(user_data.password)
+        values["password_hash"] = get_password_hash(user_data.password)
     
     # 更新状态
     if user_data.is_active is not None:
-        user.is_active = user_data.is_active
+        values["is_active"] = user_data.is_active
     
     # 更新用户类型
     if user_data.user_type is not None:
@@ -179,34 +301,27 @@ async def update_user(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="user_type必须是'frontend'或'backend'"
             )
-        user.user_type = user_data.user_type
-    
-    db.commit()
-    db.refresh(user)
-    
-    logger.info(f"管理员 {current_user.username} 更新了用户: {user.username}")
-    
-    return UserResponse(
-        id=user.id,
-        username=user.username,
-        is_admin=user.is_admin,
-        is_active=user.is_active,
-        user_type=user.user_type,
-        token_balance=user.token_balance,
-        max_concurrent_workflows=user.max_concurrent_workflows,
-        created_at=user.created_at.isoformat()
-    )
+        values["user_type"] = user_data.user_type
+    
+    if not values:
+        return UserResponse.model_validate(user)
+    
+    response = await _update_user_returning(db, user_id, values)
+    
+    logger.info(f"管理员 {current_user.username} 更新了用户: {response.username}")
+    
+    return response
 
 
 @router.patch("/users/{user_id}/token-balance", response_model=UserResponse)
 async def update_user_token_balance(
     user_id: str,
     token_data: TokenBalanceUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin_user)
+    db: AsyncSession = DB,
+    current_user: User = ADMIN
 ):
     """更新用户Token余额"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await _get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -214,36 +329,25 @@ async def update_user_token_balance(
         )
     
     old_balance = user.token_balance
-    user.token_balance = token_data.token_balance
-    db.commit()
-    db.refresh(user)
+    response = await _update_user_returning(db, user_id, {"token_balance": token_data.token_balance})
     
     logger.info(
-        f"管理员 {current_user.username} 更新了用户 {user.username} 的Token余额: "
-        f"{old_balance} -> {user.token_balance}"
+        f"管理员 {current_user.username} 更新了用户 {response.username} 的Token余额: "
+        f"{old_balance} -> {response.token_balance}"
     )
     
-    return UserResponse(
-        id=user.id,
-        username=user.username,
-        is_admin=user.is_admin,
-        is_active=user.is_active,
-        user_type=user.user_type,
-        token_balance=user.token_balance,
-        max_concurrent_workflows=user.max_concurrent_workflows,
-        created_at=user.created_at.isoformat()
-    )
+    return response
 
 
 @router.patch("/users/{user_id}/max-concurrent-workflows", response_model=UserResponse)
 async def update_user_max_concurrent_workflows(
     user_id: str,
     workflow_data: MaxConcurrentWorkflowsUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin_user)
+    db: AsyncSession = DB,
+    current_user: User = ADMIN
 ):
     """更新用户最大并发workflow数"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await _get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -257,35 +361,26 @@ async def update_user_max_concurrent_workflows(
         )
     
     old_value = user.max_concurrent_workflows
-    user.max_concurrent_workflows = workflow_data.max_concurrent_workflows
-    db.commit()
-    db.refresh(user)
+    response = await _update_user_returning(
+        db, user_id, {"max_concurrent_workflows": workflow_data.max_concurrent_workflows}
+    )
     
     logger.info(
-        f"管理员 {current_user.username} 更新了用户 {user.username} 的最大并发workflow数: "
-        f"{old_value} -> {user.max_concurrent_workflows}"
+        f"管理员 {current_user.username} 更新了用户 {response.username} 的最大并发workflow数: "
+        f"{old_value} -> {response.max_concurrent_workflows}"
     )
     
-    return UserResponse(
-        id=user.id,
-        username=user.username,
-        is_admin=user.is_admin,
-        is_active=user.is_active,
-        user_type=user.user_type,
-        token_balance=user.token_balance,
-        max_concurrent_workflows=user.max_concurrent_workflows,
-        created_at=user.created_at.isoformat()
-    )
+    return response
 
 
 @router.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user(
     user_id: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin_user)
+    db: AsyncSession = DB,
+    current_user: User = ADMIN
 ):
     """删除用户"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await _get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -300,8 +395,9 @@ async def delete_user(
         )
     
     username = user.username
-    db.delete(user)
-    db.commit()
+    await db.delete(user)
+    await db.commit()
+    _invalidate_users_cache(user_id)
     
     logger.info(f"管理员 {current_user.username} 删除了用户: {username}")
 
@@ -1,20 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
 from typing import AsyncIterator
 from app.core.agent import Agent
 from app.core.schemas import ChatRequest, ChatResponse, StreamChunk
-from app.core.streaming import generate_sse_stream
+from app.core.streaming import generate_sse_stream, sse_response
 from app.api.deps import get_agent
 from app.utils.logger import logger
 
 
 router = APIRouter()
 
+# 依赖对象在导入时构建一次，各端点共享
+AGENT = Depends(get_agent)
+
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
-    agent: Agent = Depends(get_agent)
+    agent: Agent = AGENT
 ):
     """
     非流式对话端点
@@ -43,7 +45,7 @@ async def chat(
 @router.post("/chat/stream")
 async def chat_stream(
     request: ChatRequest,
-    agent: Agent = Depends(get_agent)
+    agent: Agent = AGENT
 ):
     """
     流式对话端点（Server-Sent Events）
@@ -66,15 +68,7 @@ async def chat_stream(
         sse_stream = generate_sse_stream(stream, conversation_id, on_complete=on_stream_complete)
         
         # 返回流式响应
-        return StreamingResponse(
-            sse_stream,
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no"  # 禁用 Nginx 缓冲
-            }
-        )
+        return sse_response(sse_stream)
         
     except Exception as e:
         logger.error(f"Stream endpoint error: {str(e)}")
@@ -5,22 +5,30 @@ from typing import List, Optional
 from datetime import datetime
 
 from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, field_validator
 from sqlalchemy.orm import Session
 
 from app.api.deps import get_crawl_service
 from app.api.deps_auth import get_current_admin_user
 from app.db.database import get_db
-from app.db.models import User, ArxivCrawlRun, ArxivPaper
+from app.db.models import User, ArxivCrawlRun
 from app.db.repositories import ArxivRepository
 from app.services.crawler_service import MonthlyArxivSyncService
 
 
 router = APIRouter()
 
+# 依赖对象在导入时构建一次，各端点共享
+DB = Depends(get_db)
+ADMIN = Depends(get_current_admin_user)
+CRAWL_SERVICE = Depends(get_crawl_service)
+
+# 持有手动触发的后台任务引用，防止任务在运行中被垃圾回收
+_background_tasks: set = set()
+
 
 class ArxivPaperOut(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
+    model_config = ConfigDict(from_attributes=True, frozen=True, revalidate_instances="never", defer_build=False)
 
     id: str
     arxiv_id: str
@@ -31,26 +39,26 @@ class ArxivPaperOut(BaseModel):
     detail_title: Optional[str] = None
     detail_dateline: Optional[str] = None
     algorithm_phrase: Optional[List[str]] = Field(default=None)
-    metadata: Optional[dict] = None
+    # ORM/查询行上的属性名为 metadata_json（metadata 是 Declarative 保留名）
+    metadata: Optional[dict] = Field(default=None, validation_alias="metadata_json")
     created_at: datetime
 
+    @field_validator("algorithm_phrase", mode="before")
     @classmethod
-    def from_orm_obj(cls, obj: ArxivPaper) -> "ArxivPaperOut":
-        data = cls.model_validate(obj)
-        data.metadata = obj.metadata_json
+    def _normalize_algorithm_phrase(cls, value):
         # algorithm_phrase 可能是字符串，转为 list
-        phrase = obj.algorithm_phrase
-        if isinstance(phrase, list):
-            data.algorithm_phrase = phrase
-        elif isinstance(phrase, str):
-            data.algorithm_phrase = [phrase]
-        else:
-            data.algorithm_phrase = None
-        return data
+        if isinstance(value, str):
+            return [value]
+        return value if isinstance(value, list) else None
+
+    @field_validator("metadata", mode="before")
+    @classmethod
+    def _normalize_metadata(cls, value):
+        return value if isinstance(value, dict) else None
 
 
 class CrawlRunOut(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
+    model_config = ConfigDict(from_attributes=True, frozen=True, revalidate_instances="never", defer_build=False)
 
     id: str
     run_month: str
@@ -65,12 +73,14 @@ class CrawlRunOut(BaseModel):
 
 
 class PaginatedPapersResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True, frozen=True, revalidate_instances="never", defer_build=False)
+
     total: int
     items: List[ArxivPaperOut]
 
 
 @router.get("/latest", response_model=CrawlRunOut)
-def get_latest_run(db: Session = Depends(get_db)) -> CrawlRunOut:
+def get_latest_run(db: Session = DB) -> CrawlRunOut:
     repo = ArxivRepository(db)
     run = repo.get_latest_run()
     if not run:
@@ -83,22 +93,24 @@ def list_papers(
     skip: int = Query(0, ge=0),
     limit: int = Query(20, gt=0, le=100),
     keyword: Optional[str] = Query(default=None, description="标题/摘要模糊搜索"),
-    db: Session = Depends(get_db),
+    db: Session = DB,
 ) -> PaginatedPapersResponse:
     repo = ArxivRepository(db)
     total, items = repo.list_papers(skip=skip, limit=limit, keyword=keyword)
-    mapped = [ArxivPaperOut.from_orm_obj(item) for item in items]
+    mapped = [ArxivPaperOut.model_validate(item, from_attributes=True) for item in items]
     return PaginatedPapersResponse(total=total, items=mapped)
 
 
 @router.post("/trigger")
 async def trigger_manual_run(
-    service: MonthlyArxivSyncService = Depends(get_crawl_service),
-    _: User = Depends(get_current_admin_user),
+    service: MonthlyArxivSyncService = CRAWL_SERVICE,
+    _: User = ADMIN,
 ):
     if service.is_running():
         raise HTTPException(status_code=409, detail="Crawler is already running")
-    asyncio.create_task(service.run_once())
+    task = asyncio.create_task(service.run_once())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
     return {"detail": "Arxiv crawl triggered"}
 
 
@@ -1,15 +1,21 @@
 """认证API端点"""
+import asyncio
+import hmac
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from app.db.database import get_db
+from sqlalchemy import lambda_stmt, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, ConfigDict
+from app.db.async_database import get_async_db
 from app.db.models import User
-from app.core.security import verify_password, get_password_hash, create_access_token
+from app.core.security import verify_and_update_password, get_password_hash, create_access_token
 from app.config.settings import settings
 from app.utils.logger import logger
 
 router = APIRouter()
 
+# 依赖对象在导入时构建一次
+DB = Depends(get_async_db)
+
 
 class LoginRequest(BaseModel):
     username: str
@@ -17,6 +23,8 @@ class LoginRequest(BaseModel):
 
 
 class LoginResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True, frozen=True, revalidate_instances="never", defer_build=False)
+    
     access_token: str
     token_type: str = "bearer"
     username: str
@@ -25,6 +33,8 @@ class LoginResponse(BaseModel):
 
 
 class UserResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True, frozen=True, revalidate_instances="never", defer_build=False)
+    
     id: str
     username: str
     is_admin: bool
@@ -32,58 +42,68 @@ class UserResponse(BaseModel):
     user_type: str
     max_concurrent_workflows: int
     created_at: str
-    
-    class Config:
-        from_attributes = True
+
+
+async def _get_user_by_username(db: AsyncSession, username: str):
+    """按用户名查询用户（lambda_stmt 缓存编译后的 SQL，username 作为绑定参数）"""
+    stmt = lambda_stmt(lambda: select(User).where(User.username == username))
+    return (await db.execute(stmt)).scalar_one_or_none()
 
 
 @router.post("/login", response_model=LoginResponse)
 async def login(
     request: LoginRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = DB
 ):
     """用户登录"""
-    # 检查是否是超级管理员
-    if request.username == settings.admin_username_value:
-        if request.password == settings.admin_password_value:
-            # 检查数据库中是否存在超级管理员，如果不存在则创建
-            admin_user = db.query(User).filter(User.username == settings.admin_username_value).first()
-            if not admin_user:
-                admin_user = User(
-                    username=settings.admin_username_value,
-                    password_hash=get_password_hash(settings.admin_password_value),
-                    is_admin=True,
-                    is_active=True,
-                    user_type="backend"  # 管理员默认是后端用户
-                )
-                db.add(admin_user)
-                db.commit()
-                db.refresh(admin_user)
-                logger.info(f"创建超级管理员用户: {settings.admin_username_value}")
-            
-            # 生成令牌
-            access_token = create_access_token(data={"sub": admin_user.username})
-            return LoginResponse(
-                access_token=access_token,
-                username=admin_user.username,
-                is_admin=admin_user.is_admin,
-                user_type=admin_user.user_type
-            )
-        else:
+    # 管理员配置在调用时读取（cached_property，开销与模块常量相同），reload_settings 后立即生效
+    admin_username = settings.admin_username_value
+    admin_password = settings.admin_password_value
+    
+    # 超级管理员与普通用户共用同一次按用户名的查询
+    user = await _get_user_by_username(db, request.username)
+    
+    # 数据库中不存在超级管理员时，使用配置中的密码创建（仅首次登录）；
+    # 账号存在后以数据库中的密码哈希为准，与其他用户一样校验，不再用配置密码改写
+    if not user and request.username == admin_username:
+        if not hmac.compare_digest(request.password.encode("utf-8"), admin_password.encode("utf-8")):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="用户名或密码错误"
             )
+        admin_user = User(
+            username=admin_username,
+            password_hash=await asyncio.to_thread(get_password_hash, admin_password),
+            is_admin=True,
+            is_active=True,
+            user_type="backend"  # 管理员默认是后端用户
+        )
+        db.add(admin_user)
+        await db.commit()
+        await db.refresh(admin_user)
+        logger.info(f"创建超级管理员用户: {admin_username}")
+        
+        # 生成令牌
+        access_token = await asyncio.to_thread(create_access_token, {"sub": admin_user.username})
+        return LoginResponse(
+            access_token=access_token,
+            username=admin_user.username,
+            is_admin=admin_user.is_admin,
+            user_type=admin_user.user_type
+        )
     
     # 普通用户登录
-    user = db.query(User).filter(User.username == request.username).first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="用户名或密码错误"
         )
     
-    if not verify_password(request.password, user.password_hash):
+    # 密码校验是 CPU 密集操作（多轮哈希），放到线程中执行
+    verified, upgraded_hash = await asyncio.to_thread(
+        verify_and_update_password, request.password, user.password_hash
+    )
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="用户名或密码错误"
@@ -95,8 +115,14 @@ async def login(
             detail="用户已被禁用"
         )
     
-    # 生成令牌
-    access_token = create_access_token(data={"sub": user.username})
+    # 历史 bcrypt 哈希在登录成功后升级为新方案
+    if upgraded_hash:
+        user.password_hash = upgraded_hash
+        await db.commit()
+        logger.info(f"用户 {user.username} 的密码哈希已升级")
+    
+    # 生成令牌（签名在线程中执行，不阻塞事件循环）
+    access_token = await asyncio.to_thread(create_access_token, {"sub": user.username})
     return LoginResponse(
         access_token=access_token,
         username=user.username,
@@ -122,7 +148,7 @@ def _register_me_endpoint():
             is_active=current_user.is_active,
             user_type=current_user.user_type,
             max_concurrent_workflows=current_user.max_concurrent_workflows,
-            created_at=current_user.created_at.isoformat()
+            created_at=current_user.created_at_iso
         )
 
 # 注册端点
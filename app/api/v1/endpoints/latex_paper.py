@@ -1,19 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
 from app.core.agents.latex_paper_generator_agent import LaTeXPaperGeneratorAgent
 from app.core.schemas import LaTeXPaperRequest, LaTeXPaperResponse, StreamChunk
-from app.core.streaming import generate_sse_stream
+from app.core.streaming import generate_sse_stream, sse_response
 from app.api.deps import get_latex_paper_generator_agent
 from app.utils.logger import logger
 
 
 router = APIRouter()
 
+# 依赖对象在导入时构建一次，各端点共享
+LATEX_AGENT = Depends(get_latex_paper_generator_agent)
+
 
 @router.post("/generate", response_model=LaTeXPaperResponse)
 async def generate_latex_paper(
     request: LaTeXPaperRequest,
-    agent: LaTeXPaperGeneratorAgent = Depends(get_latex_paper_generator_agent)
+    agent: LaTeXPaperGeneratorAgent = LATEX_AGENT
 ):
     """
     生成 LaTeX 论文文件（非流式）
@@ -52,7 +54,7 @@ async def generate_latex_paper(
 @router.post("/generate/stream")
 async def generate_latex_paper_stream(
     request: LaTeXPaperRequest,
-    agent: LaTeXPaperGeneratorAgent = Depends(get_latex_paper_generator_agent)
+    agent: LaTeXPaperGeneratorAgent = LATEX_AGENT
 ):
     """
     流式生成 LaTeX 论文文件（Server-Sent Events）
@@ -76,15 +78,7 @@ async def generate_latex_paper_stream(
         sse_stream = generate_sse_stream(stream, conversation_id=None, on_complete=None)
         
         # 返回流式响应
-        return StreamingResponse(
-            sse_stream,
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no"  # 禁用 Nginx 缓冲
-            }
-        )
+        return sse_response(sse_stream)
         
     except Exception as e:
         logger.error(f"LaTeX paper streaming error: {str(e)}")
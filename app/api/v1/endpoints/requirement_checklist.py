@@ -1,8 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
 from app.core.agents.requirement_checklist_agent import RequirementChecklistAgent
 from app.core.schemas import RequirementChecklistRequest, RequirementChecklistResponse, StreamChunk
-from app.core.streaming import generate_sse_stream
+from app.core.streaming import generate_sse_stream, sse_response
 from app.api.deps import get_requirement_checklist_agent
 from app.utils.logger import logger
 
@@ -69,15 +68,7 @@ async def generate_requirement_checklist_stream(
         sse_stream = generate_sse_stream(stream, conversation_id=None, on_complete=None)
         
         # 返回流式响应
-        return StreamingResponse(
-            sse_stream,
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no"  # 禁用 Nginx 缓冲
-            }
-        )
+        return sse_response(sse_stream)
         
     except Exception as e:
         logger.error(f"Requirement checklist streaming error: {str(e)}")
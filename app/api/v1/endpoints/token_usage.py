@@ -1,18 +1,39 @@
 """Token 使用统计 API 端点"""
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select, tuple_, union_all
 from typing import List, Optional
 from datetime import datetime, timedelta
+import hashlib
 from app.api.deps_auth import get_current_backend_user
 from app.db.database import get_db
 from app.db.models import User, TokenUsage
+from app.db.token_usage_mv import (
+    token_usage_daily_mv,
+    get_token_usage_daily_mv_complete_before,
+    get_token_usage_daily_mv_version,
+)
 from app.utils.logger import logger
-from pydantic import BaseModel
+from pydantic import BaseModel, field_serializer
 
 
 router = APIRouter()
 
+# 仪表盘每隔几秒轮询一次，允许浏览器短时间复用私有缓存，过期后凭 ETag 协商
+_CACHE_CONTROL = "private, max-age=5"
+
+# 明细查询只取 TokenUsageDetail 需要的列，返回 RowMapping 由响应模型直接校验，省去 ORM 实体构建
+_TOKEN_USAGE_DETAIL_COLUMNS = (
+    TokenUsage.id,
+    TokenUsage.session_id,
+    TokenUsage.prompt_tokens,
+    TokenUsage.completion_tokens,
+    TokenUsage.total_tokens,
+    TokenUsage.model,
+    TokenUsage.stage,
+    TokenUsage.created_at,
+)
+
 
 class TokenUsageSummary(BaseModel):
     """Token 使用统计摘要"""
@@ -56,6 +77,11 @@ class TokenUsageDetail(BaseModel):
     
     class Config:
         from_attributes = True
+    
+    @field_serializer("created_at")
+    def serialize_created_at(self, created_at: datetime) -> int:
+        """以毫秒时间戳返回，省去逐条 ISO8601 格式化，前端用 new Date(ms) 解析"""
+        return int(created_at.timestamp() * 1000)
 
 
 class TokenUsageResponse(BaseModel):
@@ -67,14 +93,52 @@ class TokenUsageResponse(BaseModel):
     token_balance: int  # 用户当前token余额
 
 
+class TokenUsagePage(BaseModel):
+    """Token 使用记录分页响应"""
+    items: List[TokenUsageDetail]
+    total: int  # 记录总数
+    limit: int
+    offset: int
+
+
 class TokenBalanceResponse(BaseModel):
     """Token余额响应"""
     token_balance: int
     is_overdraft: bool  # 是否欠费
 
 
+def _get_token_balance(db: Session, user_id: str) -> int:
+    """只查询 token_balance 一列，避免 refresh 整个 User 对象"""
+    token_balance = db.execute(
+        select(User.token_balance).where(User.id == user_id)
+    ).scalar_one()
+    return token_balance or 0
+
+
+def _make_etag(*parts) -> str:
+    """根据决定响应内容的各项数据生成 ETag"""
+    digest = hashlib.blake2b(":".join(map(str, parts)).encode("utf-8"), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    """If-None-Match 与 ETag 匹配时返回 304 响应，否则返回 None"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": _CACHE_CONTROL})
+    return None
+
+
+def _set_cache_headers(response: Response, etag: str) -> None:
+    """设置 ETag 及缓存控制响应头"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = _CACHE_CONTROL
+
+
 @router.get("/summary", response_model=TokenUsageResponse)
 async def get_token_usage_summary(
+    request: Request,
+    response: Response,
     days: Optional[int] = 30,
     current_user: User = Depends(get_current_backend_user),
     db: Session = Depends(get_db)
@@ -88,100 +152,136 @@ async def get_token_usage_summary(
         db: 数据库会话
         
     Returns:
-        Token 使用统计信息
+        Token 使用统计信息；数据未变化时返回 304
     """
     try:
+        # 先用一次轻量查询（余额 + 最新记录时间，走 (user_id, created_at) 索引）生成 ETag，
+        # 客户端缓存仍有效时直接返回 304，跳过下面的聚合查询；
+        # 物化视图刷新和日期切换会改变统计来源，一并计入 ETag；
+        # 日期取数据库时间（与下面统计范围的起点一致），避免应用与数据库时区不一致
+        today_start = func.date_trunc('day', func.now())
+        mv_complete_before = get_token_usage_daily_mv_complete_before()
+        token_balance, latest_created_at, db_today = db.execute(
+            select(
+                User.token_balance,
+                select(func.max(TokenUsage.created_at))
+                .where(TokenUsage.user_id == current_user.id)
+                .scalar_subquery(),
+                today_start
+            ).where(User.id == current_user.id)
+        ).one()
+        etag = _make_etag(
+            current_user.id,
+            days,
+            token_balance,
+            latest_created_at,
+            db_today,
+            get_token_usage_daily_mv_version()
+        )
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+        
         # 计算起始时间
         start_date = datetime.utcnow() - timedelta(days=days)
         
-        # 基础查询：当前用户的数据
-        query = db.query(TokenUsage).filter(
-            TokenUsage.user_id == current_user.id,
-            TokenUsage.created_at >= start_date
+        # 统计数据来源：物化视图已完整覆盖的日期（最近一次刷新开始前已结束的各天）读取按日预聚合的物化视图，
+        # 之后的数据直接读取明细表，保证当天用量实时可见；跨过零点但尚未刷新时，前一天也从明细表读取，
+        # 两部分在同一时间点衔接，不会遗漏上次刷新后写入的记录。本进程尚未成功刷新时全部读取明细表
+        range_start = func.date_trunc('day', func.now() - timedelta(days=days))
+        live_start = mv_complete_before if mv_complete_before is not None else range_start
+        mv = token_usage_daily_mv
+        history_rows = select(
+            mv.c.stage,
+            mv.c.model,
+            mv.c.prompt_tokens,
+            mv.c.completion_tokens,
+            mv.c.total_tokens,
+            mv.c.record_count
+        ).where(
+            mv.c.user_id == current_user.id,
+            mv.c.day >= range_start,
+            mv.c.day < live_start
         )
-        
-        # 汇总统计
-        summary_result = query.with_entities(
-            func.sum(TokenUsage.prompt_tokens).label('total_prompt_tokens'),
-            func.sum(TokenUsage.completion_tokens).label('total_completion_tokens'),
-            func.sum(TokenUsage.total_tokens).label('total_tokens'),
-            func.count(TokenUsage.id).label('record_count')
-        ).first()
-        
-        summary = TokenUsageSummary(
-            total_prompt_tokens=int(summary_result.total_prompt_tokens or 0),
-            total_completion_tokens=int(summary_result.total_completion_tokens or 0),
-            total_tokens=int(summary_result.total_tokens or 0),
-            record_count=int(summary_result.record_count or 0)
-        )
-        
-        # 按阶段统计
-        stage_results = query.with_entities(
+        live_rows = select(
             TokenUsage.stage,
-            func.sum(TokenUsage.prompt_tokens).label('prompt_tokens'),
-            func.sum(TokenUsage.completion_tokens).label('completion_tokens'),
-            func.sum(TokenUsage.total_tokens).label('total_tokens'),
-            func.count(TokenUsage.id).label('record_count')
-        ).group_by(TokenUsage.stage).all()
-        
-        by_stage = [
-            TokenUsageByStage(
-                stage=stage or "unknown",
-                prompt_tokens=int(prompt_tokens or 0),
-                completion_tokens=int(completion_tokens or 0),
-                total_tokens=int(total_tokens or 0),
-                record_count=int(record_count or 0)
-            )
-            for stage, prompt_tokens, completion_tokens, total_tokens, record_count in stage_results
-        ]
-        
-        # 按模型统计
-        model_results = query.with_entities(
             TokenUsage.model,
             func.sum(TokenUsage.prompt_tokens).label('prompt_tokens'),
             func.sum(TokenUsage.completion_tokens).label('completion_tokens'),
             func.sum(TokenUsage.total_tokens).label('total_tokens'),
             func.count(TokenUsage.id).label('record_count')
-        ).group_by(TokenUsage.model).all()
+        ).where(
+            TokenUsage.user_id == current_user.id,
+            TokenUsage.created_at >= live_start,
+            TokenUsage.created_at >= range_start
+        ).group_by(TokenUsage.stage, TokenUsage.model)
+        usage = union_all(history_rows, live_rows).subquery()
         
-        by_model = [
-            TokenUsageByModel(
-                model=model,
-                prompt_tokens=int(prompt_tokens or 0),
-                completion_tokens=int(completion_tokens or 0),
-                total_tokens=int(total_tokens or 0),
-                record_count=int(record_count or 0)
+        # 汇总 / 按阶段 / 按模型三种统计通过 GROUPING SETS 在一次查询中完成
+        # GROUPING(stage, model) 的位掩码区分各分组：3=总计，1=按阶段，2=按模型
+        # （stage/model 本身可能为 NULL，不能用 NULL 判断所属分组）
+        grouping_results = db.execute(
+            select(
+                func.grouping(usage.c.stage, usage.c.model).label('grouping_id'),
+                usage.c.stage,
+                usage.c.model,
+                func.sum(usage.c.prompt_tokens).label('prompt_tokens'),
+                func.sum(usage.c.completion_tokens).label('completion_tokens'),
+                func.sum(usage.c.total_tokens).label('total_tokens'),
+                func.sum(usage.c.record_count).label('record_count')
+            ).group_by(
+                func.grouping_sets(tuple_(), tuple_(usage.c.stage), tuple_(usage.c.model))
             )
-            for model, prompt_tokens, completion_tokens, total_tokens, record_count in model_results
-        ]
+        ).all()
         
-        # 最近的记录（最近20条）
-        recent_records = query.order_by(TokenUsage.created_at.desc()).limit(20).all()
-        recent_details = [
-            TokenUsageDetail(
-                id=record.id,
-                session_id=record.session_id,
-                prompt_tokens=record.prompt_tokens,
-                completion_tokens=record.completion_tokens,
-                total_tokens=record.total_tokens,
-                model=record.model,
-                stage=record.stage,
-                created_at=record.created_at
-            )
-            for record in recent_records
-        ]
+        summary = TokenUsageSummary(
+            total_prompt_tokens=0,
+            total_completion_tokens=0,
+            total_tokens=0,
+            record_count=0
+        )
+        by_stage = []
+        by_model = []
+        for grouping_id, stage, model, prompt_tokens, completion_tokens, total_tokens, record_count in grouping_results:
+            if grouping_id == 3:
+                summary = TokenUsageSummary(
+                    total_prompt_tokens=int(prompt_tokens or 0),
+                    total_completion_tokens=int(completion_tokens or 0),
+                    total_tokens=int(total_tokens or 0),
+                    record_count=int(record_count or 0)
+                )
+            elif grouping_id == 1:
+                by_stage.append(TokenUsageByStage(
+                    stage=stage or "unknown",
+                    prompt_tokens=int(prompt_tokens or 0),
+                    completion_tokens=int(completion_tokens or 0),
+                    total_tokens=int(total_tokens or 0),
+                    record_count=int(record_count or 0)
+                ))
+            else:
+                by_model.append(TokenUsageByModel(
+                    model=model,
+                    prompt_tokens=int(prompt_tokens or 0),
+                    completion_tokens=int(completion_tokens or 0),
+                    total_tokens=int(total_tokens or 0),
+                    record_count=int(record_count or 0)
+                ))
         
-        # 获取用户当前token余额
-        db.refresh(current_user)
-        token_balance = current_user.token_balance or 0
-        is_overdraft = token_balance < 0
+        # 最近的记录（最近20条）
+        recent_details = db.execute(
+            select(*_TOKEN_USAGE_DETAIL_COLUMNS).where(
+                TokenUsage.user_id == current_user.id,
+                TokenUsage.created_at >= start_date
+            ).order_by(TokenUsage.created_at.desc()).limit(20)
+        ).mappings().all()
         
+        _set_cache_headers(response, etag)
         return TokenUsageResponse(
             summary=summary,
             by_stage=by_stage,
             by_model=by_model,
             recent_records=recent_details,
-            token_balance=token_balance
+            token_balance=token_balance or 0
         )
         
     except Exception as e:
@@ -189,7 +289,7 @@ async def get_token_usage_summary(
         raise HTTPException(status_code=500, detail=f"Error getting token usage summary: {str(e)}")
 
 
-@router.get("/all", response_model=List[TokenUsageDetail])
+@router.get("/all", response_model=TokenUsagePage)
 async def get_all_token_usage(
     limit: Optional[int] = 100,
     offset: Optional[int] = 0,
@@ -206,26 +306,30 @@ async def get_all_token_usage(
         db: 数据库会话
         
     Returns:
-        Token 使用记录列表
+        Token 使用记录分页结果（含记录总数）
     """
     try:
-        records = db.query(TokenUsage).filter(
-            TokenUsage.user_id == current_user.id
-        ).order_by(TokenUsage.created_at.desc()).offset(offset).limit(limit).all()
+        # 总数通过窗口函数 COUNT(*) OVER () 随分页结果一并返回，无需单独的 COUNT 查询
+        records = db.execute(
+            select(
+                *_TOKEN_USAGE_DETAIL_COLUMNS,
+                func.count().over().label('total_count')
+            ).where(
+                TokenUsage.user_id == current_user.id
+            ).order_by(TokenUsage.created_at.desc()).offset(offset).limit(limit)
+        ).mappings().all()
         
-        return [
-            TokenUsageDetail(
-                id=record.id,
-                session_id=record.session_id,
-                prompt_tokens=record.prompt_tokens,
-                completion_tokens=record.completion_tokens,
-                total_tokens=record.total_tokens,
-                model=record.model,
-                stage=record.stage,
-                created_at=record.created_at
-            )
-            for record in records
-        ]
+        if records:
+            total = records[0]['total_count']
+        elif offset:
+            # 偏移量超出范围时没有返回行，只能单独统计总数
+            total = db.execute(
+                select(func.count()).select_from(TokenUsage).where(TokenUsage.user_id == current_user.id)
+            ).scalar_one()
+        else:
+            total = 0
+        
+        return TokenUsagePage(items=records, total=total, limit=limit, offset=offset)
     except Exception as e:
         logger.error(f"Error getting token usage records: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting token usage records: {str(e)}")
@@ -233,6 +337,8 @@ async def get_all_token_usage(
 
 @router.get("/balance", response_model=TokenBalanceResponse)
 async def get_token_balance(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_backend_user),
     db: Session = Depends(get_db)
 ):
@@ -244,13 +350,17 @@ async def get_token_balance(
         db: 数据库会话
         
     Returns:
-        Token余额信息
+        Token余额信息；余额未变化时返回 304
     """
     try:
-        db.refresh(current_user)
-        token_balance = current_user.token_balance or 0
-        is_overdraft = token_balance < 0
+        token_balance = _get_token_balance(db, current_user.id)
+        etag = _make_etag(current_user.id, token_balance)
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
         
+        is_overdraft = token_balance < 0
+        _set_cache_headers(response, etag)
         return TokenBalanceResponse(
             token_balance=token_balance,
             is_overdraft=is_overdraft
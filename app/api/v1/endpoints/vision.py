@@ -1,28 +1,42 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from fastapi.responses import StreamingResponse
-from typing import List, Optional, Tuple
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple
 from app.core.agents.vision_agent import VisionAgent
 from app.core.schemas import (
     VisionAnalysisRequest, 
     VisionAnalysisResponse, 
-    StreamChunk,
     PDFProcessRequest,
     PDFProcessResponse
 )
 from app.api.deps import get_vision_agent
+from app.utils.file_manager import VISION_UPLOAD_TEMP_PREFIX
 from app.utils.logger import logger
-from app.utils.pdf_converter import pdf_to_pngs
-from app.core.streaming import generate_sse_stream
+from app.utils.pdf_converter import get_pdf_page_count, render_pdf_page_to_png
+from app.core.streaming import encode_sse_chunk, generate_sse_stream, sse_response
+from app.config.settings import settings
+from app.utils.vision_cache import ocr_cache_key, get_cached_ocr, set_cached_ocr
 import base64
 import os
 import tempfile
 import shutil
 import asyncio
+from contextlib import aclosing
 from pathlib import Path
 
 
 router = APIRouter()
 
+# 上传文件分块拷贝大小（1MB），避免大 PDF 一次性读入内存
+_UPLOAD_CHUNK_SIZE = 1 << 20
+
+# PDF 各页文字描述之间的分隔符
+_PAGE_SEPARATOR = "\n\n" + "=" * 80 + "\n" + "页面分隔符\n" + "=" * 80 + "\n\n"
+
+# 未提供 text_prompt 时使用的默认 OCR 提示
+_DEFAULT_OCR_TEXT_PROMPT = "请直接输出图片中的所有文字内容、图表、表格、公式等，不要添加任何描述、说明或解释。保持原有的结构和格式信息。"
+
+# 处理一批 (页面索引, PNG 数据)，返回各页的 (页面索引, 描述文本, usage字典)
+_PageProcessor = Callable[[List[Tuple[int, bytes]]], Awaitable[List[Tuple[int, str, dict]]]]
+
 
 @router.post("/analyze", response_model=VisionAnalysisResponse)
 async def analyze_image(
@@ -78,7 +92,6 @@ async def analyze_image_stream(
         async def anthropic_to_sse_stream():
             accumulated_text = ""
             usage_info = None
-            stream_ended = False
             
             async for chunk in stream:
                 # 处理不同类型的 chunk
@@ -91,7 +104,7 @@ async def analyze_image_stream(
                         text = getattr(delta, 'text', None)
                         if text:
                             accumulated_text += text
-                            yield f"data: {StreamChunk(chunk=text, done=False).model_dump_json()}\n\n"
+                            yield encode_sse_chunk(text)
                 
                 elif chunk_type == 'message_delta':
                     # 消息增量（可能包含 usage 信息）
@@ -105,7 +118,6 @@ async def analyze_image_stream(
                 
                 elif chunk_type == 'message_stop':
                     # 流结束
-                    stream_ended = True
                     # 尝试从 chunk 获取 usage 信息
                     usage = getattr(chunk, 'usage', None)
                     if usage:
@@ -116,28 +128,31 @@ async def analyze_image_stream(
                         }
                     break
             
-            # 发送完成信号
-            if not stream_ended:
-                yield f"data: {StreamChunk(chunk='', done=True, usage=usage_info).model_dump_json()}\n\n"
-            else:
-                # 如果已经发送了 message_stop，确保发送完成信号
-                yield f"data: {StreamChunk(chunk='', done=True, usage=usage_info).model_dump_json()}\n\n"
-        
-        return StreamingResponse(
-            anthropic_to_sse_stream(),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no"
-            }
-        )
+            # 发送完成信号（无论是否收到 message_stop）
+            yield encode_sse_chunk("", done=True, usage=usage_info)
+        
+        return sse_response(anthropic_to_sse_stream())
         
     except Exception as e:
         logger.error(f"Vision streaming error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+def _encode_upload_file(fileobj: BinaryIO) -> str:
+    """读取上传文件内容并编码为 base64 字符串"""
+    return base64.b64encode(fileobj.read()).decode("ascii")
+
+
+async def _read_uploaded_images(files: List[UploadFile]) -> List[str]:
+    """
+    读取上传的图片并在线程中编码为 base64
+    
+    VisionAgent 会直接复用 base64 字符串（不再解码、重新编码），
+    且每张图片的原始 bytes 在编码后即可释放，不会与编码结果同时整批驻留内存。
+    """
+    return [await asyncio.to_thread(_encode_upload_file, file.file) for file in files]
+
+
 @router.post("/upload", response_model=VisionAnalysisResponse)
 async def analyze_uploaded_image(
     files: List[UploadFile] = File(...),
@@ -156,11 +171,7 @@ async def analyze_uploaded_image(
         if not files:
             raise HTTPException(status_code=400, detail="No files uploaded")
         
-        # 读取上传的图片
-        images = []
-        for file in files:
-            image_data = await file.read()
-            images.append(image_data)
+        images = await _read_uploaded_images(files)
         
         result = await vision_agent.analyze_image(
             images=images,
@@ -242,143 +253,309 @@ async def extract_text_from_image(
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
-@router.post("/pdf/process", response_model=PDFProcessResponse)
-async def process_pdf(
-    file: UploadFile = File(...),
-    text_prompt: Optional[str] = None,
-    temperature: Optional[float] = 0.3,
-    max_tokens: Optional[int] = 4096,
-    model: Optional[str] = None,
-    dpi: Optional[int] = 300,
-    vision_agent: VisionAgent = Depends(get_vision_agent)
-):
+def _cleanup_pdf_temp_files(temp_pdf_path: Optional[str]) -> None:
+    """清理 PDF 处理过程中产生的临时文件"""
+    try:
+        if temp_pdf_path and os.path.exists(temp_pdf_path):
+            os.unlink(temp_pdf_path)
+            logger.info(f"Deleted temporary PDF file: {temp_pdf_path}")
+    except Exception as e:
+        logger.warning(f"Error cleaning up temporary files: {str(e)}")
+
+
+async def _prepare_pdf(file: UploadFile) -> Tuple[str, int]:
     """
-    处理 PDF 文件：转换为 PNG，使用 Vision Agent 提取文字描述，拼接结果
+    保存上传的 PDF 并读取页数（页面在处理时按需渲染，不预先转换）
     
-    流程：
-    1. 接收上传的 PDF 文件
-    2. 将 PDF 转换为多个 PNG 图片（每页一张）
-    3. 使用 Vision Agent 并发分析所有图片，提取文字描述
-    4. 拼接所有页面的文字描述并返回（保持页面顺序）
+    Returns:
+        (临时 PDF 路径, 页数)；失败时自行清理临时文件
     """
     temp_pdf_path = None
-    temp_output_dir = None
     
     try:
         # 验证文件类型
         if not file.filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="File must be a PDF")
         
-        # 创建临时文件保存上传的 PDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
-            content = await file.read()
-            temp_pdf.write(content)
+        # 创建临时文件保存上传的 PDF：在线程中把上传的 SpooledTemporaryFile 分块拷贝到磁盘
+        with tempfile.NamedTemporaryFile(delete=False, prefix=VISION_UPLOAD_TEMP_PREFIX, suffix='.pdf') as temp_pdf:
             temp_pdf_path = temp_pdf.name
+            await asyncio.to_thread(shutil.copyfileobj, file.file, temp_pdf, _UPLOAD_CHUNK_SIZE)
         
-        logger.info(f"Received PDF file: {file.filename}, size: {len(content)} bytes")
+        logger.info(f"Received PDF file: {file.filename}, size: {os.path.getsize(temp_pdf_path)} bytes")
         
-        # 创建临时输出目录
-        temp_output_dir = tempfile.mkdtemp(prefix="pdf_pngs_")
-        logger.info(f"Created temporary output directory: {temp_output_dir}")
-        
-        # 将 PDF 转换为 PNG
-        png_paths = pdf_to_pngs(
-            pdf_path=temp_pdf_path,
-            output_dir=temp_output_dir,
-            dpi=dpi
-        )
+        try:
+            page_count = await asyncio.to_thread(get_pdf_page_count, temp_pdf_path)
+        except Exception as e:
+            logger.error(f"Error opening PDF: {str(e)}")
+            page_count = 0
         
-        if not png_paths:
+        if not page_count:
             raise HTTPException(status_code=500, detail="Failed to convert PDF to PNGs")
         
-        logger.info(f"Converted PDF to {len(png_paths)} PNG files")
+        logger.info(f"PDF has {page_count} pages")
         
-        # 如果没有提供 text_prompt，使用默认的 OCR 提示
-        if not text_prompt:
-            text_prompt = "请直接输出图片中的所有文字内容、图表、表格、公式等，不要添加任何描述、说明或解释。保持原有的结构和格式信息。"
+        return temp_pdf_path, page_count
+    
+    except Exception:
+        await asyncio.to_thread(_cleanup_pdf_temp_files, temp_pdf_path)
+        raise
+
+
+def _build_page_processor(
+    vision_agent: VisionAgent,
+    page_count: int,
+    text_prompt: Optional[str],
+    temperature: Optional[float],
+    max_tokens: Optional[int],
+    model: Optional[str]
+) -> Tuple[_PageProcessor, Dict[str, int]]:
+    """
+    构建处理一批页面图片的协程函数（各批共享同一个并发限制）
+    
+    未命中缓存的页面多于一页时合并为一次多图 Vision 调用，
+    批量结果无法按页拆分或调用失败时回退为逐页调用。
+    
+    Returns:
+        (处理函数, 统计信息)；统计信息中的 cache_hits 为命中 OCR 缓存的页数
+    """
+    # 如果没有提供 text_prompt，使用默认的 OCR 提示
+    if not text_prompt:
+        text_prompt = _DEFAULT_OCR_TEXT_PROMPT
+    
+    # 限制同时进行的 Vision 调用数，避免页数多时瞬间打满服务商限流和连接池
+    semaphore = asyncio.Semaphore(settings.vision_max_concurrency)
+    stats = {"cache_hits": 0}
+    
+    async def process_single_page(idx: int, png_data: bytes, cache_key: str) -> Tuple[int, str, dict]:
+        """
+        处理单张图片
         
-        # 定义处理单张图片的异步函数
-        async def process_single_page(idx: int, png_path: str) -> Tuple[int, str, dict]:
-            """
-            处理单张图片
+        Returns:
+            (页面索引, 描述文本, usage字典) 或 (页面索引, 错误信息, 空字典)
+        """
+        try:
+            async with semaphore:
+                logger.debug("Processing page %d/%d", idx, page_count)
+                # 使用 Vision Agent 提取文字描述（直接传入内存中的 PNG 数据）
+                result = await vision_agent.extract_text_from_image(
+                    image=png_data,
+                    text_prompt=text_prompt,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    model=model
+                )
             
-            Returns:
-                (页面索引, 描述文本, usage字典) 或 (页面索引, 错误信息, 空字典)
-            """
-            logger.info(f"Processing page {idx}/{len(png_paths)}: {png_path}")
+            page_description = result["response"]
+            usage = result.get("usage", {})
+            await set_cached_ocr(cache_key, page_description, usage)
             
-            try:
-                # 使用 Vision Agent 提取文字描述
-                result = await vision_agent.extract_text_from_image(
-                    image=png_path,
+            logger.debug("Page %d processed. Description length: %d characters", idx, len(page_description))
+            
+            return (idx, page_description, usage)
+            
+        except Exception as e:
+            logger.error(f"Error processing page {idx}: {str(e)}")
+            # 如果某页处理失败，返回错误标记
+            return (idx, f"[页面 {idx} 处理失败: {str(e)}]", {})
+    
+    async def process_batch(batch: List[Tuple[int, bytes, str]]) -> Optional[List[Tuple[int, str, dict]]]:
+        """
+        在一次 Vision 调用中处理多张图片
+        
+        Returns:
+            各页结果（整批 usage 计入第一页）；失败时返回 None
+        """
+        page_indices = [idx for idx, _, _ in batch]
+        try:
+            async with semaphore:
+                logger.debug("Processing pages %s/%d in one batch", page_indices, page_count)
+                result = await vision_agent.extract_text_from_images_batch(
+                    images=[png_data for _, png_data, _ in batch],
                     text_prompt=text_prompt,
                     temperature=temperature,
                     max_tokens=max_tokens,
                     model=model
                 )
-                
-                page_description = result["response"]
-                usage = result.get("usage", {})
-                
-                logger.info(f"Page {idx} processed. Description length: {len(page_description)} characters")
-                
-                return (idx, page_description, usage)
-                
-            except Exception as e:
-                logger.error(f"Error processing page {idx}: {str(e)}")
-                # 如果某页处理失败，返回错误标记
-                return (idx, f"[页面 {idx} 处理失败: {str(e)}]", {})
+        except Exception as e:
+            logger.warning(f"Batch OCR for pages {page_indices} failed, falling back to per-page: {str(e)}")
+            return None
+        
+        results = []
+        usage = result.get("usage", {})
+        for (idx, _, cache_key), page_description in zip(batch, result["responses"]):
+            await set_cached_ocr(cache_key, page_description)
+            results.append((idx, page_description, usage))
+            usage = {}
+        return results
+    
+    async def process_pages(pages: List[Tuple[int, bytes]]) -> List[Tuple[int, str, dict]]:
+        """处理一批页面，返回各页的 (页面索引, 描述文本, usage字典)"""
+        results = []
+        pending = []
+        for idx, png_data in pages:
+            # 按页面图片内容查找 OCR 缓存，命中则跳过 Vision 调用（不计 token 用量）
+            cache_key = ocr_cache_key(png_data, text_prompt, model, temperature)
+            cached_text = await get_cached_ocr(cache_key)
+            if cached_text is not None:
+                stats["cache_hits"] += 1
+                logger.debug("Page %d OCR cache hit", idx)
+                results.append((idx, cached_text, {}))
+            else:
+                pending.append((idx, png_data, cache_key))
         
-        # 并发处理所有图片
-        logger.info(f"Starting concurrent processing of {len(png_paths)} pages...")
-        tasks = [
-            process_single_page(idx, png_path)
-            for idx, png_path in enumerate(png_paths, 1)
-        ]
+        if len(pending) > 1:
+            batch_results = await process_batch(pending)
+            if batch_results is not None:
+                return results + batch_results
         
-        # 使用 asyncio.gather 并发执行所有任务
-        results = await asyncio.gather(*tasks)
+        results.extend(await asyncio.gather(*(
+            process_single_page(idx, png_data, cache_key) for idx, png_data, cache_key in pending
+        )))
+        return results
+    
+    return process_pages, stats
+
+
+async def _iter_pdf_page_results(
+    pdf_path: str,
+    page_count: int,
+    dpi: int,
+    process_pages: _PageProcessor
+) -> AsyncIterator[Tuple[int, str, dict]]:
+    """
+    按需渲染 PDF 页面并与 OCR 流水线并行处理，按完成顺序产出各页结果
+    
+    渲染协程在线程中逐页渲染 PNG 并放入有界队列，OCR 工作协程从队列取页处理；
+    每个工作协程一次最多取 vision_batch_size 页合并调用（队列中已有的页面才会合并，不等待凑满）。
+    队列容量为单轮可处理页数的 2 倍，渲染速度快于 OCR 时自动背压，内存中只保留少量待处理页面。
+    
+    Yields:
+        (页面索引, 描述文本, usage字典)
+    """
+    worker_count = min(settings.vision_max_concurrency, page_count)
+    batch_size = max(1, settings.vision_batch_size)
+    pages: asyncio.Queue = asyncio.Queue(maxsize=2 * worker_count * batch_size)
+    results: asyncio.Queue = asyncio.Queue()
+    
+    async def render_pages():
+        for page_num in range(page_count):
+            idx = page_num + 1
+            try:
+                png_data = await asyncio.to_thread(render_pdf_page_to_png, pdf_path, page_num, dpi)
+            except Exception as e:
+                logger.error(f"Error rendering page {idx}: {str(e)}")
+                await results.put((idx, f"[页面 {idx} 处理失败: {str(e)}]", {}))
+                continue
+            await pages.put((idx, png_data))
+        
+        # 每个工作协程一个结束标记
+        for _ in range(worker_count):
+            await pages.put(None)
+    
+    async def ocr_worker():
+        finished = False
+        while not finished:
+            item = await pages.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < batch_size and not pages.empty():
+                item = pages.get_nowait()
+                if item is None:
+                    finished = True
+                    break
+                batch.append(item)
+            
+            try:
+                batch_results = await process_pages(batch)
+            except Exception as e:
+                # 每页都必须产出一个结果，否则消费方会一直等待 results.get()
+                logger.error(f"Error processing pages {[idx for idx, _ in batch]}: {str(e)}")
+                batch_results = [(idx, f"[页面 {idx} 处理失败: {str(e)}]", {}) for idx, _ in batch]
+            for result in batch_results:
+                await results.put(result)
+    
+    tasks = [asyncio.create_task(render_pages())]
+    tasks.extend(asyncio.create_task(ocr_worker()) for _ in range(worker_count))
+    
+    try:
+        for _ in range(page_count):
+            yield await results.get()
+    finally:
+        # 提前退出（异常或客户端断开）时取消尚未完成的渲染和 OCR
+        for task in tasks:
+            task.cancel()
+
+
+def _accumulate_usage(total_usage: dict, usage: dict) -> None:
+    """累计 token 使用量"""
+    if usage:
+        total_usage["input_tokens"] += usage.get("input_tokens", 0)
+        total_usage["output_tokens"] += usage.get("output_tokens", 0)
+        total_usage["total_tokens"] += usage.get("total_tokens", 0)
+
+
+@router.post("/pdf/process", response_model=PDFProcessResponse)
+async def process_pdf(
+    file: UploadFile = File(...),
+    text_prompt: Optional[str] = None,
+    temperature: Optional[float] = 0.3,
+    max_tokens: Optional[int] = 4096,
+    model: Optional[str] = None,
+    dpi: Optional[int] = 300,
+    vision_agent: VisionAgent = Depends(get_vision_agent)
+):
+    """
+    处理 PDF 文件：转换为 PNG，使用 Vision Agent 提取文字描述，拼接结果
+    
+    流程：
+    1. 接收上传的 PDF 文件
+    2. 按需将 PDF 页面渲染为 PNG（每页一张，不落盘）
+    3. 渲染的同时使用 Vision Agent 并发分析已渲染的页面，提取文字描述
+    4. 拼接所有页面的文字描述并返回（保持页面顺序）
+    """
+    temp_pdf_path = None
+    
+    try:
+        temp_pdf_path, page_count = await _prepare_pdf(file)
         
-        # 按页面索引排序（保持顺序）
-        results.sort(key=lambda x: x[0])
+        process_pages, page_stats = _build_page_processor(
+            vision_agent, page_count, text_prompt, temperature, max_tokens, model
+        )
         
-        # 提取结果并累计 token 使用量
-        page_descriptions = []
+        # 渲染与 OCR 流水线并行处理所有页面
+        logger.info(f"Starting pipelined processing of {page_count} pages...")
+        # 按完成顺序产出的结果直接写回对应页面位置（保持顺序，无需排序）
+        page_descriptions: List[str] = [""] * page_count
         total_usage = {
             "input_tokens": 0,
             "output_tokens": 0,
             "total_tokens": 0
         }
         
-        for idx, page_description, usage in results:
-            page_descriptions.append(page_description)
-            
-            # 累计 token 使用量
-            if usage:
-                total_usage["input_tokens"] += usage.get("input_tokens", 0)
-                total_usage["output_tokens"] += usage.get("output_tokens", 0)
-                total_usage["total_tokens"] += usage.get("total_tokens", 0)
-        
-        logger.info(f"All {len(png_paths)} pages processed concurrently. Total tokens: {total_usage['total_tokens']}")
-        
-        # 拼接所有页面的文字描述
-        # 添加页面分隔符
-        separator = "\n\n" + "=" * 80 + "\n"
-        separator += "页面分隔符\n"
-        separator += "=" * 80 + "\n\n"
+        # 处理出错或请求被取消时关闭迭代器，取消尚未完成的渲染和 OCR
+        async with aclosing(_iter_pdf_page_results(temp_pdf_path, page_count, dpi, process_pages)) as page_results:
+            async for idx, page_description, usage in page_results:
+                page_descriptions[idx - 1] = page_description
+                _accumulate_usage(total_usage, usage)
+
+        logger.info(
+            f"All {page_count} pages processed concurrently. Total tokens: {total_usage['total_tokens']}, "
+            f"OCR cache hits: {page_stats['cache_hits']}/{page_count}"
+        )
         
-        full_description = ""
-        for idx, desc in enumerate(page_descriptions, 1):
-            full_description += f"=== 第 {idx} 页 ===\n\n"
-            full_description += desc
-            if idx < len(page_descriptions):
-                full_description += separator
+        # 拼接所有页面的文字描述（页面之间添加分隔符）
+        full_description = _PAGE_SEPARATOR.join(
+            f"=== 第 {idx} 页 ===\n\n{desc}"
+            for idx, desc in enumerate(page_descriptions, 1)
+        )
         
-        logger.info(f"PDF processing completed. Total pages: {len(png_paths)}, Total description length: {len(full_description)} characters")
+        logger.info(f"PDF processing completed. Total pages: {page_count}, Total description length: {len(full_description)} characters")
         
         return PDFProcessResponse(
             response=full_description,
-            page_count=len(png_paths),
+            page_count=page_count,
             page_descriptions=page_descriptions,
             total_usage=total_usage,
             raw_response=full_description
@@ -392,15 +569,66 @@ async def process_pdf(
     
     finally:
         # 清理临时文件
+        await asyncio.to_thread(_cleanup_pdf_temp_files, temp_pdf_path)
+
+
+@router.post("/pdf/process/stream")
+async def process_pdf_stream(
+    file: UploadFile = File(...),
+    text_prompt: Optional[str] = None,
+    temperature: Optional[float] = 0.3,
+    max_tokens: Optional[int] = 4096,
+    model: Optional[str] = None,
+    dpi: Optional[int] = 300,
+    vision_agent: VisionAgent = Depends(get_vision_agent)
+):
+    """
+    流式处理 PDF 文件（Server-Sent Events）
+    
+    与 /pdf/process 流程相同，但每页处理完成后立即按页面顺序推送该页的文字描述
+    （chunk 为页面内容，meta.page 为页码），最后推送 done=True 及累计的 token 使用量。
+    """
+    try:
+        temp_pdf_path, page_count = await _prepare_pdf(file)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"PDF processing error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    
+    process_pages, page_stats = _build_page_processor(
+        vision_agent, page_count, text_prompt, temperature, max_tokens, model
+    )
+    
+    async def pdf_to_sse_stream():
+        page_results = _iter_pdf_page_results(temp_pdf_path, page_count, dpi, process_pages)
+        total_usage = {
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "total_tokens": 0
+        }
+        # 乱序完成的页面先缓存，等前面的页面都推送后再按顺序推送
+        finished_pages = {}
+        next_idx = 1
+        
         try:
-            if temp_pdf_path and os.path.exists(temp_pdf_path):
-                os.unlink(temp_pdf_path)
-                logger.info(f"Deleted temporary PDF file: {temp_pdf_path}")
+            async for idx, page_description, usage in page_results:
+                _accumulate_usage(total_usage, usage)
+                finished_pages[idx] = page_description
+                
+                while next_idx in finished_pages:
+                    yield encode_sse_chunk(finished_pages.pop(next_idx), meta={"page": next_idx})
+                    next_idx += 1
             
-            if temp_output_dir and os.path.exists(temp_output_dir):
-                # 删除临时目录及其所有内容
-                shutil.rmtree(temp_output_dir)
-                logger.info(f"Deleted temporary output directory: {temp_output_dir}")
-        except Exception as e:
-            logger.warning(f"Error cleaning up temporary files: {str(e)}")
-
+            logger.info(
+                f"All {page_count} pages streamed. Total tokens: {total_usage['total_tokens']}, "
+                f"OCR cache hits: {page_stats['cache_hits']}/{page_count}"
+            )
+            yield encode_sse_chunk("", done=True, usage=total_usage, meta={"page_count": page_count})
+        
+        finally:
+            # 客户端断开时取消尚未完成的页面，并清理临时文件
+            await page_results.aclose()
+            await asyncio.to_thread(_cleanup_pdf_temp_files, temp_pdf_path)
+    
+    return sse_response(pdf_to_sse_stream())
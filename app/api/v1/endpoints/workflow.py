@@ -1,22 +1,23 @@
 """论文生成工作流 API 端点"""
 from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Form, Request, status
-from fastapi.responses import StreamingResponse, FileResponse
-from typing import Optional, List
+from fastapi.responses import StreamingResponse, FileResponse, Response
+from typing import Any, Dict, Iterable, Optional, List, Union
+from sqlalchemy import func, select, update
 from sqlalchemy.orm import Session
 from app.core.workflows.paper_generation_workflow import PaperGenerationWorkflow
 from app.core.schemas import (
     PaperGenerationWorkflowResponse,
-    PaperOverviewResult,
-    LaTeXPaperResult,
-    RequirementChecklistResult,
     WorkflowProgressChunk
 )
 from app.api.deps import get_paper_generation_workflow, get_vision_agent
 from app.api.deps_auth import get_current_backend_user
+from app.api.v1.endpoints.workflow_tasks import invalidate_task_list_cache
 from app.db.database import get_db
 from app.db.models import User, Task
 from app.core.agents.vision_agent import VisionAgent
-from app.utils.pdf_converter import pdf_to_pngs
+from app.utils.pdf_converter import extract_pdf_page_texts, iter_pdf_pages_to_jpeg
+from app.utils.image_resizer import downscale_image
+from app.utils.concurrency import SingleFlight, bounded_as_completed, bounded_map
 from app.utils.file_manager import (
     save_uploaded_file,
     create_session_folder,
@@ -26,20 +27,682 @@ from app.utils.file_manager import (
     get_session_folder_path,
     search_session_text_files,
     search_all_sessions_text_files,
+    WORKFLOW_UPLOAD_TEMP_PREFIX,
 )
+from app.utils.cache import cache
 from app.utils.logger import logger
 from app.utils.token_tracker import record_usage_from_dict, settle_token_usage
+from app.utils.vision_cache import ocr_cache_key, get_cached_ocr, set_cached_ocr
+from app.config.settings import settings
+from anthropic import InternalServerError, RateLimitError
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+import os
+import functools
+from collections import Counter
+import orjson
+import hashlib
+from pathlib import Path
+from urllib.parse import quote
 import tempfile
+import threading
 import asyncio
+from contextlib import aclosing
 from typing import Tuple
 
 
 router = APIRouter()
 GLOBAL_SESSION_ID = "__all__"
 
+# 工作流中 PDF 页面/图片 OCR 使用的固定调用参数
+_OCR_TEMPERATURE = 0.3
+_OCR_MAX_TOKENS = 4096
+_OCR_TEXT_PROMPT = "请直接输出图片中的所有文字内容、图表、表格、公式等，不要添加任何描述、说明或解释。保持原有的结构和格式信息。"
+
+# 所有工作流请求共享的 Vision 调用并发上限：一次上传几十张图片/扫描页时不会瞬间打满服务商限流
+_vision_semaphore = asyncio.Semaphore(settings.vision_max_concurrency)
+
+# 进程内按 OCR 缓存键合并进行中的 Vision 调用：多个用户/请求同时上传同一张图片或同一份扫描件时只调用一次
+_ocr_single_flight = SingleFlight()
+
+# 需要 OCR 的 PDF 页面渲染为 150 DPI 的 JPEG：文字仍清晰可辨，上传体积远小于 300 DPI 的 PNG
+_PDF_RENDER_DPI = 150
+_PDF_RENDER_JPEG_QUALITY = 85
+
+# PDF 页面文本层达到该字符数时直接使用，不再渲染为图片走 Vision OCR（扫描页文本层为空或极短）
+_PDF_TEXT_LAYER_MIN_CHARS = 50
+
+# 用户上传的图片最长边超过该像素数时先缩小再送 Vision（模型本身也会缩放，超出部分只是多余的上传数据）
+_IMAGE_MAX_DIMENSION = 2048
+_IMAGE_JPEG_QUALITY = 88
+
+# 支持的图片格式
+_ALLOWED_IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'})
+
+# Vision 调用返回的 usage 中参与汇总的字段
+_VISION_USAGE_KEYS = ("input_tokens", "output_tokens", "total_tokens")
+
+# 上传文件按 1 MiB 分块落盘，大 PDF 不会整体读入内存
+_UPLOAD_CHUNK_SIZE = 1 << 20
+
+# SSE 帧的固定前后缀预先编码为 bytes；高频的进度日志帧只有 message 是变量，其余部分预先拼好
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+_SSE_LOG_PREFIX = _SSE_PREFIX + b'{"type":"log","step":null,"step_name":null,"message":'
+_SSE_LOG_SUFFIX = b',"log":null,"done":false,"result":null}' + _SSE_SUFFIX
+
+# 下载文件按后缀确定媒体类型
+_DOWNLOAD_MEDIA_TYPES = {
+    '.json': 'application/json',
+    '.tex': 'application/x-tex',
+    '.md': 'text/markdown',
+    '.txt': 'text/plain',
+}
+
+# session 列表需要遍历输出目录统计大小，结果按用户短时缓存；新建/删除 session 时主动失效
+_SESSIONS_CACHE_TTL = 5
+# 管理员视图与普通用户使用不同的键前缀，任何用户名都不会与管理员视图的键冲突
+_SESSIONS_LIST_ADMIN_CACHE_KEY = "sessions:list:v1:admin"
+_SESSIONS_LIST_USER_CACHE_KEY = "sessions:list:v1:user:{}"
+
+
+def _invalidate_sessions_cache(*usernames: str) -> None:
+    """失效管理员视图（全部 session）及指定用户的 session 列表缓存"""
+    cache.delete(
+        _SESSIONS_LIST_ADMIN_CACHE_KEY,
+        *(_SESSIONS_LIST_USER_CACHE_KEY.format(username) for username in usernames)
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def _resolve_session_folder(session_id: str, username: Optional[str]) -> Path:
+    """
+    解析 session 文件夹路径并缓存（下载接口热路径上省去目录创建/存在性检查）
+
+    session 不存在时抛出 FileNotFoundError：异常不会被 lru_cache 记住，之后创建的 session 仍能解析到。
+    删除 session 后需调用 cache_clear()。
+    """
+    session_folder = get_session_folder_path(session_id, username)
+    if session_folder is None:
+        raise FileNotFoundError(session_id)
+    return session_folder
+
+
+async def _stream_upload_to_temp_dir(
+    upload: UploadFile,
+    suffix: str
+) -> Tuple[tempfile.TemporaryDirectory, str, int]:
+    """
+    按块把上传文件写入新建的临时目录，整个文件不会驻留内存（磁盘写入在线程中执行）
+    
+    Returns:
+        (临时目录, 文件路径, 文件字节数)；调用方用完后调用临时目录的 cleanup()，
+        即使遗漏（如 SSE 生成器从未开始执行），临时目录对象被回收时也会自动删除
+    """
+    temp_dir = tempfile.TemporaryDirectory(prefix=WORKFLOW_UPLOAD_TEMP_PREFIX, ignore_cleanup_errors=True)
+    temp_path = os.path.join(temp_dir.name, f"upload{suffix}")
+    size = 0
+    try:
+        with await asyncio.to_thread(open, temp_path, "wb") as temp_file:
+            while chunk := await upload.read(_UPLOAD_CHUNK_SIZE):
+                await asyncio.to_thread(temp_file.write, chunk)
+                size += len(chunk)
+    except BaseException:
+        await asyncio.to_thread(temp_dir.cleanup)
+        raise
+    return temp_dir, temp_path, size
+
+
+async def _load_pdf_page_texts(pdf_path: str) -> List[str]:
+    """在线程中提取 PDF 各页文本层，PDF 无法解析时返回空列表"""
+    try:
+        return await asyncio.to_thread(extract_pdf_page_texts, pdf_path)
+    except Exception as e:
+        logger.error(f"Error extracting PDF text layer: {str(e)}")
+        return []
+
+
+def _sse(chunk: WorkflowProgressChunk) -> bytes:
+    """把进度块编码为一条 SSE 消息（pydantic 直接序列化为 bytes，不经过 str 中转）"""
+    return _SSE_PREFIX + chunk.__pydantic_serializer__.to_json(chunk) + _SSE_SUFFIX
+
+
+def _sse_log(message: str) -> bytes:
+    """编码一条进度日志 SSE 消息，与 _sse(WorkflowProgressChunk(type='log', message=message)) 输出一致"""
+    return _SSE_LOG_PREFIX + orjson.dumps(message) + _SSE_LOG_SUFFIX
+
+
+# 内容固定的错误帧在导入时编码一次
+_SSE_PDF_PARSE_ERROR = _sse(WorkflowProgressChunk(type="log", message="错误: PDF解析失败", done=True))
+_SSE_NO_INPUT_ERROR = _sse(WorkflowProgressChunk(type="log", message="错误: 必须提供文字描述、上传PDF文件或上传图片文件", done=True))
+
+
+def _sum_vision_usage(usages: Iterable[Optional[Dict[str, Any]]]) -> Counter:
+    """汇总多次 Vision 调用的 token 使用量（input_tokens/output_tokens/total_tokens），缺失的键按 0 计"""
+    total = Counter()
+    for usage in usages:
+        if usage:
+            total.update({key: usage[key] for key in _VISION_USAGE_KEYS if key in usage})
+    return total
+
+
+def _vision_usage_record(total_usage: Counter) -> Dict[str, int]:
+    """把 Vision 的 input/output token 汇总转换为 record_usage_from_dict 使用的字段"""
+    return {
+        "prompt_tokens": total_usage["input_tokens"],
+        "completion_tokens": total_usage["output_tokens"],
+        "total_tokens": total_usage["total_tokens"]
+    }
+
+
+def _joined_length(parts: List[str], separator: str = "\n\n") -> int:
+    """返回 separator.join(parts) 的长度，无需真正拼接"""
+    return sum(len(part) for part in parts) + len(separator) * max(len(parts) - 1, 0)
+
+
+def _combine_document(user_document: str, pdf_page_texts: List[str], image_sections: List[str]) -> str:
+    """
+    把用户文字、PDF 各页文字和各图片识别文字合并为交给工作流的文档
+    
+    PDF 各页和各图片直接作为片段参与一次 join，不先拼出 PDF/图片全文再嵌入：
+    几百页的 PDF 内存中只有各页文本和最终文档，不会再多出两份全文大小的中间字符串。
+    """
+    parts = []
+    if user_document:
+        parts.append(user_document)
+    if any(pdf_page_texts):
+        parts.append("--- PDF内容 ---")
+        parts.extend(pdf_page_texts)
+    if image_sections:
+        parts.append("--- 图片内容 ---")
+        parts.extend(image_sections)
+    return "\n\n".join(parts)
+
+
+def _image_extension(filename: Optional[str]) -> Optional[str]:
+    """返回文件名的小写扩展名（如 '.png'），不是支持的图片格式时返回 None"""
+    if not filename:
+        return None
+    dot = filename.rfind('.')
+    if dot < 0:
+        return None
+    ext = filename[dot:].lower()
+    return ext if ext in _ALLOWED_IMAGE_EXTENSIONS else None
+
+
+def _needs_ocr(page_text: str) -> bool:
+    """页面文本层过少（扫描页/图片页）时需要走 Vision OCR"""
+    return len(page_text) < _PDF_TEXT_LAYER_MIN_CHARS
+
+
+def _start_pdf_page_renderer(
+    pdf_path: str,
+    page_indices: List[int]
+) -> Tuple[asyncio.Task, Dict[int, asyncio.Future]]:
+    """
+    启动后台渲染任务：在一个线程中按页码顺序逐页渲染需要 OCR 的页面（PDF 只打开一次），
+    每渲染完一页立即交给等待它的 OCR 任务，第 k 页的 Vision 调用不必等其余页面渲染完
+    
+    Args:
+        pdf_path: PDF 文件路径
+        page_indices: 需要渲染的页码（从 1 开始）
+        
+    Returns:
+        (渲染任务, 页码 -> 渲染结果 Future)；渲染失败的页面对应的 Future 会被设置异常
+    """
+    loop = asyncio.get_running_loop()
+    page_images = {idx: loop.create_future() for idx in page_indices}
+    stop_event = threading.Event()
+    
+    def set_page_image(idx: int, image_data: bytes) -> None:
+        # 等待该页的 OCR 任务可能已被取消（Future 随之取消）
+        if not page_images[idx].done():
+            page_images[idx].set_result(image_data)
+    
+    def render_pages() -> None:
+        page_iter = iter_pdf_pages_to_jpeg(
+            pdf_path, [idx - 1 for idx in page_indices], _PDF_RENDER_DPI, _PDF_RENDER_JPEG_QUALITY
+        )
+        for page_num, image_data in page_iter:
+            if stop_event.is_set():
+                break
+            loop.call_soon_threadsafe(set_page_image, page_num + 1, image_data)
+    
+    async def run() -> None:
+        try:
+            await asyncio.to_thread(render_pages)
+        except asyncio.CancelledError:
+            # 线程无法被强制中断，通知其在渲染完当前页后停止
+            stop_event.set()
+            for future in page_images.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Error rendering PDF pages: {str(e)}")
+        # 线程中投递的结果先于本回调执行，此时仍未完成的就是渲染失败的页面
+        for idx, future in page_images.items():
+            if not future.done():
+                future.set_exception(RuntimeError(f"页面 {idx} 渲染失败"))
+    
+    return asyncio.create_task(run()), page_images
+
+
+async def _cancel_tasks_on_disconnect(
+    request: Request,
+    tasks: List[asyncio.Task],
+    interval: float = 0.5
+) -> bool:
+    """
+    后台监听客户端连接，客户端断开时取消所有未完成的任务
+    
+    Returns:
+        客户端断开返回 True；任务全部完成前客户端一直在线返回 False
+    """
+    while not all(task.done() for task in tasks):
+        if await request.is_disconnected():
+            logger.warning("客户端已断开，取消未完成的处理任务")
+            for task in tasks:
+                task.cancel()
+            return True
+        await asyncio.sleep(interval)
+    return False
+
+
+@retry(
+    stop=stop_after_attempt(4),
+    wait=wait_exponential(multiplier=0.5, exp_base=4, max=8),
+    retry=retry_if_exception_type((RateLimitError, InternalServerError)),
+    reraise=True
+)
+async def _extract_text_with_retry(
+    vision_agent: VisionAgent,
+    image_data: bytes,
+    text_prompt: str
+) -> dict:
+    """
+    带重试机制的 Vision OCR 调用（限流 429 / 服务端过载时按 0.5s、2s、8s 退避重试）
+    
+    每次尝试单独占用全局并发名额，退避等待期间释放，不阻塞其他图片的识别
+    """
+    async with _vision_semaphore:
+        return await vision_agent.extract_text_from_image(
+            image=image_data,
+            text_prompt=text_prompt,
+            temperature=_OCR_TEMPERATURE,
+            max_tokens=_OCR_MAX_TOKENS,
+            model=None
+        )
+
+
+@retry(
+    stop=stop_after_attempt(4),
+    wait=wait_exponential(multiplier=0.5, exp_base=4, max=8),
+    retry=retry_if_exception_type((RateLimitError, InternalServerError)),
+    reraise=True
+)
+async def _extract_texts_batch_with_retry(
+    vision_agent: VisionAgent,
+    images: List[bytes],
+    text_prompt: str
+) -> dict:
+    """
+    带重试机制的多图 Vision OCR 调用（一次请求识别多张图片，重试策略及并发名额占用同 _extract_text_with_retry）
+    """
+    async with _vision_semaphore:
+        return await vision_agent.extract_text_from_images_batch(
+            images=images,
+            text_prompt=text_prompt,
+            temperature=_OCR_TEMPERATURE,
+            max_tokens=_OCR_MAX_TOKENS,
+            model=None
+        )
+
+
+async def _call_vision_ocr(
+    vision_agent: VisionAgent,
+    image_data: bytes,
+    text_prompt: str,
+    cache_key: str
+) -> dict:
+    """调用 Vision 提取图片文字（受全局并发上限约束）并写入 OCR 缓存"""
+    result = await _extract_text_with_retry(vision_agent, image_data, text_prompt)
+    await set_cached_ocr(cache_key, result["response"], result.get("usage"))
+    return result
+
+
+async def _extract_text_uncached(
+    vision_agent: VisionAgent,
+    image_data: bytes,
+    text_prompt: str,
+    cache_key: str
+) -> dict:
+    """
+    未命中缓存时调用 Vision 提取图片文字
+    
+    同一缓存键已有进行中的调用（其他请求/用户正在识别同一张图片）时等待其结果，
+    与命中缓存一样返回空 usage，不重复计费
+    """
+    result, shared = await _ocr_single_flight.do(
+        cache_key, lambda: _call_vision_ocr(vision_agent, image_data, text_prompt, cache_key)
+    )
+    if shared:
+        logger.info("Vision OCR joined an in-flight request for the same image")
+        return {"response": result["response"], "usage": {}}
+    return result
+
+
+async def _extract_text_cached(
+    vision_agent: VisionAgent,
+    image_data: bytes,
+    text_prompt: str
+) -> dict:
+    """
+    使用 Vision Agent 提取图片文字，按图片内容查找 OCR 缓存
+    
+    命中缓存时跳过 Vision 调用，返回的 usage 为空（不重复计费）；
+    未命中时受全局并发上限约束
+    """
+    cache_key = ocr_cache_key(image_data, text_prompt, None, _OCR_TEMPERATURE)
+    cached_text = await get_cached_ocr(cache_key)
+    if cached_text is not None:
+        logger.info("Vision OCR cache hit")
+        return {"response": cached_text, "usage": {}}
+    
+    return await _extract_text_uncached(vision_agent, image_data, text_prompt, cache_key)
+
+
+async def _extract_uncached_texts(
+    vision_agent: VisionAgent,
+    pending: List[Tuple[bytes, str]],
+    text_prompt: str
+) -> List[Union[dict, BaseException]]:
+    """
+    识别未命中缓存的图片 (图片数据, 缓存键)，多于一张时合并为一次多图 Vision 调用
+    
+    合并调用的 usage 计入第一张图片；批量结果无法按图片拆分或调用失败时回退为逐张调用。
+    """
+    if len(pending) > 1:
+        try:
+            batch_result = await _extract_texts_batch_with_retry(
+                vision_agent, [image_data for image_data, _ in pending], text_prompt
+            )
+        except Exception as e:
+            logger.warning(f"Batch OCR for {len(pending)} images failed, falling back to per-image: {str(e)}")
+        else:
+            results = []
+            usage = batch_result.get("usage", {})
+            for (_, cache_key), text in zip(pending, batch_result["responses"]):
+                await set_cached_ocr(cache_key, text)
+                results.append({"response": text, "usage": usage})
+                usage = {}
+            return results
+    
+    return await asyncio.gather(
+        *(_extract_text_uncached(vision_agent, image_data, text_prompt, cache_key)
+          for image_data, cache_key in pending),
+        return_exceptions=True
+    )
+
+
+async def _extract_texts_batched(
+    vision_agent: VisionAgent,
+    images: List[bytes],
+    text_prompt: str
+) -> List[Union[dict, BaseException]]:
+    """
+    提取多张图片的文字，未命中缓存的图片多于一张时合并为一次多图 Vision 调用
+    
+    其他请求正在识别的图片不放进合并调用，而是等待那次调用的结果（见 _extract_text_uncached），
+    与合并调用同时进行。
+    
+    Returns:
+        与 images 顺序一致的结果列表，每项为 {"response", "usage"} 字典，逐张调用失败时为对应的异常
+    """
+    results: List[Union[dict, BaseException]] = [None] * len(images)
+    pending = []
+    joined = []
+    for position, image_data in enumerate(images):
+        cache_key = ocr_cache_key(image_data, text_prompt, None, _OCR_TEMPERATURE)
+        cached_text = await get_cached_ocr(cache_key)
+        if cached_text is not None:
+            results[position] = {"response": cached_text, "usage": {}}
+        elif cache_key in _ocr_single_flight:
+            joined.append((position, image_data, cache_key))
+        else:
+            pending.append((position, image_data, cache_key))
+    
+    pending_results, joined_results = await asyncio.gather(
+        _extract_uncached_texts(vision_agent, [(image_data, cache_key) for _, image_data, cache_key in pending], text_prompt),
+        asyncio.gather(
+            *(_extract_text_uncached(vision_agent, image_data, text_prompt, cache_key)
+              for _, image_data, cache_key in joined),
+            return_exceptions=True
+        )
+    )
+    for (position, _, _), result in zip(pending + joined, pending_results + joined_results):
+        results[position] = result
+    return results
+
+
+async def _ocr_pdf_page_batch(
+    vision_agent: VisionAgent,
+    page_images: Dict[int, asyncio.Future],
+    batch: List[int]
+) -> List[Tuple[int, str, dict]]:
+    """
+    识别一组需要 OCR 的 PDF 页面：等待这些页面渲染完成后一起交给 _extract_texts_batched
+    
+    Returns:
+        各页的 (页面索引, 文字内容, usage字典)；渲染或识别失败的页面为错误标记
+    """
+    rendered = await asyncio.gather(*(page_images[idx] for idx in batch), return_exceptions=True)
+    
+    results = []
+    ocr_pages = []
+    for idx, image_data in zip(batch, rendered):
+        if isinstance(image_data, BaseException):
+            logger.error(f"Error processing page {idx}: {str(image_data)}")
+            results.append((idx, f"[页面 {idx} 处理失败: {str(image_data)}]", {}))
+        else:
+            ocr_pages.append((idx, image_data))
+    
+    ocr_results = await _extract_texts_batched(
+        vision_agent, [image_data for _, image_data in ocr_pages], _OCR_TEXT_PROMPT
+    )
+    for (idx, _), result in zip(ocr_pages, ocr_results):
+        if isinstance(result, BaseException):
+            logger.error(f"Error processing page {idx}: {str(result)}")
+            results.append((idx, f"[页面 {idx} 处理失败: {str(result)}]", {}))
+        else:
+            results.append((idx, result["response"], result.get("usage", {})))
+    return results
+
+
+def _batch_pdf_ocr_pages(page_indices: List[int]) -> List[List[int]]:
+    """按 vision_batch_size 把需要 OCR 的页码切分为批次（每批一次 Vision 调用）"""
+    batch_size = max(1, settings.vision_batch_size)
+    return [page_indices[i:i + batch_size] for i in range(0, len(page_indices), batch_size)]
+
+
+def _image_content_key(image_data: bytes) -> bytes:
+    """上传图片的内容哈希（用于识别同一请求内重复上传的图片）"""
+    return hashlib.blake2b(image_data, digest_size=16).digest()
+
+
+async def _downscale_and_extract_text(
+    vision_agent: VisionAgent,
+    image_data: bytes,
+    text_prompt: str
+) -> dict:
+    """超大图片先缩小（session 中保存的仍是原图），再使用 Vision Agent 提取文字（查找 OCR 缓存）"""
+    ocr_image = await asyncio.to_thread(
+        downscale_image, image_data, _IMAGE_MAX_DIMENSION, _IMAGE_JPEG_QUALITY
+    )
+    return await _extract_text_cached(vision_agent, ocr_image, text_prompt)
+
+
+async def _extract_text_deduplicated(
+    inflight: Dict[bytes, asyncio.Task],
+    vision_agent: VisionAgent,
+    image_data: bytes,
+    text_prompt: str
+) -> dict:
+    """
+    同一请求内内容相同的上传图片（如重复上传的同一张图）只缩放、识别一次，结果共享
+    
+    inflight 为本次请求内"原图内容哈希 -> OCR 任务"的映射，按上传的原始内容计算，
+    重复图片不必再解码缩放；重复图片等待首个任务的结果，usage 为空，避免重复计费
+    """
+    key = _image_content_key(image_data)
+    task = inflight.get(key)
+    if task is not None:
+        logger.info("Duplicate image in request, reusing its OCR result")
+        result = await asyncio.shield(task)
+        return {"response": result["response"], "usage": {}}
+    
+    task = asyncio.ensure_future(_downscale_and_extract_text(vision_agent, image_data, text_prompt))
+    inflight[key] = task
+    return await task
+
+
+def _count_running_workflows(db: Session, user_id: str) -> int:
+    """统计用户当前运行中的 workflow 数量"""
+    return db.execute(
+        select(func.count()).select_from(Task).where(
+            Task.user_id == user_id,
+            Task.status == "running"
+        )
+    ).scalar_one()
+
+
+def _start_pending_task(db: Session, task_id: str, user_id: str, max_concurrent: int) -> Optional[Task]:
+    """
+    原子地将 pending 任务切换为 running，同时校验运行中任务数未达上限
+    
+    先锁住用户行，使同一用户的并发启动请求串行执行；随后的条件 UPDATE 在新的语句快照中统计
+    running 数量，不会出现两个请求都通过检查的情况。
+    
+    Returns:
+        更新后的任务对象；任务不存在、不是 pending 或已达并发上限时返回 None
+    """
+    db.execute(select(User.id).where(User.id == user_id).with_for_update())
+    
+    running_count = select(func.count()).select_from(Task).where(
+        Task.user_id == user_id,
+        Task.status == "running"
+    ).scalar_subquery()
+    
+    task = db.execute(
+        update(Task)
+        .where(
+            Task.id == task_id,
+            Task.user_id == user_id,
+            Task.status == "pending",
+            running_count < max_concurrent
+        )
+        .values(status="running", current_step="正在初始化工作流...")
+        .returning(Task)
+        .execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+    db.commit()
+    if task is not None:
+        invalidate_task_list_cache(user_id)
+    return task
+
+
+def _get_task_start_state(db: Session, task_id: str, user_id: str) -> Tuple[Optional[str], int]:
+    """
+    一次查询同时取出任务状态和用户运行中的 workflow 数量，用于说明任务启动失败的原因
+    
+    Returns:
+        (任务状态, 运行中任务数)；任务不存在或不属于该用户时状态为 None
+    """
+    task_status = select(Task.status).where(
+        Task.id == task_id,
+        Task.user_id == user_id
+    ).scalar_subquery()
+    running_count = select(func.count()).select_from(Task).where(
+        Task.user_id == user_id,
+        Task.status == "running"
+    ).scalar_subquery()
+    
+    row = db.execute(select(task_status, running_count)).one()
+    return row[0], row[1]
+
+
+def _commit_task_state(db: Session, task_id: Optional[str] = None, **task_values) -> bool:
+    """
+    用一条 UPDATE 写入任务状态并提交事务
+    
+    会话中只 flush 未提交的 token 使用记录（commit=False）和余额扣减随同一事务一次提交；
+    task_id 为 None 时只提交这些挂起的写入。提交失败时回滚并记录日志，不向上抛出。
+    
+    Returns:
+        是否提交成功
+    """
+    owner_id = None
+    try:
+        if task_id is not None:
+            # RETURNING 顺带取回任务所属用户，用于失效其任务列表缓存，无需额外查询
+            owner_id = db.execute(
+                update(Task).where(Task.id == task_id).values(**task_values).returning(Task.user_id)
+            ).scalar_one_or_none()
+        db.commit()
+    except Exception as e:
+        logger.error(f"Failed to commit task state (task_id={task_id}): {str(e)}")
+        db.rollback()
+        return False
+    if owner_id is not None:
+        invalidate_task_list_cache(owner_id)
+    if task_id is not None:
+        logger.info(f"Updated task {task_id} status to {task_values.get('status')}")
+    return True
+
+
+def _settle_and_complete_task(
+    db: Session,
+    user_id: str,
+    session_id: str,
+    task_id: Optional[str],
+    final_result: PaperGenerationWorkflowResponse
+) -> None:
+    """结算流式工作流的 token 并把任务标记为 completed，与工作流各阶段的 token 记录在同一事务中提交"""
+    total_tokens = (final_result.total_usage or {}).get("total_tokens", 0)
+    if total_tokens > 0:
+        try:
+            settlement = settle_token_usage(
+                db=db,
+                user_id=user_id,
+                total_tokens=total_tokens,
+                session_id=session_id,
+                commit=False
+            )
+            logger.info(
+                f"Token settlement completed (stream): previous_balance={settlement['previous_balance']}, "
+                f"tokens_used={settlement['tokens_used']}, new_balance={settlement['new_balance']}, "
+                f"is_overdraft={settlement['is_overdraft']}"
+            )
+        except Exception as e:
+            logger.error(f"Failed to settle token usage (stream): {str(e)}")
+            # 不抛出异常，允许流程完成
+    
+    if task_id is None:
+        _commit_task_state(db)
+        return
+    
+    from datetime import datetime
+    _commit_task_state(
+        db,
+        task_id,
+        status="completed",
+        completed_at=datetime.now(),
+        result_data=final_result.model_dump(),
+        current_step="工作流执行完成"
+    )
+
 
 @router.post("/execute", response_model=PaperGenerationWorkflowResponse)
 async def execute_workflow(
+    request: Request,
     document: Optional[str] = Form(None, description="用户提供的文字描述"),
     pdf_file: Optional[UploadFile] = File(None, description="用户上传的PDF文件"),
     image_files: Optional[List[UploadFile]] = File(None, description="用户上传的图片文件（支持多张）"),
@@ -73,12 +736,16 @@ async def execute_workflow(
     - session/uploaded: 上传的文件（PDF、图片等）
     - session/generated: 生成的文件（概览、LaTeX、清单等）
     """
+    temp_pdf_dir = None
+    temp_pdf_path = None
+    # 后台监听客户端连接：断开后立即取消整个请求的处理（包括正在进行的 Vision 调用和工作流生成），
+    # 而不是等全部处理完才发现，避免为已离开的客户端继续消耗 token
+    disconnect_watcher = asyncio.create_task(
+        _cancel_tasks_on_disconnect(request, [asyncio.current_task()])
+    )
     try:
         # 检查用户当前运行中的workflow数量
-        running_workflows_count = db.query(Task).filter(
-            Task.user_id == current_user.id,
-            Task.status == "running"
-        ).count()
+        running_workflows_count = _count_running_workflows(db, current_user.id)
         
         max_concurrent = current_user.max_concurrent_workflows or 10
         if running_workflows_count >= max_concurrent:
@@ -88,12 +755,13 @@ async def execute_workflow(
             )
         
         # 创建session文件夹（如果还没有创建），使用当前用户名
-        session_folder = create_session_folder(session_id, username=current_user.username)
+        session_folder = await asyncio.to_thread(create_session_folder, session_id, username=current_user.username)
+        _invalidate_sessions_cache(current_user.username)
         
         # 处理用户输入
         user_document = document or ""
-        pdf_text_content = ""
-        image_text_content = ""
+        pdf_page_texts: List[str] = []
+        image_texts: List[str] = []
         has_pdf = False
         pdf_session_folder = None
         
@@ -104,177 +772,80 @@ async def execute_workflow(
             if not pdf_file.filename.endswith('.pdf'):
                 raise HTTPException(status_code=400, detail="上传的文件必须是PDF格式")
             
-            # 读取PDF内容
-            pdf_content = await pdf_file.read()
+            # 分块写入临时目录（工作流结束后清理），不把整个 PDF 读入内存
+            temp_pdf_dir, temp_pdf_path, pdf_size = await _stream_upload_to_temp_dir(pdf_file, '.pdf')
+            
+            logger.info(f"Received PDF file: {pdf_file.filename}, size: {pdf_size} bytes")
+            
+            # 先提取各页文本层：文本足够的页面直接使用，只有扫描页才渲染为图片走 Vision OCR
+            page_texts = await _load_pdf_page_texts(temp_pdf_path)
+            
+            if not page_texts:
+                raise HTTPException(status_code=500, detail="PDF解析失败")
+            
+            ocr_page_indices = [idx for idx, page_text in enumerate(page_texts, 1) if _needs_ocr(page_text)]
+            ocr_page_count = len(ocr_page_indices)
+            logger.info(f"PDF has {len(page_texts)} pages, {ocr_page_count} of them need OCR")
             
-            # 创建临时文件处理PDF
-            temp_pdf_path = None
-            temp_output_dir = None
+            # 逐页渲染与 Vision OCR 流水线并行：每渲染完一批页面，该批的 OCR 即可开始
+            render_task, page_images = _start_pdf_page_renderer(temp_pdf_path, ocr_page_indices)
             
+            # 文本层足够的页面直接使用；需要 OCR 的页面按批次由固定数量的 worker 按页码顺序处理，
+            # 结果按页面索引放回原位（保持顺序）。客户端断开时整个请求被取消，未完成的批次随 worker 一并取消
+            results = [(idx, page_text, {}) for idx, page_text in enumerate(page_texts, 1)]
             try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
-                    temp_pdf.write(pdf_content)
-                    temp_pdf_path = temp_pdf.name
-                
-                logger.info(f"Received PDF file: {pdf_file.filename}, size: {len(pdf_content)} bytes")
-                
-                # 创建临时输出目录用于PDF转PNG
-                temp_output_dir = tempfile.mkdtemp(prefix="pdf_pngs_")
-                
-                # 将PDF转换为PNG
-                png_paths = pdf_to_pngs(
-                    pdf_path=temp_pdf_path,
-                    output_dir=temp_output_dir,
-                    dpi=300
+                batch_results = await bounded_map(
+                    _batch_pdf_ocr_pages(ocr_page_indices),
+                    lambda batch: _ocr_pdf_page_batch(vision_agent, page_images, batch),
+                    settings.vision_max_concurrency
                 )
-                
-                if not png_paths:
-                    raise HTTPException(status_code=500, detail="PDF转PNG失败")
-                
-                logger.info(f"Converted PDF to {len(png_paths)} PNG files")
-                
-                # 提取文字内容
-                text_prompt = "请直接输出图片中的所有文字内容、图表、表格、公式等，不要添加任何描述、说明或解释。保持原有的结构和格式信息。"
-                
-                async def process_single_page(idx: int, png_path: str) -> Tuple[int, str, dict]:
-                    try:
-                        # 检查客户端是否断开
-                        if await request.is_disconnected():
-                            logger.warning(f"客户端已断开，取消页面 {idx} 的处理")
-                            raise asyncio.CancelledError("客户端已断开连接")
-                        
-                        result = await vision_agent.extract_text_from_image(
-                            image=png_path,
-                            text_prompt=text_prompt,
-                            temperature=0.3,
-                            max_tokens=4096,
-                            model=None
-                        )
-                        return (idx, result["response"], result.get("usage", {}))
-                    except asyncio.CancelledError:
-                        logger.info(f"页面 {idx} 处理被取消（客户端断开）")
-                        raise
-                    except Exception as e:
-                        logger.error(f"Error processing page {idx}: {str(e)}")
-                        return (idx, f"[页面 {idx} 处理失败: {str(e)}]", {})
-                
-                # 并发处理所有页面，使用 asyncio.Task 以便可以取消
-                page_tasks = [
-                    asyncio.create_task(process_single_page(idx, png_path)) 
-                    for idx, png_path in enumerate(png_paths, 1)
-                ]
-                
-                try:
-                    # 等待所有任务完成，但如果客户端断开则取消
-                    results = await asyncio.gather(*page_tasks, return_exceptions=True)
-                    
-                    # 检查是否有客户端断开的情况
-                    if await request.is_disconnected():
-                        logger.warning("客户端已断开，取消剩余的PDF页面处理任务")
-                        # 取消所有未完成的任务
-                        for task in page_tasks:
-                            if not task.done():
-                                task.cancel()
-                        raise asyncio.CancelledError("客户端已断开连接")
-                    
-                    # 处理结果，过滤掉异常
-                    valid_results = []
-                    for result in results:
-                        if isinstance(result, Exception):
-                            if isinstance(result, asyncio.CancelledError):
-                                logger.info("部分PDF页面处理被取消")
-                                continue
-                            logger.error(f"PDF页面处理异常: {result}")
-                            continue
-                        valid_results.append(result)
-                    
-                    results = valid_results
-                    results.sort(key=lambda x: x[0])
-                    
-                except asyncio.CancelledError:
-                    logger.info("PDF页面处理被取消（客户端断开）")
-                    # 取消所有任务
-                    for task in page_tasks:
-                        if not task.done():
-                            task.cancel()
-                    # 等待任务取消完成
-                    await asyncio.gather(*page_tasks, return_exceptions=True)
-                    raise
-                
-                # 拼接所有页面的文字内容并汇总 token 使用量
-                page_descriptions = [result[1] for result in results]
-                pdf_text_content = "\n\n".join(page_descriptions)
-                
-                # 汇总所有页面的 token 使用量
-                total_pdf_usage = {
-                    "input_tokens": 0,
-                    "output_tokens": 0,
-                    "total_tokens": 0
-                }
-                for result in results:
-                    usage = result[2] if len(result) > 2 else {}
-                    if usage:
-                        total_pdf_usage["input_tokens"] += usage.get("input_tokens", 0)
-                        total_pdf_usage["output_tokens"] += usage.get("output_tokens", 0)
-                        total_pdf_usage["total_tokens"] += usage.get("total_tokens", 0)
-                
-                # 记录 PDF 处理的 token 使用
-                if total_pdf_usage["total_tokens"] > 0:
-                    try:
-                        # 获取模型名称（从 vision_agent 或使用默认值）
-                        model_name = None  # vision agent 会使用默认模型
-                        record_usage_from_dict(
-                            db=db,
-                            user_id=current_user.id,
-                            usage_dict={
-                                "prompt_tokens": total_pdf_usage["input_tokens"],
-                                "completion_tokens": total_pdf_usage["output_tokens"],
-                                "total_tokens": total_pdf_usage["total_tokens"]
-                            },
-                            model=model_name,
-                            stage="pdf_processing",
-                            session_id=session_id
-                        )
-                        logger.info(f"Recorded PDF processing token usage: {total_pdf_usage['total_tokens']} tokens")
-                    except Exception as e:
-                        logger.error(f"Failed to record PDF processing token usage: {str(e)}")
-                
-                logger.info(f"Extracted text from PDF: {len(pdf_text_content)} characters")
-                
+            except asyncio.CancelledError:
+                logger.info("PDF页面处理被取消（客户端断开）")
+                raise
             finally:
-                # 清理临时文件
-                import os
-                if temp_pdf_path and os.path.exists(temp_pdf_path):
-                    try:
-                        os.unlink(temp_pdf_path)
-                    except:
-                        pass
-                if temp_output_dir and os.path.exists(temp_output_dir):
-                    try:
-                        import shutil
-                        shutil.rmtree(temp_output_dir)
-                    except:
-                        pass
+                render_task.cancel()
+            for batch_result in batch_results:
+                for idx, page_description, usage in batch_result:
+                    results[idx - 1] = (idx, page_description, usage)
+            
+            # 收集所有页面的文字内容（合并文档时再统一拼接）并汇总 token 使用量
+            pdf_page_texts = [result[1] for result in results]
+            
+            # 汇总所有页面的 token 使用量
+            total_pdf_usage = _sum_vision_usage(result[2] for result in results)
+            
+            # 记录 PDF 处理的 token 使用
+            if total_pdf_usage["total_tokens"] > 0:
+                try:
+                    # 获取模型名称（从 vision_agent 或使用默认值）
+                    model_name = None  # vision agent 会使用默认模型
+                    record_usage_from_dict(
+                        db=db,
+                        user_id=current_user.id,
+                        usage_dict=_vision_usage_record(total_pdf_usage),
+                        model=model_name,
+                        stage="pdf_processing",
+                        session_id=session_id,
+                        commit=False  # 随工作流后续写入/结算一并提交
+                    )
+                    logger.info(f"Recorded PDF processing token usage: {total_pdf_usage['total_tokens']} tokens")
+                except Exception as e:
+                    logger.error(f"Failed to record PDF processing token usage: {str(e)}")
+            
+            logger.info(f"Extracted text from PDF: {_joined_length(pdf_page_texts)} characters")
         
         # 处理图片文件上传
         if image_files:
             logger.info(f"Received {len(image_files)} image files")
             
-            # 支持的图片格式
-            allowed_image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
-            
-            # 提取文字内容
-            text_prompt = "请直接输出图片中的所有文字内容、图表、表格、公式等，不要添加任何描述、说明或解释。保持原有的结构和格式信息。"
+            # 内容相同的图片只识别一次
+            inflight_ocr: Dict[bytes, asyncio.Task] = {}
             
             async def process_single_image(idx: int, image_file: UploadFile) -> Tuple[int, str, str, dict]:
                 """处理单张图片"""
                 try:
                     # 验证文件类型
-                    file_ext = None
-                    for ext in allowed_image_extensions:
-                        if image_file.filename and image_file.filename.lower().endswith(ext):
-                            file_ext = ext
-                            break
+                    file_ext = _image_extension(image_file.filename)
                     
                     if not file_ext:
                         logger.warning(f"Image {idx} ({image_file.filename}) has unsupported format, skipping")
@@ -285,7 +856,8 @@ async def execute_workflow(
                     
                     # 保存图片到session文件夹
                     image_filename = image_file.filename or f"image_{idx}{file_ext}"
-                    image_path = save_uploaded_file(
+                    await asyncio.to_thread(
+                        save_uploaded_file,
                         session_folder=session_folder,
                         file_name=image_filename,
                         content=image_content
@@ -293,14 +865,8 @@ async def execute_workflow(
                     
                     logger.info(f"Processing image {idx}/{len(image_files)}: {image_filename}")
                     
-                    # 使用 Vision Agent 提取文字
-                    result = await vision_agent.extract_text_from_image(
-                        image=image_path,
-                        text_prompt=text_prompt,
-                        temperature=0.3,
-                        max_tokens=4096,
-                        model=None
-                    )
+                    # 缩小超大图片并使用 Vision Agent 提取文字（重复图片复用首张的结果）
+                    result = await _extract_text_deduplicated(inflight_ocr, vision_agent, image_content, _OCR_TEXT_PROMPT)
                     
                     extracted_text = result["response"]
                     usage = result.get("usage", {})
@@ -312,32 +878,23 @@ async def execute_workflow(
                     logger.error(f"Error processing image {idx}: {str(e)}")
                     return (idx, f"[图片 {idx} 处理失败: {str(e)}]", "", {})
             
-            # 并发处理所有图片
-            tasks = [process_single_image(idx, img_file) for idx, img_file in enumerate(image_files, 1)]
-            image_results = await asyncio.gather(*tasks)
-            image_results.sort(key=lambda x: x[0])
+            # 固定数量的 worker 并发处理所有图片（结果按上传顺序返回）
+            image_results = await bounded_map(
+                list(enumerate(image_files, 1)),
+                lambda image: process_single_image(*image),
+                settings.vision_max_concurrency
+            )
             
-            # 拼接所有图片的文字内容并汇总 token 使用量
-            image_texts = []
-            total_image_usage = {
-                "input_tokens": 0,
-                "output_tokens": 0,
-                "total_tokens": 0
-            }
+            # 收集所有图片的文字内容并汇总 token 使用量
             for result in image_results:
                 idx = result[0]
                 text = result[1] if len(result) > 1 else ""
                 filename = result[2] if len(result) > 2 else ""
-                usage = result[3] if len(result) > 3 else {}
                 
                 if text:
                     image_texts.append(f"--- 图片 {idx}: {filename} ---\n\n{text}")
-                
-                # 累计 token 使用量
-                if usage:
-                    total_image_usage["input_tokens"] += usage.get("input_tokens", 0)
-                    total_image_usage["output_tokens"] += usage.get("output_tokens", 0)
-                    total_image_usage["total_tokens"] += usage.get("total_tokens", 0)
+            
+            total_image_usage = _sum_vision_usage(result[3] if len(result) > 3 else None for result in image_results)
             
             # 记录图片处理的 token 使用
             if total_image_usage["total_tokens"] > 0:
@@ -346,41 +903,26 @@ async def execute_workflow(
                     record_usage_from_dict(
                         db=db,
                         user_id=current_user.id,
-                        usage_dict={
-                            "prompt_tokens": total_image_usage["input_tokens"],
-                            "completion_tokens": total_image_usage["output_tokens"],
-                            "total_tokens": total_image_usage["total_tokens"]
-                        },
+                        usage_dict=_vision_usage_record(total_image_usage),
                         model=model_name,
                         stage="image_processing",
-                        session_id=session_id
+                        session_id=session_id,
+                        commit=False  # 随工作流后续写入/结算一并提交
                     )
                     logger.info(f"Recorded image processing token usage: {total_image_usage['total_tokens']} tokens")
                 except Exception as e:
                     logger.error(f"Failed to record image processing token usage: {str(e)}")
             
             if image_texts:
-                image_text_content = "\n\n".join(image_texts)
-                logger.info(f"Extracted text from images: {len(image_text_content)} characters")
+                logger.info(f"Extracted text from images: {_joined_length(image_texts)} characters")
         
         # 合并所有输入内容
-        content_parts = []
-        if user_document:
-            content_parts.append(user_document)
-        if pdf_text_content:
-            content_parts.append(f"--- PDF内容 ---\n\n{pdf_text_content}")
-        if image_text_content:
-            content_parts.append(f"--- 图片内容 ---\n\n{image_text_content}")
-        
-        if content_parts:
-            combined_document = "\n\n".join(content_parts)
-        else:
-            combined_document = ""
+        combined_document = _combine_document(user_document, pdf_page_texts, image_texts)
         
         if not combined_document.strip():
             raise HTTPException(status_code=400, detail="必须提供文字描述、上传PDF文件或上传图片文件")
         
-        # 执行工作流（直接传递PDF内容和文件名，避免文件关闭问题）
+        # 执行工作流（传递已落盘的PDF路径和文件名，避免文件关闭问题）
         result = await workflow.execute(
             user_document=combined_document,
             session_id=session_id,
@@ -390,14 +932,14 @@ async def execute_workflow(
             temperature=temperature,
             max_tokens=max_tokens,
             model=model,
-            pdf_content=pdf_content if pdf_file else None,  # 直接传递PDF字节内容
+            pdf_path=temp_pdf_path,  # 传递PDF临时文件路径，由工作流复制到 session 中
             pdf_filename=pdf_file.filename if pdf_file else None,  # 传递PDF文件名
             username=current_user.username,
             user_id=current_user.id,
             db_session=db
         )
         
-        # 结算token使用（在流程结束时扣除用户余额）
+        # 结算token使用（在流程结束时扣除用户余额，与工作流最后阶段的 token 记录在同一事务中提交）
         total_tokens = result.get("total_usage", {}).get("total_tokens", 0)
         if total_tokens > 0:
             try:
@@ -417,35 +959,32 @@ async def execute_workflow(
                 # 不抛出异常，允许流程完成
         
         # 转换为响应模型
-        return PaperGenerationWorkflowResponse(
-            session_id=result["session_id"],
-            session_folder=result["session_folder"],
-            paper_overview=PaperOverviewResult(
-                file_name=result["paper_overview"]["file_name"],
-                file_path=result["paper_overview"]["file_path"],
-                usage=result["paper_overview"].get("usage")
-            ),
-            latex_paper=LaTeXPaperResult(
-                file_name=result["latex_paper"].get("file_name"),
-                file_path=result["latex_paper"].get("file_path"),
-                is_skipped=result["latex_paper"]["is_skipped"],
-                skip_reason=result["latex_paper"].get("skip_reason"),
-                usage=result["latex_paper"].get("usage")
-            ),
-            requirement_checklist=RequirementChecklistResult(
-                file_name=result["requirement_checklist"]["file_name"],
-                file_path=result["requirement_checklist"]["file_path"],
-                usage=result["requirement_checklist"].get("usage")
-            ),
-            total_usage=result["total_usage"]
-        )
+        # 工作流结果中各部分的字典结构与响应模型一致，整体交给 model_validate 一次完成嵌套校验
+        return PaperGenerationWorkflowResponse.model_validate({
+            "session_id": result["session_id"],
+            "session_folder": result["session_folder"],
+            "paper_overview": result["paper_overview"],
+            "latex_paper": result["latex_paper"],
+            "requirement_checklist": result["requirement_checklist"],
+            "total_usage": result["total_usage"]
+        })
         
+    except asyncio.CancelledError:
+        logger.info("工作流执行被取消（客户端断开）")
+        raise
     except ValueError as e:
         logger.error(f"Workflow execution error: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Workflow execution error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        disconnect_watcher.cancel()
+        # 工作流中途失败时，已 flush 的 PDF/图片 token 使用记录仍需提交（正常结束时已随结算提交，这里为空操作）
+        _commit_task_state(db)
+        # 清理PDF临时目录（删除目录是阻塞的文件系统操作，放到线程中执行）
+        if temp_pdf_dir is not None:
+            await asyncio.to_thread(temp_pdf_dir.cleanup)
 
 
 @router.post("/execute/stream")
@@ -487,7 +1026,9 @@ async def execute_workflow_stream(
     流式响应会发送进度更新和日志信息。
     """
     # 在生成器函数外部读取文件内容，避免文件对象被提前关闭
-    pdf_content = None
+    temp_pdf_dir = None
+    temp_pdf_path = None
+    pdf_size = 0
     pdf_filename = None
     image_contents = []  # 存储所有图片的内容和文件名
     
@@ -503,10 +1044,10 @@ async def execute_workflow_stream(
             raise HTTPException(status_code=400, detail="上传的文件必须是PDF格式")
         
         try:
-            # 立即读取文件内容，在文件对象关闭之前
+            # 在文件对象关闭之前分块写入临时目录（生成器结束时清理），不把整个 PDF 读入内存
             pdf_filename = pdf_file.filename
-            pdf_content = await pdf_file.read()
-            logger.info(f"✓ PDF内容读取成功，大小: {len(pdf_content)} 字节")
+            temp_pdf_dir, temp_pdf_path, pdf_size = await _stream_upload_to_temp_dir(pdf_file, '.pdf')
+            logger.info(f"✓ PDF内容读取成功，大小: {pdf_size} 字节")
             logger.info(f"PDF文件名: {pdf_filename}")
             logger.info("=" * 80)
         except Exception as e:
@@ -519,119 +1060,81 @@ async def execute_workflow_stream(
     # 读取图片文件内容
     if image_files:
         logger.info(f"读取 {len(image_files)} 张图片文件...")
-        allowed_image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
         
-        for idx, image_file in enumerate(image_files):
+        async def read_image_file(idx: int, image_file: UploadFile) -> Optional[dict]:
+            """读取单张图片，格式不支持或读取失败时返回 None"""
             try:
                 # 验证文件类型
-                file_ext = None
-                if image_file.filename:
-                    for ext in allowed_image_extensions:
-                        if image_file.filename.lower().endswith(ext):
-                            file_ext = ext
-                            break
+                file_ext = _image_extension(image_file.filename)
                 
                 if not file_ext:
                     logger.warning(f"图片 {idx+1} ({image_file.filename}) 格式不支持，将跳过")
-                    continue
+                    return None
                 
                 image_content = await image_file.read()
-                image_contents.append({
+                logger.info(f"✓ 图片 {idx+1} 读取成功: {image_file.filename}, 大小: {len(image_content)} 字节")
+                return {
                     'filename': image_file.filename or f"image_{idx+1}{file_ext}",
                     'content': image_content,
                     'index': idx + 1
-                })
-                logger.info(f"✓ 图片 {idx+1} 读取成功: {image_file.filename}, 大小: {len(image_content)} 字节")
+                }
             except Exception as e:
                 logger.error(f"读取图片 {idx+1} 失败: {str(e)}")
                 import traceback
                 logger.error(f"错误堆栈: {traceback.format_exc()}")
+                return None
+        
+        # 并发读取所有图片（较大的上传已落盘在临时文件中，读取在线程池中进行）
+        read_results = await asyncio.gather(
+            *(read_image_file(idx, image_file) for idx, image_file in enumerate(image_files))
+        )
+        image_contents = [img_data for img_data in read_results if img_data is not None]
     
     async def generate_sse_stream():
+        # 后台监听客户端连接：断开后 0.5 秒内取消整个流式处理（包括正在进行的 Vision 调用及其子任务），
+        # 不依赖在各步骤之间轮询 request.is_disconnected()
+        disconnect_watcher = asyncio.create_task(
+            _cancel_tasks_on_disconnect(request, [asyncio.current_task()])
+        )
         try:
-            # 如果提供了 task_id，先尝试更新任务状态为 running（在检查并发数之前）
-            # 这样可以确保状态更新和并发数检查在同一事务中，避免竞态条件
-            task_db_obj = None
-            if task_id:
-                task_db_obj = db.query(Task).filter(
-                    Task.id == task_id,
-                    Task.user_id == current_user.id
-                ).first()
-                
-                if not task_db_obj:
-                    error_chunk = WorkflowProgressChunk(
-                        type="error",
-                        message=f"任务不存在或无权访问",
-                        done=True
-                    )
-                    yield f"data: {error_chunk.model_dump_json()}\n\n"
-                    return
-                
-                # 检查任务状态，只有 pending 状态的任务才能开始执行
-                if task_db_obj.status != "pending":
-                    error_chunk = WorkflowProgressChunk(
-                        type="error",
-                        message=f"任务状态为 {task_db_obj.status}，无法开始执行",
-                        done=True
-                    )
-                    yield f"data: {error_chunk.model_dump_json()}\n\n"
-                    return
-            
-            # 检查用户当前运行中的workflow数量
-            running_workflows_count = db.query(Task).filter(
-                Task.user_id == current_user.id,
-                Task.status == "running"
-            ).count()
-            
             max_concurrent = current_user.max_concurrent_workflows or 10
             
-            # 如果提供了 task_id，使用原子操作更新任务状态为 running
-            # 这样可以确保只有pending状态的任务才能被更新，避免竞态条件
-            if task_db_obj:
-                # 使用原子操作：只有pending状态的任务才能被更新为running
-                # 同时检查并发数限制
-                if running_workflows_count >= max_concurrent:
-                    error_chunk = WorkflowProgressChunk(
-                        type="error",
-                        message=f"已达到最大并发数限制（{running_workflows_count}/{max_concurrent}），请等待任务完成后再启动新任务",
-                        done=True
-                    )
-                    yield f"data: {error_chunk.model_dump_json()}\n\n"
-                    return
-                
-                # 原子更新：只有pending状态的任务才能被更新为running
-                updated_rows = db.query(Task).filter(
-                    Task.id == task_id,
-                    Task.user_id == current_user.id,
-                    Task.status == "pending"
-                ).update({
-                    "status": "running",
-                    "current_step": "正在初始化工作流..."
-                }, synchronize_session=False)
+            task_db_obj = None
+            final_result = None
+            if task_id:
+                # 一条条件 UPDATE 同时完成"任务属于当前用户且为 pending"和"运行中任务数未达上限"的判断，
+                # 并把任务切换为 running，正常路径只需一次往返
+                task_db_obj = _start_pending_task(db, task_id, current_user.id, max_concurrent)
                 
-                if updated_rows == 0:
-                    # 任务状态已经不是pending，可能已经被其他请求更新
+                if task_db_obj is None:
+                    # 更新失败时才额外查询一次（任务状态与运行中任务数合并为一条 SELECT），用于给出具体的错误原因
+                    existing_status, running_workflows_count = _get_task_start_state(db, task_id, current_user.id)
+                    if existing_status is None:
+                        message = "任务不存在或无权访问"
+                    elif existing_status != "pending":
+                        message = f"任务状态为 {existing_status}，无法开始执行"
+                    else:
+                        message = f"已达到最大并发数限制（{running_workflows_count}/{max_concurrent}），请等待任务完成后再启动新任务"
+                    
                     error_chunk = WorkflowProgressChunk(
                         type="error",
-                        message=f"任务状态已变更，无法开始执行",
+                        message=message,
                         done=True
                     )
-                    yield f"data: {error_chunk.model_dump_json()}\n\n"
+                    yield _sse(error_chunk)
                     return
                 
-                db.commit()
-                # 刷新对象以获取最新状态
-                db.refresh(task_db_obj)
                 logger.info(f"Updated task {task_id} status to running (atomic update)")
             else:
                 # 如果没有提供task_id，只检查并发数
+                running_workflows_count = _count_running_workflows(db, current_user.id)
                 if running_workflows_count >= max_concurrent:
                     error_chunk = WorkflowProgressChunk(
                         type="error",
                         message=f"已达到最大并发数限制（{running_workflows_count}/{max_concurrent}），请等待任务完成后再启动新任务",
                         done=True
                     )
-                    yield f"data: {error_chunk.model_dump_json()}\n\n"
+                    yield _sse(error_chunk)
                     return
             
             logger.info("=" * 80)
@@ -639,160 +1142,95 @@ async def execute_workflow_stream(
             logger.info(f"PDF文件: {pdf_filename if pdf_filename else 'None'}")
             logger.info(f"文档内容长度: {len(document) if document else 0}")
             
-            # 检查客户端是否断开
-            if await request.is_disconnected():
-                logger.warning("客户端在开始处理前已断开")
-                return
-            
             # 创建session文件夹（确保使用同一个session），使用当前用户名
             from app.utils.file_manager import create_session_folder
-            session_folder = create_session_folder(session_id, username=current_user.username)
+            session_folder = await asyncio.to_thread(create_session_folder, session_id, username=current_user.username)
+            _invalidate_sessions_cache(current_user.username)
             # 获取实际的 session_id（如果之前是 None，现在会有新生成的 ID）
             actual_session_id = session_folder.name
             logger.info(f"使用 session_folder: {session_folder}, session_id: {actual_session_id}")
             
             # 处理用户输入
             user_document = document or ""
-            pdf_text_content = ""
-            image_text_content = ""
+            pdf_page_texts: List[str] = []
+            image_texts: List[str] = []
             has_pdf = False
             
             # 处理PDF文件上传（使用外部读取的内容）
-            if pdf_content and pdf_filename:
-                # 检查客户端是否断开
-                if await request.is_disconnected():
-                    logger.warning("客户端已断开，取消PDF处理")
-                    return
-                
+            if temp_pdf_path and pdf_filename:
                 logger.info(f"使用已读取的PDF文件: {pdf_filename}")
-                logger.info(f"PDF内容大小: {len(pdf_content)} 字节")
+                logger.info(f"PDF内容大小: {pdf_size} 字节")
                 has_pdf = True
                 
-                # 创建临时文件处理PDF
-                temp_pdf_path = None
-                temp_output_dir = None
+                yield _sse_log(f'正在处理PDF文件: {pdf_filename}')
                 
+                # 先提取各页文本层：文本足够的页面直接使用，只有扫描页才渲染为图片走 Vision OCR
+                page_texts = await _load_pdf_page_texts(temp_pdf_path)
+                
+                if not page_texts:
+                    yield _SSE_PDF_PARSE_ERROR
+                    return
+                
+                ocr_page_indices = [idx for idx, page_text in enumerate(page_texts, 1) if _needs_ocr(page_text)]
+                ocr_page_count = len(ocr_page_indices)
+                yield _sse_log(f'PDF共 {len(page_texts)} 页，其中 {ocr_page_count} 页需要识别图片，正在提取文字...')
+                
+                # 逐页渲染与 Vision OCR 流水线并行：每渲染完一批页面，该批的 OCR 即可开始
+                render_task, page_images = _start_pdf_page_renderer(temp_pdf_path, ocr_page_indices)
+                
+                # 文本层足够的页面直接使用；需要 OCR 的页面按批次由固定数量的 worker 按页码顺序处理，
+                # 按完成顺序推送 OCR 进度，结果按页面索引放回原位（保持顺序）
+                results = [(idx, page_text, {}) for idx, page_text in enumerate(page_texts, 1)]
+                ocr_done_count = 0
                 try:
-                    yield f"data: {WorkflowProgressChunk(type='log', message=f'正在处理PDF文件: {pdf_filename}', done=False).model_dump_json()}\n\n"
-                    
-                    # 再次检查客户端是否断开
-                    if await request.is_disconnected():
-                        logger.warning("客户端已断开，取消PDF处理")
-                        return
-                    
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
-                        temp_pdf.write(pdf_content)
-                        temp_pdf_path = temp_pdf.name
-                    
-                    # 创建临时输出目录用于PDF转PNG
-                    temp_output_dir = tempfile.mkdtemp(prefix="pdf_pngs_")
-                    
-                    yield f"data: {WorkflowProgressChunk(type='log', message='正在将PDF转换为图片...', done=False).model_dump_json()}\n\n"
-                    
-                    # 将PDF转换为PNG
-                    png_paths = pdf_to_pngs(
-                        pdf_path=temp_pdf_path,
-                        output_dir=temp_output_dir,
-                        dpi=300
-                    )
-                    
-                    if not png_paths:
-                        error_chunk = WorkflowProgressChunk(
-                            type="log",
-                            message="错误: PDF转PNG失败",
-                            done=True
-                        )
-                        yield f"data: {error_chunk.model_dump_json()}\n\n"
-                        return
-                    
-                    yield f"data: {WorkflowProgressChunk(type='log', message=f'PDF已转换为 {len(png_paths)} 张图片，正在提取文字...', done=False).model_dump_json()}\n\n"
-                    
-                    # 提取文字内容
-                    text_prompt = "请直接输出图片中的所有文字内容、图表、表格、公式等，不要添加任何描述、说明或解释。保持原有的结构和格式信息。"
-                    
-                    async def process_single_page(idx: int, png_path: str) -> Tuple[int, str, dict]:
-                        try:
-                            result = await vision_agent.extract_text_from_image(
-                                image=png_path,
-                                text_prompt=text_prompt,
-                                temperature=0.3,
-                                max_tokens=4096,
-                                model=None
-                            )
-                            return (idx, result["response"], result.get("usage", {}))
-                        except Exception as e:
-                            logger.error(f"Error processing page {idx}: {str(e)}")
-                            return (idx, f"[页面 {idx} 处理失败: {str(e)}]", {})
-                    
-                    # 并发处理所有页面
-                    tasks = [process_single_page(idx, png_path) for idx, png_path in enumerate(png_paths, 1)]
-                    results = await asyncio.gather(*tasks)
-                    results.sort(key=lambda x: x[0])
-                    
-                    # 拼接所有页面的文字内容并汇总 token 使用量
-                    page_descriptions = [result[1] for result in results]
-                    pdf_text_content = "\n\n".join(page_descriptions)
-                    
-                    # 汇总所有页面的 token 使用量
-                    total_pdf_usage = {
-                        "input_tokens": 0,
-                        "output_tokens": 0,
-                        "total_tokens": 0
-                    }
-                    for result in results:
-                        usage = result[2] if len(result) > 2 else {}
-                        if usage:
-                            total_pdf_usage["input_tokens"] += usage.get("input_tokens", 0)
-                            total_pdf_usage["output_tokens"] += usage.get("output_tokens", 0)
-                            total_pdf_usage["total_tokens"] += usage.get("total_tokens", 0)
-                    
-                    # 记录 PDF 处理的 token 使用
-                    if total_pdf_usage["total_tokens"] > 0:
-                        try:
-                            model_name = None  # vision agent 会使用默认模型
-                            record_usage_from_dict(
-                                db=db,
-                                user_id=current_user.id,
-                                usage_dict={
-                                    "prompt_tokens": total_pdf_usage["input_tokens"],
-                                    "completion_tokens": total_pdf_usage["output_tokens"],
-                                    "total_tokens": total_pdf_usage["total_tokens"]
-                                },
-                                model=model_name,
-                                stage="pdf_processing",
-                                session_id=actual_session_id
-                            )
-                            logger.info(f"Recorded PDF processing token usage (stream): {total_pdf_usage['total_tokens']} tokens")
-                        except Exception as e:
-                            logger.error(f"Failed to record PDF processing token usage (stream): {str(e)}")
-                    
-                    yield f"data: {WorkflowProgressChunk(type='log', message=f'✓ PDF文字提取完成，共 {len(pdf_text_content)} 字符', done=False).model_dump_json()}\n\n"
-                    
+                    async with aclosing(bounded_as_completed(
+                        _batch_pdf_ocr_pages(ocr_page_indices),
+                        lambda batch: _ocr_pdf_page_batch(vision_agent, page_images, batch),
+                        settings.vision_max_concurrency
+                    )) as completed_batches:
+                        async for _, batch_result in completed_batches:
+                            for idx, page_description, usage in batch_result:
+                                results[idx - 1] = (idx, page_description, usage)
+                                ocr_done_count += 1
+                                yield _sse_log(f'PDF页面 {idx} 识别完成（{ocr_done_count}/{ocr_page_count}）')
                 finally:
-                    # 清理临时文件
-                    import os
-                    if temp_pdf_path and os.path.exists(temp_pdf_path):
-                        try:
-                            os.unlink(temp_pdf_path)
-                        except:
-                            pass
-                    if temp_output_dir and os.path.exists(temp_output_dir):
-                        try:
-                            import shutil
-                            shutil.rmtree(temp_output_dir)
-                        except:
-                            pass
+                    # 客户端断开时生成器被取消，一并取消渲染任务（页面 worker 随 aclosing 取消）
+                    render_task.cancel()
+                
+                # 收集所有页面的文字内容（合并文档时再统一拼接）并汇总 token 使用量
+                pdf_page_texts = [result[1] for result in results]
+                
+                # 汇总所有页面的 token 使用量
+                total_pdf_usage = _sum_vision_usage(result[2] for result in results)
+                
+                # 记录 PDF 处理的 token 使用
+                if total_pdf_usage["total_tokens"] > 0:
+                    try:
+                        model_name = None  # vision agent 会使用默认模型
+                        record_usage_from_dict(
+                            db=db,
+                            user_id=current_user.id,
+                            usage_dict=_vision_usage_record(total_pdf_usage),
+                            model=model_name,
+                            stage="pdf_processing",
+                            session_id=actual_session_id,
+                            commit=False  # 随工作流后续写入/结算一并提交
+                        )
+                        logger.info(f"Recorded PDF processing token usage (stream): {total_pdf_usage['total_tokens']} tokens")
+                    except Exception as e:
+                        logger.error(f"Failed to record PDF processing token usage (stream): {str(e)}")
+                
+                yield _sse_log(f'✓ PDF文字提取完成，共 {_joined_length(pdf_page_texts)} 字符')
             
             # 处理图片文件上传（使用外部读取的内容）
             if image_contents:
-                # 检查客户端是否断开
-                if await request.is_disconnected():
-                    logger.warning("客户端已断开，取消图片处理")
-                    return
-                
-                yield f"data: {WorkflowProgressChunk(type='log', message=f'正在处理 {len(image_contents)} 张图片...', done=False).model_dump_json()}\n\n"
+                yield _sse_log(f'正在处理 {len(image_contents)} 张图片...')
                 
-                text_prompt = "请直接输出图片中的所有文字内容、图表、表格、公式等，不要添加任何描述、说明或解释。保持原有的结构和格式信息。"
+                # 内容相同的图片只识别一次
+                inflight_ocr: Dict[bytes, asyncio.Task] = {}
+                duplicate_count = len(image_contents) - len({_image_content_key(img['content']) for img in image_contents})
+                if duplicate_count:
+                    yield _sse_log(f'其中 {duplicate_count} 张图片与其他图片内容相同，将复用识别结果')
                 
                 async def process_single_image_stream(img_data: dict) -> Tuple[int, str, str, dict]:
                     """处理单张图片（流式版本）"""
@@ -801,13 +1239,9 @@ async def execute_workflow_stream(
                         filename = img_data['filename']
                         image_content = img_data['content']
                         
-                        # 检查客户端是否断开
-                        if await request.is_disconnected():
-                            logger.warning(f"客户端已断开，取消图片 {idx} 的处理")
-                            raise asyncio.CancelledError("客户端已断开连接")
-                        
                         # 保存图片到session文件夹
-                        image_path = save_uploaded_file(
+                        await asyncio.to_thread(
+                            save_uploaded_file,
                             session_folder=session_folder,
                             file_name=filename,
                             content=image_content
@@ -815,19 +1249,8 @@ async def execute_workflow_stream(
                         
                         logger.info(f"Processing image {idx}/{len(image_contents)}: {filename}")
                         
-                        # 再次检查客户端是否断开
-                        if await request.is_disconnected():
-                            logger.warning(f"客户端已断开，取消图片 {idx} 的 OCR 处理")
-                            raise asyncio.CancelledError("客户端已断开连接")
-                        
-                        # 使用 Vision Agent 提取文字
-                        result = await vision_agent.extract_text_from_image(
-                            image=image_path,
-                            text_prompt=text_prompt,
-                            temperature=0.3,
-                            max_tokens=4096,
-                            model=None
-                        )
+                        # 缩小超大图片并使用 Vision Agent 提取文字（重复图片复用首张的结果）
+                        result = await _extract_text_deduplicated(inflight_ocr, vision_agent, image_content, _OCR_TEXT_PROMPT)
                         
                         extracted_text = result["response"]
                         usage = result.get("usage", {})
@@ -842,70 +1265,32 @@ async def execute_workflow_stream(
                         logger.error(f"Error processing image {idx}: {str(e)}")
                         return (idx, f"[图片 {idx} 处理失败: {str(e)}]", filename, {})
                 
-                # 并发处理所有图片，使用 asyncio.Task 以便可以取消
-                image_tasks = [
-                    asyncio.create_task(process_single_image_stream(img_data)) 
-                    for img_data in image_contents
-                ]
-                
+                # 固定数量的 worker 并发处理所有图片，按完成顺序推送进度，结果按上传顺序放回原位；
+                # 客户端断开时整个流式处理被取消，未完成的图片随 worker 一并取消（aclosing）
+                image_results = [None] * len(image_contents)
+                image_done_count = 0
                 try:
-                    # 等待所有任务完成，但如果客户端断开则取消
-                    image_results = await asyncio.gather(*image_tasks, return_exceptions=True)
-                    
-                    # 检查是否有客户端断开的情况
-                    if await request.is_disconnected():
-                        logger.warning("客户端已断开，取消剩余的图片处理任务")
-                        # 取消所有未完成的任务
-                        for task in image_tasks:
-                            if not task.done():
-                                task.cancel()
-                        raise asyncio.CancelledError("客户端已断开连接")
-                    
-                    # 处理结果，过滤掉异常
-                    valid_results = []
-                    for result in image_results:
-                        if isinstance(result, Exception):
-                            if isinstance(result, asyncio.CancelledError):
-                                logger.info("部分图片处理被取消")
-                                continue
-                            logger.error(f"图片处理异常: {result}")
-                            continue
-                        valid_results.append(result)
-                    
-                    image_results = valid_results
-                    image_results.sort(key=lambda x: x[0])
-                    
+                    async with aclosing(bounded_as_completed(
+                        image_contents, process_single_image_stream, settings.vision_max_concurrency
+                    )) as completed_images:
+                        async for position, result in completed_images:
+                            image_results[position] = result
+                            image_done_count += 1
+                            yield _sse_log(f'图片 {result[0]} 识别完成（{image_done_count}/{len(image_contents)}）')
                 except asyncio.CancelledError:
                     logger.info("图片处理被取消（客户端断开）")
-                    # 取消所有任务
-                    for task in image_tasks:
-                        if not task.done():
-                            task.cancel()
-                    # 等待任务取消完成
-                    await asyncio.gather(*image_tasks, return_exceptions=True)
                     raise
                 
-                # 拼接所有图片的文字内容并汇总 token 使用量
-                image_texts = []
-                total_image_usage = {
-                    "input_tokens": 0,
-                    "output_tokens": 0,
-                    "total_tokens": 0
-                }
+                # 收集所有图片的文字内容并汇总 token 使用量
                 for result in image_results:
                     idx = result[0]
                     text = result[1] if len(result) > 1 else ""
                     filename = result[2] if len(result) > 2 else ""
-                    usage = result[3] if len(result) > 3 else {}
                     
                     if text:
                         image_texts.append(f"--- 图片 {idx}: {filename} ---\n\n{text}")
-                    
-                    # 累计 token 使用量
-                    if usage:
-                        total_image_usage["input_tokens"] += usage.get("input_tokens", 0)
-                        total_image_usage["output_tokens"] += usage.get("output_tokens", 0)
-                        total_image_usage["total_tokens"] += usage.get("total_tokens", 0)
+                
+                total_image_usage = _sum_vision_usage(result[3] if len(result) > 3 else None for result in image_results)
                 
                 # 记录图片处理的 token 使用
                 if total_image_usage["total_tokens"] > 0:
@@ -914,56 +1299,35 @@ async def execute_workflow_stream(
                         record_usage_from_dict(
                             db=db,
                             user_id=current_user.id,
-                            usage_dict={
-                                "prompt_tokens": total_image_usage["input_tokens"],
-                                "completion_tokens": total_image_usage["output_tokens"],
-                                "total_tokens": total_image_usage["total_tokens"]
-                            },
+                            usage_dict=_vision_usage_record(total_image_usage),
                             model=model_name,
                             stage="image_processing",
-                            session_id=actual_session_id
+                            session_id=actual_session_id,
+                            commit=False  # 随工作流后续写入/结算一并提交
                         )
                         logger.info(f"Recorded image processing token usage (stream): {total_image_usage['total_tokens']} tokens")
                     except Exception as e:
                         logger.error(f"Failed to record image processing token usage (stream): {str(e)}")
                 
                 if image_texts:
-                    image_text_content = "\n\n".join(image_texts)
-                    yield f"data: {WorkflowProgressChunk(type='log', message=f'✓ 图片文字提取完成，共 {len(image_text_content)} 字符', done=False).model_dump_json()}\n\n"
+                    yield _sse_log(f'✓ 图片文字提取完成，共 {_joined_length(image_texts)} 字符')
             
             # 合并所有输入内容
-            content_parts = []
-            if user_document:
-                content_parts.append(user_document)
-            if pdf_text_content:
-                content_parts.append(f"--- PDF内容 ---\n\n{pdf_text_content}")
-            if image_text_content:
-                content_parts.append(f"--- 图片内容 ---\n\n{image_text_content}")
-            
-            if content_parts:
-                combined_document = "\n\n".join(content_parts)
-            else:
-                combined_document = ""
+            combined_document = _combine_document(user_document, pdf_page_texts, image_texts)
             
             if not combined_document.strip():
-                error_chunk = WorkflowProgressChunk(
-                    type="log",
-                    message="错误: 必须提供文字描述、上传PDF文件或上传图片文件",
-                    done=True
-                )
-                yield f"data: {error_chunk.model_dump_json()}\n\n"
+                yield _SSE_NO_INPUT_ERROR
                 return
             
-            # 执行工作流（直接传递PDF内容和文件名，避免文件关闭问题）
+            # 执行工作流（传递已落盘的PDF路径和文件名，避免文件关闭问题）
             logger.info("准备调用工作流execute_stream方法...")
-            logger.info(f"PDF内容是否可用: {pdf_content is not None}")
+            logger.info(f"PDF内容是否可用: {temp_pdf_path is not None}")
             logger.info(f"PDF文件名: {pdf_filename}")
             logger.info(f"合并后文档长度: {len(combined_document)}")
             
             try:
                 # 使用实际的 session_id，确保使用同一个 session_folder
-                final_result = None
-                async for progress_chunk in workflow.execute_stream(
+                async with aclosing(workflow.execute_stream(
                     user_document=combined_document,
                     session_id=actual_session_id,  # 使用实际创建的 session_id
                     user_info=user_info,
@@ -972,65 +1336,41 @@ async def execute_workflow_stream(
                     temperature=temperature,
                     max_tokens=max_tokens,
                     model=model,
-                    pdf_content=pdf_content,  # 直接传递PDF字节内容
+                    pdf_path=temp_pdf_path,  # 传递PDF临时文件路径，由工作流复制到 session 中
                     pdf_filename=pdf_filename,  # 传递PDF文件名
                     username=current_user.username,
                     user_id=current_user.id,
                     db_session=db
-                ):
-                    # 保存最终结果用于token结算
-                    if progress_chunk.done and progress_chunk.result:
-                        final_result = progress_chunk.result
-                    
-                    # 转换为 JSON 并发送 SSE 格式
-                    yield f"data: {progress_chunk.model_dump_json()}\n\n"
-                
-                # 在流式执行完成后结算token
-                if final_result and final_result.total_usage:
-                    total_tokens = final_result.total_usage.get("total_tokens", 0)
-                    if total_tokens > 0:
-                        try:
-                            settlement = settle_token_usage(
-                                db=db,
-                                user_id=current_user.id,
-                                total_tokens=total_tokens,
-                                session_id=actual_session_id
-                            )
-                            logger.info(
-                                f"Token settlement completed (stream): previous_balance={settlement['previous_balance']}, "
-                                f"tokens_used={settlement['tokens_used']}, new_balance={settlement['new_balance']}, "
-                                f"is_overdraft={settlement['is_overdraft']}"
+                )) as progress_stream:
+                    async for progress_chunk in progress_stream:
+                        if progress_chunk.done and progress_chunk.result:
+                            # 先结算 token 并提交任务状态，再发送最终结果：
+                            # 客户端收到结果后立即断开，生成器不会再被驱动，放在循环之后的写入会丢失
+                            final_result = progress_chunk.result
+                            _settle_and_complete_task(
+                                db,
+                                current_user.id,
+                                actual_session_id,
+                                task_id if task_db_obj else None,
+                                final_result
                             )
-                        except Exception as e:
-                            logger.error(f"Failed to settle token usage (stream): {str(e)}")
-                            # 不抛出异常，允许流程完成
+                        
+                        # 转换为 JSON 并发送 SSE 格式
+                        yield _sse(progress_chunk)
                 
-                # 如果提供了 task_id，更新任务状态为 completed
-                if task_db_obj and final_result:
-                    try:
-                        from datetime import datetime
-                        task_db_obj.status = "completed"
-                        task_db_obj.completed_at = datetime.now()
-                        task_db_obj.result_data = final_result.model_dump() if hasattr(final_result, 'model_dump') else final_result
-                        task_db_obj.current_step = "工作流执行完成"
-                        db.commit()
-                        logger.info(f"Updated task {task_id} status to completed")
-                    except Exception as e:
-                        logger.error(f"Failed to update task status to completed: {str(e)}")
-                        db.rollback()
+                if final_result is None:
+                    # 工作流没有产生最终结果时，仍提交已 flush 的 token 使用记录
+                    _commit_task_state(db)
             except asyncio.CancelledError:
                 logger.info("工作流执行被取消（客户端断开）")
-                # 如果提供了 task_id，更新任务状态为 failed
-                if task_db_obj:
-                    try:
-                        task_db_obj.status = "failed"
-                        task_db_obj.error = "工作流执行被取消（客户端断开）"
-                        task_db_obj.current_step = "已取消"
-                        db.commit()
-                        logger.info(f"Updated task {task_id} status to failed (cancelled)")
-                    except Exception as e:
-                        logger.error(f"Failed to update task status to failed: {str(e)}")
-                        db.rollback()
+                # 如果提供了 task_id 且任务尚未完成，更新任务状态为 failed（已产生的 token 使用记录一并提交）
+                _commit_task_state(
+                    db,
+                    task_id if task_db_obj and final_result is None else None,
+                    status="failed",
+                    error="工作流执行被取消（客户端断开）",
+                    current_step="已取消"
+                )
                 # 不发送错误消息，直接返回
                 return
             except Exception as e:
@@ -1038,17 +1378,14 @@ async def execute_workflow_stream(
                 logger.error(f"错误类型: {type(e).__name__}")
                 import traceback
                 logger.error(f"错误堆栈: {traceback.format_exc()}")
-                # 如果提供了 task_id，更新任务状态为 failed
-                if task_db_obj:
-                    try:
-                        task_db_obj.status = "failed"
-                        task_db_obj.error = str(e)
-                        task_db_obj.current_step = f"执行错误: {str(e)}"
-                        db.commit()
-                        logger.info(f"Updated task {task_id} status to failed")
-                    except Exception as update_error:
-                        logger.error(f"Failed to update task status to failed: {str(update_error)}")
-                        db.rollback()
+                # 如果提供了 task_id 且任务尚未完成，更新任务状态为 failed（已产生的 token 使用记录一并提交）
+                _commit_task_state(
+                    db,
+                    task_id if task_db_obj and final_result is None else None,
+                    status="failed",
+                    error=str(e),
+                    current_step=f"执行错误: {str(e)}"
+                )
                 # 检查客户端是否仍然连接
                 try:
                     if not await request.is_disconnected():
@@ -1057,23 +1394,33 @@ async def execute_workflow_stream(
                             message=f"工作流执行错误: {str(e)}",
                             done=True
                         )
-                        yield f"data: {error_chunk.model_dump_json()}\n\n"
+                        yield _sse(error_chunk)
                 except:
                     pass
                 return
+        except GeneratorExit:
+            # 客户端断开时取消可能落在 Starlette 的 send 上，生成器停在 yield 处、随后被 aclose() 关闭：
+            # 这种情况下收不到 CancelledError，需要在这里把未完成的任务标记为失败（同步提交，不会被再次取消打断）
+            if final_result is None:
+                logger.info("工作流流式处理被关闭（客户端断开）")
+                _commit_task_state(
+                    db,
+                    task_id if task_db_obj else None,
+                    status="failed",
+                    error="工作流执行被取消（客户端断开）",
+                    current_step="已取消"
+                )
+            raise
         except asyncio.CancelledError:
             logger.info("工作流流式处理被取消（客户端断开）")
-            # 如果提供了 task_id，更新任务状态为 failed
-            if task_db_obj:
-                try:
-                    task_db_obj.status = "failed"
-                    task_db_obj.error = "工作流执行被取消（客户端断开）"
-                    task_db_obj.current_step = "已取消"
-                    db.commit()
-                    logger.info(f"Updated task {task_id} status to failed (cancelled)")
-                except Exception as e:
-                    logger.error(f"Failed to update task status to failed: {str(e)}")
-                    db.rollback()
+            # 如果提供了 task_id 且任务尚未完成，更新任务状态为 failed（已产生的 token 使用记录一并提交）
+            _commit_task_state(
+                db,
+                task_id if task_db_obj and final_result is None else None,
+                status="failed",
+                error="工作流执行被取消（客户端断开）",
+                current_step="已取消"
+            )
             # 不发送错误消息，直接返回
             return
         except Exception as e:
@@ -1083,17 +1430,14 @@ async def execute_workflow_stream(
             import traceback
             logger.error(f"完整错误堆栈:\n{traceback.format_exc()}")
             logger.error("=" * 80)
-            # 如果提供了 task_id，更新任务状态为 failed
-            if task_db_obj:
-                try:
-                    task_db_obj.status = "failed"
-                    task_db_obj.error = str(e)
-                    task_db_obj.current_step = f"执行错误: {str(e)}"
-                    db.commit()
-                    logger.info(f"Updated task {task_id} status to failed")
-                except Exception as update_error:
-                    logger.error(f"Failed to update task status to failed: {str(update_error)}")
-                    db.rollback()
+            # 如果提供了 task_id 且任务尚未完成，更新任务状态为 failed（已产生的 token 使用记录一并提交）
+            _commit_task_state(
+                db,
+                task_id if task_db_obj and final_result is None else None,
+                status="failed",
+                error=str(e),
+                current_step=f"执行错误: {str(e)}"
+            )
             # 检查客户端是否仍然连接，如果已断开则不发送错误消息
             try:
                 if not await request.is_disconnected():
@@ -1102,10 +1446,15 @@ async def execute_workflow_stream(
                         message=f"错误: {str(e)}",
                         done=True
                     )
-                    yield f"data: {error_chunk.model_dump_json()}\n\n"
+                    yield _sse(error_chunk)
             except:
                 # 如果检查连接状态时出错，说明客户端已断开，直接返回
                 pass
+        finally:
+            disconnect_watcher.cancel()
+            # 清理PDF临时目录（删除目录是阻塞的文件系统操作，放到线程中执行）
+            if temp_pdf_dir is not None:
+                await asyncio.to_thread(temp_pdf_dir.cleanup)
     
     return StreamingResponse(
         generate_sse_stream(),
@@ -1140,7 +1489,14 @@ async def list_sessions(
         loop = asyncio.get_event_loop()
         # 如果是管理员，可以查看所有 session；否则只查看自己的
         username = None if current_user.is_admin else current_user.username
-        sessions = await loop.run_in_executor(None, list_all_sessions, username)
+        cache_key = (
+            _SESSIONS_LIST_ADMIN_CACHE_KEY if username is None
+            else _SESSIONS_LIST_USER_CACHE_KEY.format(username)
+        )
+        sessions = cache.get(cache_key)
+        if sessions is None:
+            sessions = await loop.run_in_executor(None, list_all_sessions, username)
+            cache.set(cache_key, sessions, _SESSIONS_CACHE_TTL)
         return {"sessions": sessions}
     except Exception as e:
         logger.error(f"Error listing sessions: {str(e)}")
@@ -1186,6 +1542,8 @@ async def delete_session(
         # 在线程池中执行删除操作，避免阻塞
         loop = asyncio.get_event_loop()
         success = await loop.run_in_executor(None, delete_session_folder, session_id, username)
+        _resolve_session_folder.cache_clear()
+        _invalidate_sessions_cache(session_id.split('/', 1)[0] if '/' in session_id else current_user.username)
         
         if success:
             return {"success": True, "message": f"Session {session_id} deleted successfully"}
@@ -1381,8 +1739,9 @@ async def download_file(
             username = None
         
         # 获取session文件夹路径
-        session_folder = get_session_folder_path(session_id, username)
-        if not session_folder:
+        try:
+            session_folder = _resolve_session_folder(session_id, username)
+        except FileNotFoundError:
             raise HTTPException(
                 status_code=404,
                 detail=f"Session {session_id} not found"
@@ -1423,16 +1782,27 @@ async def download_file(
             )
         
         # 确定媒体类型
-        if file_type == "artifact" or file_name.endswith('.json'):
+        if file_type == "artifact":
             media_type = 'application/json'
-        elif file_name.endswith('.tex'):
-            media_type = 'application/x-tex'
-        elif file_name.endswith('.md'):
-            media_type = 'text/markdown'
-        elif file_name.endswith('.txt'):
-            media_type = 'text/plain'
         else:
-            media_type = 'application/octet-stream'
+            media_type = _DOWNLOAD_MEDIA_TYPES.get(file_path.suffix, 'application/octet-stream')
+        
+        # 前置 Nginx 负责发送文件：只返回内部跳转头，传输期间不占用 Python worker
+        if settings.use_x_accel_redirect:
+            relative_path = file_path.resolve().relative_to(Path(settings.output_dir).resolve()).as_posix()
+            quoted_name = quote(file_name)
+            if quoted_name != file_name:
+                content_disposition = f"attachment; filename*=utf-8''{quoted_name}"
+            else:
+                content_disposition = f'attachment; filename="{file_name}"'
+            return Response(
+                status_code=200,
+                media_type=media_type,
+                headers={
+                    "X-Accel-Redirect": settings.x_accel_redirect_prefix + quote(relative_path),
+                    "Content-Disposition": content_disposition,
+                }
+            )
         
         # 返回文件
         return FileResponse(
@@ -1,85 +1,188 @@
 """工作流任务管理 API 端点"""
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy import case, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
+from app.db.async_database import get_async_db
 from app.db.database import get_db
-from app.db.models import Task, User
+from app.db.models import Session as DBSession, Task, User
 from app.api.deps_auth import get_current_backend_user
 from app.core.schemas import (
     WorkflowTaskCreate,
     WorkflowTaskUpdate,
-    WorkflowTaskResponse
+    WorkflowTaskResponse,
+    WorkflowTaskSummary
 )
+from app.utils.cache import cache
 from app.utils.logger import logger
-import uuid
+import orjson
+import os
+import time
 from datetime import datetime
 
 router = APIRouter()
 
+# 任务响应用到的列（_serialize_task 读取的全部字段），供列表查询与 UPDATE ... RETURNING 使用
+_TASK_RESPONSE_COLUMNS = (
+    Task.id, Task.task_id, Task.name, Task.status, Task.document, Task.user_info,
+    Task.has_outline, Task.has_existing_tex, Task.temperature, Task.max_tokens,
+    Task.error, Task.current_step, Task.logs, Task.result_data,
+    Task.pdf_file_info, Task.image_files_info,
+    Task.created_at, Task.updated_at, Task.completed_at,
+)
+
+# 任务摘要只包含的小字段：文档、日志、结果与文件信息等 JSON 大字段不从数据库取出
+_TASK_SUMMARY_COLUMNS = (
+    Task.id, Task.task_id, Task.name, Task.status, Task.current_step,
+    Task.created_at, Task.updated_at, Task.completed_at,
+)
+
+# 前端轮询任务列表，序列化后的响应按用户短时缓存（管理员视图共用一个键）；任务写入后主动失效
+_TASKS_CACHE_TTL = 5
+_TASKS_LIST_CACHE_KEY = "tasks:list:v1:{}"
+_ALL_TASKS_CACHE_OWNER = "*"
+
+
+def invalidate_task_list_cache(*user_ids: str) -> None:
+    """失效管理员视图（全部任务）及指定用户的任务列表缓存"""
+    cache.delete(
+        _TASKS_LIST_CACHE_KEY.format(_ALL_TASKS_CACHE_OWNER),
+        *(_TASKS_LIST_CACHE_KEY.format(user_id) for user_id in user_ids)
+    )
+
 
 def generate_task_id() -> str:
-    """生成任务ID"""
-    return f"task_{int(datetime.now().timestamp() * 1000)}_{uuid.uuid4().hex[:9]}"
+    """
+    生成任务ID
+
+    格式与前端保持一致（task_<毫秒时间戳>_<9 位随机十六进制>），时间戳前缀使 ID 按创建时间有序；
+    直接取整数纳秒时间与随机字节，省去 datetime 对象、浮点运算和 UUID 对象的构造。
+    """
+    return f"task_{time.time_ns() // 1_000_000}_{os.urandom(5).hex()[:9]}"
+
+
+def _json_response(content: bytes, status_code: int = status.HTTP_200_OK) -> Response:
+    """返回已序列化的 JSON 响应，跳过 FastAPI 的 jsonable_encoder 与二次校验"""
+    return Response(content=content, media_type="application/json", status_code=status_code)
+
+
+def _serialize_task(task: Task, session_id_str: Optional[str]) -> dict:
+    """把数据库任务（ORM 对象或含同名列的 Row）转换为响应字典
+
+    数据都来自本服务自己写入的数据库，字段与 WorkflowTaskResponse 一一对应，
+    不再经过模型构造与校验，直接交给 orjson 序列化；嵌套的 JSON 列原样输出。
+    """
+    created_at = task.created_at
+    updated_at = task.updated_at
+    completed_at = task.completed_at
+    return {
+        "id": task.id,
+        "task_id": task.task_id,
+        "name": task.name,
+        "status": task.status,
+        "document": task.document,
+        "user_info": task.user_info,
+        "session_id": session_id_str,  # 使用 Session 的 session_id 字符串
+        "has_outline": task.has_outline,
+        "has_existing_tex": task.has_existing_tex,
+        "temperature": task.temperature,
+        "max_tokens": task.max_tokens,
+        "error": task.error,
+        "current_step": task.current_step,
+        "logs": task.logs or [],
+        "response": task.result_data or None,
+        "pdf_file_info": task.pdf_file_info,
+        "image_files_info": task.image_files_info or [],
+        "created_at": created_at.isoformat() if created_at else "",
+        "updated_at": updated_at.isoformat() if updated_at else "",
+        "completed_at": completed_at.isoformat() if completed_at else None,
+    }
+
+
+def _serialize_task_summary(task: Task, session_id_str: Optional[str]) -> dict:
+    """把任务摘要 Row 转换为响应字典（字段与 WorkflowTaskSummary 一一对应）"""
+    created_at = task.created_at
+    updated_at = task.updated_at
+    completed_at = task.completed_at
+    return {
+        "id": task.id,
+        "task_id": task.task_id,
+        "name": task.name,
+        "status": task.status,
+        "session_id": session_id_str,
+        "current_step": task.current_step,
+        "created_at": created_at.isoformat() if created_at else "",
+        "updated_at": updated_at.isoformat() if updated_at else "",
+        "completed_at": completed_at.isoformat() if completed_at else None,
+    }
 
 
 @router.get("/", response_model=List[WorkflowTaskResponse])
 async def list_tasks(
     current_user: User = Depends(get_current_backend_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取当前用户的所有工作流任务
     
     普通用户只能看到自己的任务，管理员可以看到所有任务
     """
+    cache_key = _TASKS_LIST_CACHE_KEY.format(
+        _ALL_TASKS_CACHE_OWNER if current_user.is_admin else current_user.id
+    )
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return _json_response(cached)
+    
     try:
-        if current_user.is_admin:
-            # 管理员可以看到所有任务
-            tasks = db.query(Task).order_by(Task.created_at.desc()).all()
-        else:
-            # 普通用户只能看到自己的任务
-            tasks = db.query(Task).filter(
-                Task.user_id == current_user.id
-            ).order_by(Task.created_at.desc()).all()
+        # 只查询响应需要的列，关联 Session 的 session_id 字符串通过 LEFT JOIN 放进同一行：
+        # 返回轻量的 Row，不构造 ORM 实例与 identity map，也不会触发懒加载；
+        # 只读列表走异步会话，查询期间不阻塞事件循环
+        stmt = select(*_TASK_RESPONSE_COLUMNS, DBSession.session_id.label("session_ref")).outerjoin(
+            DBSession, Task.session_id == DBSession.id
+        )
+        if not current_user.is_admin:
+            # 普通用户只能看到自己的任务（管理员可以看到所有任务）
+            stmt = stmt.where(Task.user_id == current_user.id)
+        rows = (await db.execute(stmt.order_by(Task.created_at.desc()))).all()
         
-        result = []
-        for task in tasks:
-            # 获取 session_id 字符串（如果存在关联的 Session）
-            session_id_str = None
-            if task.session_id:
-                from app.db.models import Session
-                session = db.query(Session).filter(Session.id == task.session_id).first()
-                if session:
-                    session_id_str = session.session_id
-            
-            # 转换数据库模型为响应模型
-            task_dict = {
-                "id": task.id,
-                "task_id": task.task_id,
-                "name": task.name,
-                "status": task.status,
-                "document": task.document,
-                "user_info": task.user_info,
-                "session_id": session_id_str,  # 使用 Session 的 session_id 字符串
-                "has_outline": task.has_outline,
-                "has_existing_tex": task.has_existing_tex,
-                "temperature": task.temperature,
-                "max_tokens": task.max_tokens,
-                "error": task.error,
-                "current_step": task.current_step,
-                "logs": task.logs if task.logs else [],
-                "response": task.result_data if task.result_data else None,
-                "pdf_file_info": task.pdf_file_info,
-                "image_files_info": task.image_files_info if task.image_files_info else [],
-                "created_at": task.created_at.isoformat() if task.created_at else "",
-                "updated_at": task.updated_at.isoformat() if task.updated_at else "",
-                "completed_at": task.completed_at.isoformat() if task.completed_at else None,
-            }
-            result.append(WorkflowTaskResponse(**task_dict))
+        # Row 支持按列名取属性，与 ORM 对象共用同一个转换函数
+        result = [_serialize_task(row, row.session_ref) for row in rows]
         
-        return result
+        content = orjson.dumps(result)
+        cache.set(cache_key, content, _TASKS_CACHE_TTL)
+        return _json_response(content)
     except Exception as e:
-        logger.error(f"Error listing tasks: {str(e)}")
+        logger.error("Error listing tasks: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"获取任务列表失败: {str(e)}"
+        )
+
+
+@router.get("/summary", response_model=List[WorkflowTaskSummary])
+async def list_task_summaries(
+    current_user: User = Depends(get_current_backend_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    获取当前用户的任务摘要列表
+    
+    只返回名称、状态、时间等小字段，适合只需展示任务列表的界面；完整内容通过任务详情接口获取。
+    普通用户只能看到自己的任务，管理员可以看到所有任务
+    """
+    try:
+        stmt = select(*_TASK_SUMMARY_COLUMNS, DBSession.session_id.label("session_ref")).outerjoin(
+            DBSession, Task.session_id == DBSession.id
+        )
+        if not current_user.is_admin:
+            stmt = stmt.where(Task.user_id == current_user.id)
+        rows = (await db.execute(stmt.order_by(Task.created_at.desc()))).all()
+        
+        return _json_response(orjson.dumps([_serialize_task_summary(row, row.session_ref) for row in rows]))
+    except Exception as e:
+        logger.error("Error listing task summaries: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"获取任务列表失败: {str(e)}"
@@ -98,7 +201,13 @@ async def get_task(
     普通用户只能获取自己的任务，管理员可以获取任何任务
     """
     try:
-        task = db.query(Task).filter(Task.id == task_id).first()
+        # 与任务列表相同：只取响应所需的列，关联 Session 的 session_id 字符串经 LEFT JOIN 放进同一行，
+        # 得到轻量的 Row，不构造 Task / Session ORM 实例
+        task = db.execute(
+            select(*_TASK_RESPONSE_COLUMNS, Task.user_id, DBSession.session_id.label("session_ref"))
+            .outerjoin(DBSession, Task.session_id == DBSession.id)
+            .where(Task.id == task_id)
+        ).first()
         
         if not task:
             raise HTTPException(
@@ -113,42 +222,11 @@ async def get_task(
                 detail="无权访问此任务"
             )
         
-        # 获取 session_id 字符串（如果存在关联的 Session）
-        session_id_str = None
-        if task.session_id:
-            from app.db.models import Session
-            session = db.query(Session).filter(Session.id == task.session_id).first()
-            if session:
-                session_id_str = session.session_id
-        
-        task_dict = {
-            "id": task.id,
-            "task_id": task.task_id,
-            "name": task.name,
-            "status": task.status,
-            "document": task.document,
-            "user_info": task.user_info,
-            "session_id": session_id_str,  # 使用 Session 的 session_id 字符串
-            "has_outline": task.has_outline,
-            "has_existing_tex": task.has_existing_tex,
-            "temperature": task.temperature,
-            "max_tokens": task.max_tokens,
-            "error": task.error,
-            "current_step": task.current_step,
-            "logs": task.logs if task.logs else [],
-            "response": task.result_data if task.result_data else None,
-            "pdf_file_info": task.pdf_file_info,
-            "image_files_info": task.image_files_info if task.image_files_info else [],
-            "created_at": task.created_at.isoformat() if task.created_at else "",
-            "updated_at": task.updated_at.isoformat() if task.updated_at else "",
-            "completed_at": task.completed_at.isoformat() if task.completed_at else None,
-        }
-        
-        return WorkflowTaskResponse(**task_dict)
+        return _json_response(orjson.dumps(_serialize_task(task, task.session_ref)))
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error getting task: {str(e)}")
+        logger.error("Error getting task: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"获取任务失败: {str(e)}"
@@ -165,11 +243,12 @@ async def create_task(
     创建新的工作流任务
     """
     try:
-        # 检查并发数限制
-        running_tasks_count = db.query(Task).filter(
-            Task.user_id == current_user.id,
-            Task.status == "running"
-        ).count()
+        # 检查并发数限制；任务总数（用于默认名称）与 running 数在同一条聚合查询中取回
+        counts = db.query(
+            func.count(Task.id).label("total"),
+            func.coalesce(func.sum(case((Task.status == "running", 1), else_=0)), 0).label("running"),
+        ).filter(Task.user_id == current_user.id).one()
+        running_tasks_count = counts.running
         
         max_concurrent = current_user.max_concurrent_workflows or 10
         if running_tasks_count >= max_concurrent:
@@ -183,18 +262,16 @@ async def create_task(
         # 生成默认任务名称
         if not task_data.name:
             # 计算任务序号
-            existing_count = db.query(Task).filter(
-                Task.user_id == current_user.id
-            ).count()
-            task_data.name = f"任务 {existing_count + 1}"
+            task_data.name = f"任务 {counts.total + 1}"
         
         # 如果提供了 session_id，尝试查找对应的 Session 对象
         session_db_id = None
+        session_id_str = None
         if task_data.session_id:
-            from app.db.models import Session
-            session = db.query(Session).filter(Session.session_id == task_data.session_id).first()
+            session = db.query(DBSession).filter(DBSession.session_id == task_data.session_id).first()
             if session:
                 session_db_id = session.id
+                session_id_str = session.session_id
         
         task = Task(
             task_id=task_id,
@@ -215,42 +292,15 @@ async def create_task(
         db.commit()
         db.refresh(task)
         
-        logger.info(f"Created task {task.id} for user {current_user.username}")
-        
-        # 获取 session_id 字符串（如果存在关联的 Session）
-        session_id_str = None
-        if task.session_id:
-            from app.db.models import Session
-            session = db.query(Session).filter(Session.id == task.session_id).first()
-            if session:
-                session_id_str = session.session_id
+        invalidate_task_list_cache(current_user.id)
+        logger.info("Created task %s for user %s", task.id, current_user.username)
         
-        task_dict = {
-            "id": task.id,
-            "task_id": task.task_id,
-            "name": task.name,
-            "status": task.status,
-            "document": task.document,
-            "user_info": task.user_info,
-            "session_id": session_id_str,  # 使用 Session 的 session_id 字符串
-            "has_outline": task.has_outline,
-            "has_existing_tex": task.has_existing_tex,
-            "temperature": task.temperature,
-            "max_tokens": task.max_tokens,
-            "error": task.error,
-            "current_step": task.current_step,
-            "logs": task.logs if task.logs else [],
-            "response": task.result_data if task.result_data else None,
-            "pdf_file_info": task.pdf_file_info,
-            "image_files_info": task.image_files_info if task.image_files_info else [],
-            "created_at": task.created_at.isoformat() if task.created_at else "",
-            "updated_at": task.updated_at.isoformat() if task.updated_at else "",
-            "completed_at": task.completed_at.isoformat() if task.completed_at else None,
-        }
-        
-        return WorkflowTaskResponse(**task_dict)
+        return _json_response(
+            orjson.dumps(_serialize_task(task, session_id_str)),
+            status_code=status.HTTP_201_CREATED,
+        )
     except Exception as e:
-        logger.error(f"Error creating task: {str(e)}")
+        logger.error("Error creating task: %s", e)
         db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -271,109 +321,86 @@ async def update_task(
     普通用户只能更新自己的任务，管理员可以更新任何任务
     """
     try:
-        task = db.query(Task).filter(Task.id == task_id).first()
-        
-        if not task:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="任务不存在"
-            )
-        
-        # 权限检查
-        if not current_user.is_admin and task.user_id != current_user.id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="无权更新此任务"
-            )
-        
-        # 更新字段
+        # 收集需要更新的字段
+        values = {}
         if task_data.name is not None:
-            task.name = task_data.name
+            values["name"] = task_data.name
         if task_data.document is not None:
-            task.document = task_data.document
+            values["document"] = task_data.document
         if task_data.user_info is not None:
-            task.user_info = task_data.user_info
+            values["user_info"] = task_data.user_info
         if task_data.session_id is not None:
-            # 如果提供了 session_id 字符串，查找对应的 Session 对象
-            if task_data.session_id:
-                from app.db.models import Session
-                session = db.query(Session).filter(Session.session_id == task_data.session_id).first()
-                if session:
-                    task.session_id = session.id
-                else:
-                    # Session 不存在，设置为 None
-                    task.session_id = None
-            else:
-                # 空字符串，设置为 None
-                task.session_id = None
+            # 提供了 session_id 字符串时在同一条 UPDATE 中用子查询换成 Session 的数据库 ID；
+            # Session 不存在或传入空字符串时为 None
+            values["session_id"] = select(DBSession.id).where(
+                DBSession.session_id == task_data.session_id
+            ).scalar_subquery() if task_data.session_id else None
         if task_data.status is not None:
-            task.status = task_data.status
+            values["status"] = task_data.status
         if task_data.has_outline is not None:
-            task.has_outline = task_data.has_outline
+            values["has_outline"] = task_data.has_outline
         if task_data.has_existing_tex is not None:
-            task.has_existing_tex = task_data.has_existing_tex
+            values["has_existing_tex"] = task_data.has_existing_tex
         if task_data.temperature is not None:
-            task.temperature = str(task_data.temperature)
+            values["temperature"] = str(task_data.temperature)
         if task_data.max_tokens is not None:
-            task.max_tokens = str(task_data.max_tokens)
+            values["max_tokens"] = str(task_data.max_tokens)
         if task_data.error is not None:
-            task.error = task_data.error
+            values["error"] = task_data.error
         if task_data.current_step is not None:
-            task.current_step = task_data.current_step
+            values["current_step"] = task_data.current_step
         if task_data.logs is not None:
-            task.logs = task_data.logs
+            values["logs"] = task_data.logs
         if task_data.response is not None:
-            task.result_data = task_data.response.model_dump() if hasattr(task_data.response, 'model_dump') else task_data.response
+            values["result_data"] = task_data.response.model_dump() if hasattr(task_data.response, 'model_dump') else task_data.response
         if task_data.pdf_file_info is not None:
-            task.pdf_file_info = task_data.pdf_file_info.model_dump() if hasattr(task_data.pdf_file_info, 'model_dump') else task_data.pdf_file_info
+            values["pdf_file_info"] = task_data.pdf_file_info.model_dump() if hasattr(task_data.pdf_file_info, 'model_dump') else task_data.pdf_file_info
         if task_data.image_files_info is not None:
-            task.image_files_info = [info.model_dump() if hasattr(info, 'model_dump') else info for info in task_data.image_files_info]
+            values["image_files_info"] = [info.model_dump() if hasattr(info, 'model_dump') else info for info in task_data.image_files_info]
         
-        # 如果状态变为完成，设置完成时间
-        if task_data.status == "completed" and not task.completed_at:
-            task.completed_at = datetime.now()
+        # 如果状态变为完成，设置完成时间（已有完成时间则保留）
+        if task_data.status == "completed":
+            values["completed_at"] = func.coalesce(Task.completed_at, datetime.now())
         
-        db.commit()
-        db.refresh(task)
+        # 权限检查并入 WHERE：普通用户只能更新自己的任务；RETURNING 带回响应所需的列，
+        # 关联 Session 的 session_id 字符串用相关子查询取出，正常路径只需一次往返
+        stmt = update(Task).where(Task.id == task_id)
+        if not current_user.is_admin:
+            stmt = stmt.where(Task.user_id == current_user.id)
+        row = db.execute(
+            stmt.values(**values).returning(
+                *_TASK_RESPONSE_COLUMNS,
+                Task.user_id,
+                select(DBSession.session_id)
+                .where(DBSession.id == Task.session_id)
+                .scalar_subquery()
+                .label("session_ref"),
+            )
+        ).one_or_none()
         
-        logger.info(f"Updated task {task.id}")
+        if row is None:
+            # 更新失败时才额外查询一次，区分任务不存在与无权更新
+            exists = db.execute(select(Task.id).where(Task.id == task_id)).first()
+            if not exists:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="任务不存在"
+                )
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="无权更新此任务"
+            )
         
-        # 获取 session_id 字符串（如果存在关联的 Session）
-        session_id_str = None
-        if task.session_id:
-            from app.db.models import Session
-            session = db.query(Session).filter(Session.id == task.session_id).first()
-            if session:
-                session_id_str = session.session_id
+        db.commit()
         
-        task_dict = {
-            "id": task.id,
-            "task_id": task.task_id,
-            "name": task.name,
-            "status": task.status,
-            "document": task.document,
-            "user_info": task.user_info,
-            "session_id": session_id_str,  # 使用 Session 的 session_id 字符串
-            "has_outline": task.has_outline,
-            "has_existing_tex": task.has_existing_tex,
-            "temperature": task.temperature,
-            "max_tokens": task.max_tokens,
-            "error": task.error,
-            "current_step": task.current_step,
-            "logs": task.logs if task.logs else [],
-            "response": task.result_data if task.result_data else None,
-            "pdf_file_info": task.pdf_file_info,
-            "image_files_info": task.image_files_info if task.image_files_info else [],
-            "created_at": task.created_at.isoformat() if task.created_at else "",
-            "updated_at": task.updated_at.isoformat() if task.updated_at else "",
-            "completed_at": task.completed_at.isoformat() if task.completed_at else None,
-        }
+        invalidate_task_list_cache(row.user_id)
+        logger.info("Updated task %s", row.id)
         
-        return WorkflowTaskResponse(**task_dict)
+        return _json_response(orjson.dumps(_serialize_task(row, row.session_ref)))
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error updating task: {str(e)}")
+        logger.error("Error updating task: %s", e)
         db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -408,16 +435,18 @@ async def delete_task(
                 detail="无权删除此任务"
             )
         
+        owner_id = task.user_id
         db.delete(task)
         db.commit()
         
-        logger.info(f"Deleted task {task_id}")
+        invalidate_task_list_cache(owner_id)
+        logger.info("Deleted task %s", task_id)
         
         return None
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error deleting task: {str(e)}")
+        logger.error("Error deleting task: %s", e)
         db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
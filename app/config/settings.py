@@ -1,9 +1,11 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
 from typing import Optional
+from functools import cached_property
 import asyncio
 import aiohttp
 import logging
+import time
 
 
 class Settings(BaseSettings):
@@ -34,6 +36,9 @@ class Settings(BaseSettings):
     anthropic_model: str = "claude-sonnet-4-20250514"
     anthropic_temperature: float = 0.7
     anthropic_max_tokens: int = 100000
+    vision_max_concurrency: int = Field(default=8, description="PDF 逐页 Vision 调用的最大并发数")
+    vision_batch_size: int = Field(default=1, description="PDF 每次 Vision 调用合并的页数（多图消息），1 表示逐页调用")
+    vision_requests_per_second: float = Field(default=0, description="Vision 调用的全局速率上限（每秒请求数），0 表示不限速")
     
     # 服务器配置
     host: str = "0.0.0.0"
@@ -45,6 +50,8 @@ class Settings(BaseSettings):
     
     # 文件输出配置
     output_dir: str = "output"  # 输出目录，用于保存生成的文件
+    use_x_accel_redirect: bool = Field(default=False, description="下载文件时只返回 X-Accel-Redirect 头，由前置 Nginx 直接发送文件（需配置 internal 的对应 location）")
+    x_accel_redirect_prefix: str = Field(default="/protected/", description="X-Accel-Redirect 内部 location 前缀，对应 Nginx 中 alias 到输出目录的 location")
     
     # 代理配置
     proxy_enabled: bool = Field(default=True, description="是否启用代理")
@@ -73,9 +80,10 @@ class Settings(BaseSettings):
     arxiv_hot_temperature: float = Field(default=0.2, description="热门短语模型温度")
     arxiv_hot_max_tokens: int = Field(default=512, description="热门短语模型最大 tokens")
     arxiv_hot_top_k: int = Field(default=10, description="热门短语数量")
-    scheduler_enabled: bool = Field(default=True, description="是否启用 APScheduler")
+    scheduler_enabled: bool = Field(default=True, description="是否启用 arXiv 定时同步（物化视图刷新等维护任务始终运行）")
     scheduler_timezone: str = Field(default="Asia/Shanghai", description="调度器时区")
     arxiv_cron: str = Field(default="0 3 1 * *", description="arXiv 同步 cron 表达式")
+    token_usage_mv_refresh_minutes: int = Field(default=5, description="token_usage_daily_mv 物化视图刷新间隔（分钟）")
     
     # 数据库配置 - 支持 db_* 或 POSTGRES_* 环境变量名
     db_user: Optional[str] = Field(default="postgres")
@@ -91,7 +99,14 @@ class Settings(BaseSettings):
     postgres_host: Optional[str] = Field(default=None, alias="POSTGRES_HOST")
     postgres_port: Optional[int] = Field(default=None, alias="POSTGRES_PORT")
     
-    @property
+    # 数据库连接池配置
+    db_pool_size: int = Field(default=20, description="连接池常驻连接数")
+    db_max_overflow: int = Field(default=10, description="连接池允许的额外连接数")
+    db_pool_timeout: int = Field(default=30, description="获取连接的超时时间（秒）")
+    db_pool_recycle: int = Field(default=1800, description="连接回收时间（秒），避免使用被服务端关闭的连接")
+    db_use_null_pool: bool = Field(default=False, description="是否禁用应用侧连接池（PgBouncer 事务模式下启用）")
+    
+    @cached_property
     def database_url(self) -> str:
         """构建数据库连接URL"""
         # 优先使用 POSTGRES_*，否则使用 db_* 或默认值
@@ -102,6 +117,11 @@ class Settings(BaseSettings):
         db = self.postgres_db or self.db_name or "academic_workflow"
         return f"postgresql://{user}:{password}@{host}:{port}/{db}"
     
+    @cached_property
+    def async_database_url(self) -> str:
+        """构建异步（asyncpg）数据库连接URL"""
+        return self.database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    
     # JWT认证配置
     secret_key: str = Field(default="your-secret-key-change-in-production")
     algorithm: str = "HS256"
@@ -115,12 +135,12 @@ class Settings(BaseSettings):
     super_admin_username: Optional[str] = Field(default=None, alias="SUPER_ADMIN_USERNAME")
     super_admin_password: Optional[str] = Field(default=None, alias="SUPER_ADMIN_PASSWORD")
     
-    @property
+    @cached_property
     def admin_username_value(self) -> str:
         """获取管理员用户名（优先使用 SUPER_ADMIN_*，否则使用 admin_* 或默认值）"""
         return self.super_admin_username or self.admin_username or "admin"
     
-    @property
+    @cached_property
     def admin_password_value(self) -> str:
         """获取管理员密码（优先使用 SUPER_ADMIN_*，否则使用 admin_* 或默认值）"""
         return self.super_admin_password or self.admin_password or "admin123"
@@ -134,19 +154,35 @@ class ProxyManager:
         self.logger = logging.getLogger(__name__)
         self._proxy_available = None
         self._last_check_time = 0
-        self._check_interval = 300  # 5分钟检查一次
+        self.check_interval = 300  # 5分钟检查一次（调度器按同一间隔在后台刷新）
+        self._probe_task: Optional[asyncio.Task] = None
     
     async def is_proxy_available(self, force_check: bool = False) -> bool:
-        """检查代理是否可用"""
-        import time
-        current_time = time.time()
+        """
+        检查代理是否可用
         
-        # 如果不强制检查且在检查间隔内，返回缓存结果
-        if not force_check and self._proxy_available is not None and (current_time - self._last_check_time) < self._check_interval:
+        已有检测结果时直接返回缓存值；结果过期时在后台重新检测，调用方不等待探测请求。
+        只有首次检测或 force_check 时才等待检测完成，并发调用共享同一次探测。
+        """
+        if not force_check and self._proxy_available is not None:
+            if time.monotonic() - self._last_check_time >= self.check_interval:
+                self._start_probe()
             return self._proxy_available
         
+        # shield：等待方被取消时不影响其他调用方共享的探测
+        return await asyncio.shield(self._start_probe())
+    
+    def _start_probe(self) -> "asyncio.Task[bool]":
+        """启动一次代理检测；已有检测进行中时复用该任务"""
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.ensure_future(self._probe())
+        return self._probe_task
+    
+    async def _probe(self) -> bool:
+        """实际请求测试地址，更新检测结果与检测时间"""
         if not self.settings.proxy_enabled:
             self._proxy_available = False
+            self._last_check_time = time.monotonic()
             return False
         
         try:
@@ -162,7 +198,7 @@ class ProxyManager:
                     proxy=self.settings.proxy_url
                 ) as response:
                     self._proxy_available = response.status == 200
-                    self._last_check_time = current_time
+                    self._last_check_time = time.monotonic()
                     
                     if self._proxy_available:
                         self.logger.info(f"✓ 代理可用: {self.settings.proxy_url}")
@@ -173,7 +209,7 @@ class ProxyManager:
                     
         except Exception as e:
             self._proxy_available = False
-            self._last_check_time = current_time
+            self._last_check_time = time.monotonic()
             self.logger.warning(f"✗ 代理不可用: {self.settings.proxy_url} - {e}")
             return False
     
@@ -191,6 +227,9 @@ class ProxyManager:
         return self.settings.proxy_url if self._proxy_available else None
 
 
+# 由字段派生、以 cached_property 缓存的配置项；reload_settings 时需要失效
+_DERIVED_SETTINGS = ("database_url", "async_database_url", "admin_username_value", "admin_password_value")
+
 # 全局配置实例
 settings = Settings()
 
@@ -202,8 +241,11 @@ def reload_settings() -> Settings:
     """Reload settings from environment (in-place) so existing references stay valid."""
     global settings
     new_settings = Settings()
-    for field_name, value in new_settings.model_dump().items():
-        setattr(settings, field_name, value)
+    for field_name in Settings.model_fields:
+        setattr(settings, field_name, getattr(new_settings, field_name))
+    # 派生值按字段缓存在实例上，字段更新后需丢弃，下次访问时重新计算
+    for name in _DERIVED_SETTINGS:
+        settings.__dict__.pop(name, None)
 
     # 重置代理管理器状态，使其使用新配置
     proxy_manager.settings = settings
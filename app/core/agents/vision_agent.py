@@ -1,13 +1,22 @@
 from typing import Dict, Any, Optional, List, Union, Tuple
 import base64
+import os
+import re
 import time
 from pathlib import Path
 from io import BytesIO
 from PIL import Image
+from app.config.settings import settings
 from app.services.anthropic_service import AnthropicService
+from app.utils.concurrency import AsyncRateLimiter
 from app.utils.logger import logger
 
 
+# 所有 Vision 调用共享的速率限制：接口依赖注入的 VisionAgent 是单例，
+# 但 query_to_md_workflow 与 postprocess_steps 中还会各自创建 VisionAgent，限速器放在模块级才能覆盖全部实例
+_vision_rate_limiter = AsyncRateLimiter(settings.vision_requests_per_second)
+
+
 class VisionAgent:
     """Vision Agent - 使用 Anthropic Claude 进行图片识别和多模态分析"""
     
@@ -44,6 +53,9 @@ Extract and output ONLY the actual content from images. Do NOT add any:
     MAX_BASE64_SIZE_BYTES = 5_242_880  # 5MB，API 限制
     MAX_ORIGINAL_SIZE_BYTES = 3_750_000  # 约 3.75MB，确保 base64 编码后不超过 5MB
     
+    # 批量 OCR 响应中每张图片结果前的分隔标记，如 ---PAGE 3---
+    _PAGE_MARKER_PATTERN = re.compile(r"^[ \t]*-{3}[ \t]*PAGE[ \t]+(\d+)[ \t]*-{3}[ \t]*$", re.MULTILINE)
+    
     def __init__(self, anthropic_service: AnthropicService):
         self.anthropic_service = anthropic_service
     
@@ -87,6 +99,42 @@ Extract and output ONLY the actual content from images. Do NOT add any:
         
         return media_type_map.get(ext, "image/jpeg")
     
+    def _detect_media_type_from_bytes(self, image_data: bytes) -> str:
+        """
+        根据文件头（magic bytes）检测二进制图片的媒体类型
+        
+        Args:
+            image_data: 图片二进制数据
+            
+        Returns:
+            媒体类型字符串，无法识别时默认为 image/jpeg
+        """
+        if image_data.startswith(b"\x89PNG\r\n\x1a\n"):
+            return "image/png"
+        if image_data.startswith((b"GIF87a", b"GIF89a")):
+            return "image/gif"
+        if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+            return "image/webp"
+        return "image/jpeg"
+    
+    def _split_base64_image(self, image: str) -> Tuple[str, str]:
+        """
+        解析 base64 图片字符串（支持 data URL 前缀），只解码文件头来检测媒体类型
+        
+        Args:
+            image: base64 字符串，或 data:image/png;base64,... 形式的 data URL
+            
+        Returns:
+            (base64 数据, 媒体类型)
+        """
+        if image.startswith("data:") and "," in image:
+            header, base64_data = image.split(",", 1)
+            media_type = header[len("data:"):].split(";", 1)[0] or "image/jpeg"
+            return base64_data, media_type
+        
+        # 16 个 base64 字符对应 12 字节文件头，足够识别 PNG/GIF/WEBP
+        return image, self._detect_media_type_from_bytes(base64.b64decode(image[:16]))
+    
     def _get_base64_size(self, image_data: bytes) -> int:
         """
         计算图片 base64 编码后的大小
@@ -252,42 +300,41 @@ Extract and output ONLY the actual content from images. Do NOT add any:
                 continue
             
             # 处理不同类型的图片输入
-            if isinstance(image, (str, Path)):
+            image_block = None
+            if isinstance(image, Path) or (isinstance(image, str) and os.path.isfile(image)):
                 # 文件路径
                 image_data = self._load_image_from_path(image)
                 media_type = self._detect_media_type(image)
             elif isinstance(image, bytes):
                 # 二进制数据
                 image_data = image
-                media_type = "image/jpeg"  # 默认，可以后续改进自动检测
+                media_type = self._detect_media_type_from_bytes(image_data)
             elif isinstance(image, str):
-                # 可能是 base64 字符串或文件路径
-                try:
-                    # 尝试解码 base64
-                    image_data = base64.b64decode(image)
-                    media_type = "image/jpeg"  # 默认
-                except Exception:
-                    # 如果不是 base64，当作文件路径处理
-                    image_data = self._load_image_from_path(image)
-                    media_type = self._detect_media_type(image)
+                # base64 字符串：未超出大小限制时直接复用，避免解码后再重新编码
+                base64_data, media_type = self._split_base64_image(image)
+                if len(base64_data) <= self.MAX_BASE64_SIZE_BYTES:
+                    image_block = self.anthropic_service.create_base64_image_block(base64_data, media_type)
+                else:
+                    image_data = base64.b64decode(base64_data)
             else:
                 raise ValueError(f"Unsupported image type: {type(image)}")
             
-            # 检查并压缩图片（如果需要）
-            original_size = len(image_data)
-            original_base64_size = self._get_base64_size(image_data)
-            
-            if original_base64_size > self.MAX_BASE64_SIZE_BYTES:
-                image_data, media_type = self._compress_image(image_data, media_type)
-                compressed_base64_size = self._get_base64_size(image_data)
-                logger.info(
-                    f"Image compressed: {original_size} -> {len(image_data)} bytes "
-                    f"(base64: ~{original_base64_size} -> ~{compressed_base64_size} bytes, "
-                    f"media_type: {media_type})"
-                )
-            
-            # 创建图片块
-            image_block = self.anthropic_service.create_image_block(image_data, media_type)
+            if image_block is None:
+                # 检查并压缩图片（如果需要）
+                original_size = len(image_data)
+                original_base64_size = self._get_base64_size(image_data)
+                
+                if original_base64_size > self.MAX_BASE64_SIZE_BYTES:
+                    image_data, media_type = self._compress_image(image_data, media_type)
+                    compressed_base64_size = self._get_base64_size(image_data)
+                    logger.info(
+                        f"Image compressed: {original_size} -> {len(image_data)} bytes "
+                        f"(base64: ~{original_base64_size} -> ~{compressed_base64_size} bytes, "
+                        f"media_type: {media_type})"
+                    )
+                
+                # 创建图片块
+                image_block = self.anthropic_service.create_image_block(image_data, media_type)
             content.append(image_block)
             duration_ms = (time.perf_counter() - start_time) * 1000
             logger.info(
@@ -373,6 +420,7 @@ Extract and output ONLY the actual content from images. Do NOT add any:
         ]
         
         # 调用 Anthropic API
+        await _vision_rate_limiter.acquire()
         response_text, usage = await self.anthropic_service.messages_create(
             messages=messages,
             temperature=temperature,
@@ -443,6 +491,7 @@ Extract and output ONLY the actual content from images. Do NOT add any:
         ]
         
         # 调用 Anthropic API 流式接口
+        await _vision_rate_limiter.acquire()
         stream = await self.anthropic_service.messages_create_stream(
             messages=messages,
             temperature=temperature,
@@ -520,4 +569,66 @@ Extract and output ONLY the actual content from images. Do NOT add any:
             max_tokens=max_tokens,
             model=model
         )
-
+    
+    async def extract_text_from_images_batch(
+        self,
+        images: List[Union[str, Path, bytes]],
+        text_prompt: str,
+        temperature: float = 0.3,
+        max_tokens: int = 2048,
+        model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        在一次调用中对多张图片做 OCR（多图消息），按分隔标记拆分出每张图片的结果
+        
+        Args:
+            images: 图片列表（按顺序编号为第 1..N 张）
+            text_prompt: 单张图片的 OCR 提示，会附加分隔格式要求
+            temperature: 温度参数（OCR 建议使用较低温度）
+            max_tokens: 单张图片的最大token数，实际请求按图片数放大
+            model: 模型名称
+            
+        Returns:
+            {
+                "responses": List[str],  # 每张图片的文字结果（与 images 顺序一致）
+                "usage": dict,           # 整批的 Token 使用情况
+                "raw_response": str      # 原始响应
+            }
+            
+        Raises:
+            ValueError: 响应无法按分隔标记拆分为 N 段时抛出（调用方可回退为逐张处理）
+        """
+        image_count = len(images)
+        content = [self.anthropic_service.create_text_block(
+            f"{text_prompt}\n\n下面共有 {image_count} 张图片，请按顺序逐张处理。"
+            f"每张图片的结果前单独一行输出分隔标记 ---PAGE N---（N 为图片序号，从 1 开始），"
+            f"分隔标记之外不要输出任何其他内容。"
+        )]
+        for idx, image in enumerate(images, 1):
+            content.append(self.anthropic_service.create_text_block(f"---PAGE {idx}---"))
+            content.extend(self._prepare_image_content([image]))
+        
+        await _vision_rate_limiter.acquire()
+        response_text, usage = await self.anthropic_service.messages_create(
+            messages=[{"role": "user", "content": content}],
+            temperature=temperature,
+            max_tokens=max_tokens * image_count,
+            model=model,
+            system=self.SYSTEM_PROMPT
+        )
+        
+        # re.split 带捕获组时结果为 [前导内容, 序号1, 内容1, 序号2, 内容2, ...]
+        parts = self._PAGE_MARKER_PATTERN.split(response_text)
+        page_numbers = [int(number) for number in parts[1::2]]
+        if page_numbers != list(range(1, image_count + 1)):
+            raise ValueError(
+                f"Batch OCR response has page markers {page_numbers}, expected 1..{image_count}"
+            )
+        
+        logger.info(f"Vision batch OCR completed for {image_count} images. Usage: {usage}")
+        
+        return {
+            "responses": [text.strip() for text in parts[2::2]],
+            "usage": usage,
+            "raw_response": response_text
+        }
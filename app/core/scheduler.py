@@ -1,35 +1,72 @@
 """APScheduler 封装"""
 from __future__ import annotations
 
-from typing import Optional
-
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
-from app.config.settings import settings
+from app.config.settings import proxy_manager, settings
+from app.db.token_usage_mv import refresh_token_usage_daily_mv
 from app.services.crawler_service import MonthlyArxivSyncService
+from app.utils.file_manager import cleanup_stale_upload_temp_files
 from app.utils.logger import setup_logger
+from app.utils.vision_cache import purge_expired_ocr_cache
 
 
 logger = setup_logger("scheduler")
 
+# 上传暂存文件只在请求处理期间使用；超过该时长仍存在的，视为进程异常退出后的遗留
+_STALE_UPLOAD_TEMP_MAX_AGE_SECONDS = 6 * 3600
 
-def init_scheduler(sync_service: MonthlyArxivSyncService) -> Optional[AsyncIOScheduler]:
-    if not settings.scheduler_enabled:
-        logger.info("Scheduler disabled via settings")
-        return None
 
+def init_scheduler(sync_service: MonthlyArxivSyncService) -> AsyncIOScheduler:
+    # 物化视图刷新、暂存文件与 OCR 缓存清理、代理检测属于服务自身的维护任务，始终运行；
+    # scheduler_enabled 只控制 arXiv 定时同步
     scheduler = AsyncIOScheduler(timezone=settings.scheduler_timezone)
-    trigger = CronTrigger.from_crontab(settings.arxiv_cron, timezone=settings.scheduler_timezone)
+    if settings.scheduler_enabled:
+        trigger = CronTrigger.from_crontab(settings.arxiv_cron, timezone=settings.scheduler_timezone)
+        scheduler.add_job(
+            sync_service.run_once,
+            trigger=trigger,
+            max_instances=1,
+            misfire_grace_time=3600,
+            coalesce=True,
+        )
+    else:
+        logger.info("arXiv sync schedule disabled via settings")
+    scheduler.add_job(
+        refresh_token_usage_daily_mv,
+        trigger=IntervalTrigger(minutes=settings.token_usage_mv_refresh_minutes),
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        cleanup_stale_upload_temp_files,
+        trigger=IntervalTrigger(hours=1),
+        args=[_STALE_UPLOAD_TEMP_MAX_AGE_SECONDS],
+        max_instances=1,
+        coalesce=True,
+    )
+    # 过期的 OCR 缓存记录在后台定期清理，请求路径上只按 created_at 过滤
+    scheduler.add_job(
+        purge_expired_ocr_cache,
+        trigger=IntervalTrigger(hours=6),
+        max_instances=1,
+        coalesce=True,
+    )
+    # 后台定期刷新代理检测结果，请求路径上只读取缓存值，不必等待探测
     scheduler.add_job(
-        sync_service.run_once,
-        trigger=trigger,
+        proxy_manager.is_proxy_available,
+        trigger=IntervalTrigger(seconds=proxy_manager.check_interval),
+        kwargs={"force_check": True},
         max_instances=1,
-        misfire_grace_time=3600,
         coalesce=True,
     )
     scheduler.start()
-    logger.info("Scheduler started with cron %s (%s)", settings.arxiv_cron, settings.scheduler_timezone)
+    if settings.scheduler_enabled:
+        logger.info("Scheduler started with cron %s (%s)", settings.arxiv_cron, settings.scheduler_timezone)
+    else:
+        logger.info("Scheduler started (maintenance jobs only)")
     return scheduler
 
 
@@ -30,6 +30,7 @@ class StreamChunk(BaseModel):
     chunk: str = Field(..., description="数据块内容")
     done: bool = Field(False, description="是否完成")
     usage: Optional[Dict[str, Any]] = Field(None, description="Token使用情况（仅在done=True时）")
+    meta: Optional[Dict[str, Any]] = Field(None, description="附加信息（如 PDF 流式处理时的页码）")
 
 
 class PaperOverviewRequest(BaseModel):
@@ -245,3 +246,16 @@ class WorkflowTaskResponse(BaseModel):
     class Config:
         from_attributes = True
 
+
+class WorkflowTaskSummary(BaseModel):
+    """工作流任务摘要响应模型（列表展示用，不含文档、日志与结果等大字段）"""
+    id: str = Field(..., description="任务ID")
+    task_id: str = Field(..., description="任务标识符")
+    name: Optional[str] = Field(None, description="任务名称")
+    status: str = Field(..., description="任务状态")
+    session_id: Optional[str] = Field(None, description="Session ID")
+    current_step: Optional[str] = Field(None, description="当前步骤")
+    created_at: str = Field(..., description="创建时间（ISO格式）")
+    updated_at: str = Field(..., description="更新时间（ISO格式）")
+    completed_at: Optional[str] = Field(None, description="完成时间（ISO格式）")
+
@@ -1,14 +1,20 @@
 """安全相关工具：密码哈希、JWT令牌等"""
 import hashlib
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from app.config.settings import settings
 from app.utils.logger import logger
 
 # 密码加密上下文
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 新密码使用 sha256_crypt（SHA-256 可利用 CPU 的 SHA 指令加速），rounds 调整到单次校验约 50ms；
+# bcrypt 保留用于校验历史哈希，并标记为 deprecated，登录成功后会自动升级为新方案
+pwd_context = CryptContext(
+    schemes=["sha256_crypt", "bcrypt"],
+    deprecated=["bcrypt"],
+    sha256_crypt__default_rounds=80000,
+)
 
 
 def _preprocess_password(password: str) -> str:
@@ -46,13 +52,28 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         raise
 
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    验证密码，并在哈希方案过时（如历史 bcrypt 哈希）时返回新哈希
+
+    Returns:
+        (是否验证成功, 新的密码哈希；无需升级时为 None)
+    """
+    preprocessed_password = _preprocess_password(plain_password)
+    try:
+        return pwd_context.verify_and_update(preprocessed_password, hashed_password)
+    except Exception as e:
+        logger.error(f"密码验证时发生错误: {e}")
+        raise
+
+
 def get_password_hash(password: str) -> str:
     """
     生成密码哈希
     
-    使用 SHA-256 + bcrypt 双重哈希：
-    1. 先用 SHA-256 将密码转换为固定长度（避免 bcrypt 72 字节限制）
-    2. 再用 bcrypt 进行二次哈希（提供盐值和慢速哈希）
+    使用 SHA-256 预处理 + sha256_crypt 哈希：
+    1. 先用 SHA-256 将密码转换为固定长度（兼容历史 bcrypt 哈希的 72 字节限制）
+    2. 再用 sha256_crypt 进行二次哈希（提供盐值和慢速哈希）
     """
     logger.info("开始生成密码哈希")
     
@@ -69,7 +90,7 @@ def get_password_hash(password: str) -> str:
         raise ValueError(f"预处理后的密码长度 {len(preprocessed_bytes)} 字节超过了 bcrypt 的 72 字节限制")
     
     try:
-        # 使用 bcrypt 进行二次哈希
+        # 使用默认方案（sha256_crypt）进行二次哈希
         hashed = pwd_context.hash(preprocessed_password)
         logger.info(f"密码哈希生成成功: 哈希值前20位={hashed[:20]}...")
         return hashed
@@ -1,12 +1,80 @@
-from typing import AsyncIterator, Dict, Any, Callable
-from app.core.schemas import StreamChunk
+from typing import AsyncIterator, Dict, Any, Callable, Optional
+import orjson
+from fastapi.responses import StreamingResponse
 
 
+# SSE 帧的固定前后缀预先编码为 bytes，每个数据块只需拼接 JSON 负载
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+
+# 高频的文本增量帧和完成帧只有一个字段是变量，其余部分预先拼好，只需序列化变量部分
+_SSE_DELTA_PREFIX = _SSE_PREFIX + b'{"chunk":'
+_SSE_DELTA_SUFFIX = b',"done":false,"usage":null,"meta":null}' + _SSE_SUFFIX
+_SSE_DONE_PREFIX = _SSE_PREFIX + b'{"chunk":"","done":true,"usage":'
+_SSE_DONE_SUFFIX = b',"meta":null}' + _SSE_SUFFIX
+
+# SSE 响应的公共响应头
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"  # 禁用 Nginx 缓冲
+}
+
+
+def encode_sse_chunk(
+    chunk: str,
+    done: bool = False,
+    usage: Optional[Dict[str, Any]] = None,
+    meta: Optional[Dict[str, Any]] = None
+) -> bytes:
+    """
+    将数据块编码为 SSE 帧（与 StreamChunk.model_dump_json() 输出一致）
+    
+    Args:
+        chunk: 数据块内容
+        done: 是否完成
+        usage: Token使用情况（仅在done=True时）
+        meta: 附加信息（如页码）
+        
+    Returns:
+        SSE 格式的 bytes
+    """
+    if meta is None:
+        if not done and usage is None:
+            return _SSE_DELTA_PREFIX + orjson.dumps(chunk) + _SSE_DELTA_SUFFIX
+        if done and not chunk:
+            return _SSE_DONE_PREFIX + orjson.dumps(usage) + _SSE_DONE_SUFFIX
+    payload = orjson.dumps({"chunk": chunk, "done": done, "usage": usage, "meta": meta})
+    return _SSE_PREFIX + payload + _SSE_SUFFIX
+
+
+
+def sse_response(sse_stream: AsyncIterator[bytes]) -> StreamingResponse:
+    """
+    构建 SSE 流式响应
+    
+    sse_stream 产出的是已编码好的 SSE 帧（见 encode_sse_chunk），响应层只做字节透传。
+    必须是异步迭代器：同步迭代器会被 Starlette 放到线程池中逐块迭代，开销大得多。
+    
+    Args:
+        sse_stream: SSE 帧异步迭代器
+        
+    Returns:
+        StreamingResponse
+    """
+    if not hasattr(sse_stream, "__aiter__"):
+        raise TypeError("SSE 流必须是异步迭代器（async generator）")
+    return StreamingResponse(
+        sse_stream,
+        media_type="text/event-stream",
+        headers=_SSE_HEADERS
+    )
+
 async def generate_sse_stream(
     openai_stream: AsyncIterator,
     conversation_id: str = None,
     on_complete: Callable[[str], None] = None
-) -> AsyncIterator[str]:
+) -> AsyncIterator[bytes]:
     """
     将 OpenAI 流式响应转换为 SSE 格式
     
@@ -16,7 +84,7 @@ async def generate_sse_stream(
         on_complete: 流完成时的回调函数，接收完整响应文本
         
     Yields:
-        SSE 格式的字符串
+        SSE 格式的 bytes
     """
     accumulated_text = ""
     usage_info = None
@@ -31,11 +99,7 @@ async def generate_sse_stream(
                     content = delta.content
                     accumulated_text += content
                     # 发送数据块
-                    stream_chunk = StreamChunk(
-                        chunk=content,
-                        done=False
-                    )
-                    yield f"data: {stream_chunk.model_dump_json()}\n\n"
+                    yield encode_sse_chunk(content)
                 
                 # 检查是否完成
                 if chunk.choices[0].finish_reason:
@@ -52,18 +116,9 @@ async def generate_sse_stream(
             on_complete(accumulated_text)
         
         # 发送完成信号
-        final_chunk = StreamChunk(
-            chunk="",
-            done=True,
-            usage=usage_info
-        )
-        yield f"data: {final_chunk.model_dump_json()}\n\n"
+        yield encode_sse_chunk("", done=True, usage=usage_info)
         
     except Exception as e:
         # 错误处理
-        error_chunk = StreamChunk(
-            chunk=f"Error: {str(e)}",
-            done=True
-        )
-        yield f"data: {error_chunk.model_dump_json()}\n\n"
+        yield encode_sse_chunk(f"Error: {str(e)}", done=True)
 
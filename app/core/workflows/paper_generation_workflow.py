@@ -1,12 +1,13 @@
 """论文生成工作流 - 整合三个 Agent"""
+import asyncio
 from typing import Dict, Any, Optional, AsyncIterator
 from pathlib import Path
 from fastapi import UploadFile
 from app.core.agents.paper_overview_agent import PaperOverviewAgent
 from app.core.agents.latex_paper_generator_agent import LaTeXPaperGeneratorAgent
 from app.core.agents.requirement_checklist_agent import RequirementChecklistAgent
-from app.core.schemas import WorkflowProgressChunk, PaperGenerationWorkflowResponse, PaperOverviewResult, LaTeXPaperResult, RequirementChecklistResult
-from app.utils.file_manager import create_session_folder, save_file, get_file_path, save_uploaded_file, save_artifact
+from app.core.schemas import WorkflowProgressChunk, PaperGenerationWorkflowResponse
+from app.utils.file_manager import create_session_folder, save_file, get_file_path, save_uploaded_file, copy_uploaded_file, save_artifact
 from app.utils.token_tracker import record_usage_from_dict
 from app.utils.logger import logger
 
@@ -36,6 +37,7 @@ class PaperGenerationWorkflow:
         model: Optional[str] = None,
         pdf_file: Optional[UploadFile] = None,
         pdf_content: Optional[bytes] = None,
+        pdf_path: Optional[str] = None,
         pdf_filename: Optional[str] = None,
         username: Optional[str] = None,
         user_id: Optional[str] = None,
@@ -53,6 +55,9 @@ class PaperGenerationWorkflow:
             temperature: 温度参数
             max_tokens: 最大token数
             model: 模型名称
+            pdf_content: 上传的PDF内容
+            pdf_path: 已落盘的上传PDF路径（优先于 pdf_content，按文件复制不读入内存）
+            pdf_filename: 上传的PDF文件名
             
         Returns:
             {
@@ -87,8 +92,23 @@ class PaperGenerationWorkflow:
         logger.info("=" * 80)
         
         # 1.1 保存上传的PDF文件（如果有）
-        if pdf_content and pdf_filename:
-            # 优先使用直接传递的PDF内容（避免文件关闭问题）
+        if pdf_path and pdf_filename:
+            # 优先使用已落盘的PDF文件（大文件不必读入内存）
+            try:
+                pdf_file_path = await asyncio.to_thread(
+                    copy_uploaded_file,
+                    session_folder=session_folder,
+                    file_name=pdf_filename,
+                    source_path=pdf_path
+                )
+                logger.info(f"✓ PDF file saved: {pdf_file_path}")
+                
+                if has_outline:
+                    logger.info("用户已选择PDF为大纲/初稿（将跳过 LaTeX 生成）")
+            except Exception as e:
+                logger.error(f"Failed to save PDF file: {str(e)}")
+        elif pdf_content and pdf_filename:
+            # 使用直接传递的PDF内容（避免文件关闭问题）
             try:
                 pdf_file_path = save_uploaded_file(
                     session_folder=session_folder,
@@ -405,7 +425,7 @@ class PaperGenerationWorkflow:
                 results["total_usage"]["completion_tokens"] += checklist_result["usage"].get("completion_tokens", 0)
                 results["total_usage"]["total_tokens"] += checklist_result["usage"].get("total_tokens", 0)
                 
-                # 记录 token 使用到数据库
+                # 记录 token 使用到数据库（最后一个阶段只 flush，与调用方的 token 结算在同一事务中提交）
                 if user_id and db_session:
                     try:
                         record_usage_from_dict(
@@ -414,7 +434,8 @@ class PaperGenerationWorkflow:
                             usage_dict=checklist_result["usage"],
                             model=model,
                             stage="requirement_checklist",
-                            session_id=session_id
+                            session_id=session_id,
+                            commit=False
                         )
                     except Exception as e:
                         logger.error(f"Failed to record token usage for requirement_checklist: {str(e)}")
@@ -445,6 +466,7 @@ class PaperGenerationWorkflow:
         model: Optional[str] = None,
         pdf_file: Optional[UploadFile] = None,
         pdf_content: Optional[bytes] = None,
+        pdf_path: Optional[str] = None,
         pdf_filename: Optional[str] = None,
         username: Optional[str] = None,
         user_id: Optional[str] = None,
@@ -471,11 +493,42 @@ class PaperGenerationWorkflow:
         # 1.1 保存上传的PDF文件（如果有）
         logger.info("检查PDF文件参数...")
         logger.info(f"pdf_content is None: {pdf_content is None}")
+        logger.info(f"pdf_path: {pdf_path}")
         logger.info(f"pdf_filename: {pdf_filename}")
         logger.info(f"pdf_file is None: {pdf_file is None}")
         
-        if pdf_content and pdf_filename:
-            # 优先使用直接传递的PDF内容（避免文件关闭问题）
+        if pdf_path and pdf_filename:
+            # 优先使用已落盘的PDF文件（大文件不必读入内存）
+            logger.info(f"使用已落盘的PDF文件保存: {pdf_filename}, 路径: {pdf_path}")
+            try:
+                pdf_file_path = await asyncio.to_thread(
+                    copy_uploaded_file,
+                    session_folder=session_folder,
+                    file_name=pdf_filename,
+                    source_path=pdf_path
+                )
+                logger.info(f"✓ PDF文件保存成功: {pdf_file_path}")
+                yield WorkflowProgressChunk(
+                    type="log",
+                    message=f"✓ PDF文件已保存: {pdf_filename}",
+                    done=False
+                )
+                
+                if has_outline:
+                    yield WorkflowProgressChunk(
+                        type="log",
+                        message="用户已选择PDF为大纲/初稿（将跳过 LaTeX 生成）",
+                        done=False
+                    )
+            except Exception as e:
+                logger.error(f"保存PDF文件失败: {str(e)}")
+                yield WorkflowProgressChunk(
+                    type="log",
+                    message=f"保存PDF文件失败: {str(e)}",
+                    done=False
+                )
+        elif pdf_content and pdf_filename:
+            # 使用直接传递的PDF内容（避免文件关闭问题）
             logger.info(f"使用直接传递的PDF内容保存文件: {pdf_filename}, 大小: {len(pdf_content)} 字节")
             try:
                 pdf_file_path = save_uploaded_file(
@@ -954,7 +1007,7 @@ class PaperGenerationWorkflow:
                 results["total_usage"]["completion_tokens"] += checklist_result["usage"].get("completion_tokens", 0)
                 results["total_usage"]["total_tokens"] += checklist_result["usage"].get("total_tokens", 0)
                 
-                # 记录 token 使用到数据库
+                # 记录 token 使用到数据库（最后一个阶段只 flush，与调用方的 token 结算在同一事务中提交）
                 if user_id and db_session:
                     try:
                         record_usage_from_dict(
@@ -963,7 +1016,8 @@ class PaperGenerationWorkflow:
                             usage_dict=checklist_result["usage"],
                             model=model,
                             stage="requirement_checklist",
-                            session_id=session_id
+                            session_id=session_id,
+                            commit=False
                         )
                     except Exception as e:
                         logger.error(f"Failed to record token usage for requirement_checklist (stream): {str(e)}")
@@ -986,28 +1040,14 @@ class PaperGenerationWorkflow:
             raise
         
         # 5. 发送最终结果
-        final_response = PaperGenerationWorkflowResponse(
-            session_id=results["session_id"],
-            session_folder=results["session_folder"],
-            paper_overview=PaperOverviewResult(
-                file_name=results["paper_overview"]["file_name"],
-                file_path=results["paper_overview"]["file_path"],
-                usage=results["paper_overview"].get("usage")
-            ),
-            latex_paper=LaTeXPaperResult(
-                file_name=results["latex_paper"].get("file_name"),
-                file_path=results["latex_paper"].get("file_path"),
-                is_skipped=results["latex_paper"]["is_skipped"],
-                skip_reason=results["latex_paper"].get("skip_reason"),
-                usage=results["latex_paper"].get("usage")
-            ),
-            requirement_checklist=RequirementChecklistResult(
-                file_name=results["requirement_checklist"]["file_name"],
-                file_path=results["requirement_checklist"]["file_path"],
-                usage=results["requirement_checklist"].get("usage")
-            ),
-            total_usage=results["total_usage"]
-        )
+        final_response = PaperGenerationWorkflowResponse.model_validate({
+            "session_id": results["session_id"],
+            "session_folder": results["session_folder"],
+            "paper_overview": results["paper_overview"],
+            "latex_paper": results["latex_paper"],
+            "requirement_checklist": results["requirement_checklist"],
+            "total_usage": results["total_usage"]
+        })
         
         yield WorkflowProgressChunk(
             type="result",
@@ -4,7 +4,7 @@ import asyncio
 import json
 import os
 import random
-import re
+import threading
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
@@ -26,8 +26,10 @@ from app.services.anthropic_service import AnthropicService
 from app.services.hot_phrase_service import get_recent_hot_phrases
 from app.services.openai_service import OpenAIService
 from app.utils.file_manager import save_artifact
+from app.utils.image_resizer import downscale_image
 from app.utils.logger import logger
-from app.utils.pdf_converter import pdf_to_pngs
+from app.utils.pdf_converter import get_pdf_page_count, iter_pdf_to_pngs
+from app.utils.vision_cache import get_cached_ocr, ocr_cache_key, set_cached_ocr
 from app.config.settings import reload_settings
 
 
@@ -129,7 +131,7 @@ async def run_pdf_ocr_step(
 
     This step:
     - Reads generated/papers_manifest.json
-    - For each paper's PDF, runs pdf_to_pngs + VisionAgent OCR with controlled concurrency
+    - For each paper's PDF, renders PNG pages and runs VisionAgent OCR on each page as soon as it is rendered, with controlled concurrency
     - Writes artifact/pdf_processing.json
     - Updates papers_manifest.json with OCR paths & status
 
@@ -206,60 +208,39 @@ async def run_pdf_ocr_step(
         )
 
         try:
-            png_paths = pdf_to_pngs(
-                pdf_path=str(pdf_path),
-                output_dir=str(images_dir),
-                dpi=300,
-            )
+            total_pages = await asyncio.to_thread(get_pdf_page_count, str(pdf_path))
         except Exception as e:  # noqa: BLE001
-            logger.exception("pdf_to_pngs failed for %s: %s", paper_id, e)
+            logger.exception("Failed to open PDF for %s: %s", paper_id, e)
             paper["status"] = "failed"
             result["status"] = "failed"
             result["error"] = f"pdf_to_pngs failed: {e}"
             return result
 
-        if not png_paths:
+        page_count = total_pages
+        if resolved_page_limit is not None and resolved_page_limit < total_pages:
+            logger.info(
+                "Limiting OCR for %s to first %d pages (total=%d)",
+                paper_id,
+                resolved_page_limit,
+                total_pages,
+            )
+            page_count = resolved_page_limit
+
+        result["page_count"] = page_count
+        if page_count == 0:
             logger.error("No PNG pages generated for %s", paper_id)
             paper["status"] = "failed"
             result["status"] = "failed"
             result["error"] = "No PNG pages generated"
             return result
 
-        logger.info("PDF %s converted to %d PNG pages", paper_id, len(png_paths))
-
-        def _page_sort_key(path: str) -> tuple[int, str]:
-            """
-            Extract numeric page index if present to keep OCR ordering consistent.
-            Falls back to lexical order to avoid crashes on unexpected filenames.
-            """
-            stem = Path(path).stem
-            match = re.search(r"_page_(\d+)", stem)
-            if match:
-                return (int(match.group(1)), stem)
-            return (0, stem)
-
-        sorted_png_paths = sorted(png_paths, key=_page_sort_key)
-        if resolved_page_limit is not None:
-            limited_paths = sorted_png_paths[:resolved_page_limit]
-            if len(limited_paths) < len(sorted_png_paths):
-                logger.info(
-                    "Limiting OCR for %s to first %d pages (total=%d)",
-                    paper_id,
-                    len(limited_paths),
-                    len(sorted_png_paths),
-                )
-            sorted_png_paths = limited_paths
-
-        result["page_count"] = len(sorted_png_paths)
-        if not sorted_png_paths:
-            logger.error("No PNG pages selected for OCR for %s", paper_id)
-            paper["status"] = "failed"
-            result["status"] = "failed"
-            result["error"] = "No PNG pages selected for OCR"
-            return result
-
         # 页面级并发处理
         page_semaphore = asyncio.Semaphore(max_concurrent_pages)
+        ocr_prompt = (
+            "请直接输出图片中的所有文字内容、图表、表格、公式等，"
+            "不要添加任何描述、说明或解释。保持原有的结构和格式信息。"
+        )
+        ocr_temperature = 0.3
 
         async def process_single_page(
             page_idx: int, png_path: str
@@ -268,34 +249,52 @@ async def run_pdf_ocr_step(
             处理单页 OCR
             返回: (page_idx, text, usage, error)
             """
+            # 同一论文页面（重复下载/重跑的论文）按图片内容命中 OCR 缓存时跳过 Vision 调用，不重复计费
+            try:
+                png_data = await asyncio.to_thread(Path(png_path).read_bytes)
+            except OSError as e:
+                logger.exception(
+                    "Failed to read page image for paper %s page %d: %s", paper_id, page_idx, e
+                )
+                return (page_idx, "", {}, f"OCR failed on page {page_idx}: {e}")
+            cache_key = ocr_cache_key(png_data, ocr_prompt, None, ocr_temperature)
+            cached_text = await get_cached_ocr(cache_key)
+            if cached_text is not None:
+                logger.info(
+                    "OCR cache hit for paper %s page %d/%d",
+                    paper_id,
+                    page_idx,
+                    page_count,
+                )
+                return (page_idx, cached_text, {}, None)
+
             async with page_semaphore:
                 try:
                     logger.info(
                         "OCR on paper %s page %d/%d: %s",
                         paper_id,
                         page_idx,
-                        len(sorted_png_paths),
+                        page_count,
                         png_path,
                     )
-                    ocr_prompt = (
-                        "请直接输出图片中的所有文字内容、图表、表格、公式等，"
-                        "不要添加任何描述、说明或解释。保持原有的结构和格式信息。"
-                    )
+                    # 300 DPI 的整页 PNG 有数 MB，先等比缩小并转为 JPEG 再上传，减少上传数据量和图片 token
+                    ocr_image = await asyncio.to_thread(downscale_image, png_data)
                     ocr_result = await vision_agent.extract_text_from_image(
-                        image=png_path,
+                        image=ocr_image,
                         text_prompt=ocr_prompt,
-                        temperature=0.3,
+                        temperature=ocr_temperature,
                         max_tokens=10000,
                         model=None,
                     )
                     text = ocr_result.get("response") or ""
                     usage = ocr_result.get("usage") or {}
+                    await set_cached_ocr(cache_key, text, usage)
 
                     logger.info(
                         "OCR completed for paper %s page %d/%d",
                         paper_id,
                         page_idx,
-                        len(sorted_png_paths),
+                        page_count,
                     )
 
                     return (page_idx, text, usage, None)
@@ -306,36 +305,63 @@ async def run_pdf_ocr_step(
                     return (page_idx, "", {}, f"OCR failed on page {page_idx}: {e}")
 
         logger.info(
-            "Starting concurrent OCR for paper %s: %d pages (max_concurrent=%d)",
+            "Starting pipelined PNG rendering and OCR for paper %s: %d pages (max_concurrent=%d)",
             paper_id,
-            len(sorted_png_paths),
+            page_count,
             max_concurrent_pages,
         )
 
-        page_results = await asyncio.gather(
-            *[
-                process_single_page(page_idx, png_path)
-                for page_idx, png_path in enumerate(sorted_png_paths, start=1)
-            ],
-            return_exceptions=True,
-        )
+        # 渲染与 OCR 流水线并行：渲染线程每落盘一页就交给 OCR，不必等整份 PDF 渲染完
+        loop = asyncio.get_running_loop()
+        rendered_pages: asyncio.Queue = asyncio.Queue()
+        stop_rendering = threading.Event()
 
-        # 按页面索引排序并处理结果
-        page_texts: List[str] = [""] * len(sorted_png_paths)
+        def render_pages() -> None:
+            try:
+                for png_path in iter_pdf_to_pngs(
+                    str(pdf_path), str(images_dir), dpi=300, max_pages=page_count
+                ):
+                    if stop_rendering.is_set():
+                        return
+                    loop.call_soon_threadsafe(rendered_pages.put_nowait, png_path)
+            finally:
+                loop.call_soon_threadsafe(rendered_pages.put_nowait, None)
+
+        render_task = asyncio.create_task(asyncio.to_thread(render_pages))
+        page_tasks: List[asyncio.Task] = []
+        try:
+            while (png_path := await rendered_pages.get()) is not None:
+                page_tasks.append(
+                    asyncio.create_task(process_single_page(len(page_tasks) + 1, png_path))
+                )
+            await render_task
+            page_results = await asyncio.gather(*page_tasks, return_exceptions=True)
+        except Exception as e:  # noqa: BLE001
+            logger.exception("pdf_to_pngs failed for %s: %s", paper_id, e)
+            paper["status"] = "failed"
+            result["status"] = "failed"
+            result["error"] = f"pdf_to_pngs failed: {e}"
+            return result
+        finally:
+            # 渲染失败或整个步骤被取消时，停止渲染并取消尚未完成的页面
+            stop_rendering.set()
+            for task in page_tasks:
+                task.cancel()
+
+        logger.info("PDF %s converted to %d PNG pages", paper_id, len(page_tasks))
+
+        # gather 按提交（页面）顺序返回结果，每页结果按页面索引写回对应位置
+        page_texts: List[str] = [""] * page_count
         failed_pages: List[tuple[int, str]] = []
 
-        valid_results = []
         for page_result in page_results:
             if isinstance(page_result, Exception):
                 logger.error(
                     "Unexpected exception in page processing: %s", page_result
                 )
                 continue
-            valid_results.append(page_result)
-
-        valid_results.sort(key=lambda x: x[0])
 
-        for page_idx, text, usage, error in valid_results:
+            page_idx, text, usage, error = page_result
             if error:
                 failed_pages.append((page_idx, error))
                 result["status"] = "failed"
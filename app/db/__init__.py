@@ -1,6 +1,7 @@
 """数据库模块"""
 from app.db.database import engine, SessionLocal, Base
+from app.db.async_database import async_engine, AsyncSessionLocal
 from app.db.models import User, Session, Task
 
-__all__ = ["engine", "SessionLocal", "Base", "User", "Session", "Task"]
+__all__ = ["engine", "SessionLocal", "async_engine", "AsyncSessionLocal", "Base", "User", "Session", "Task"]
 
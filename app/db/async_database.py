@@ -0,0 +1,36 @@
+"""异步数据库连接配置"""
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from app.config.settings import settings
+
+# 创建异步数据库引擎（asyncpg 驱动，不阻塞事件循环）
+if settings.db_use_null_pool:
+    # 由 PgBouncer 等外部连接池负责复用连接
+    async_engine = create_async_engine(
+        settings.async_database_url,
+        poolclass=NullPool,
+    )
+else:
+    async_engine = create_async_engine(
+        settings.async_database_url,
+        pool_pre_ping=True,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+    )
+
+# 创建异步会话工厂
+# expire_on_commit=False：提交后仍可直接读取已加载的属性，避免隐式 IO
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+async def get_async_db():
+    """获取异步数据库会话"""
+    async with AsyncSessionLocal() as db:
+        yield db
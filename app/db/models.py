@@ -1,6 +1,6 @@
 """数据库模型"""
-from sqlalchemy import Column, String, Integer, DateTime, Boolean, Text, ForeignKey, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, Integer, DateTime, Boolean, Text, ForeignKey, JSON, Index
+from sqlalchemy.orm import relationship, column_property
 from sqlalchemy.sql import func
 from app.db.database import Base
 import uuid
@@ -20,6 +20,8 @@ class User(Base):
     max_concurrent_workflows = Column(Integer, default=10, nullable=False)  # 最大并发workflow数，默认10
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    # created_at 的 ISO 8601 字符串，由数据库随行一并渲染，序列化时无需再调用 isoformat()
+    created_at_iso = column_property(func.to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS.USTZH:TZM'))
     
     # 关系
     sessions = relationship("Session", back_populates="user", cascade="all, delete-orphan")
@@ -45,6 +47,12 @@ class Session(Base):
 class Task(Base):
     """任务模型"""
     __tablename__ = "tasks"
+    __table_args__ = (
+        # 创建任务时按 user_id 统计总数与 running 数，复合索引让计数只扫描该用户的索引区间；
+        # 启动工作流时的 running 数检查（user_id = ? AND status = 'running'）两列都是等值条件，
+        # 同一索引只扫描运行中的几行，因此不再单独建 status = 'running' 的部分索引
+        Index("ix_tasks_user_status", "user_id", "status"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     task_id = Column(String(255), unique=True, nullable=False, index=True)
@@ -98,6 +106,10 @@ class Task(Base):
 class TokenUsage(Base):
     """Token 使用记录模型"""
     __tablename__ = "token_usage"
+    __table_args__ = (
+        # 统计接口均按 user_id 过滤并按 created_at 过滤/倒序，复合索引可直接做范围扫描
+        Index("ix_token_usage_user_created", "user_id", "created_at"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String, ForeignKey("users.id"), nullable=False, index=True)
@@ -1,16 +1,32 @@
 """数据库仓储：arXiv 爬虫"""
 from __future__ import annotations
 
-from typing import Iterable, List, Optional, Tuple
+from typing import Iterable, List, Optional, Sequence, Tuple
 from datetime import datetime
 
 from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import or_
+from sqlalchemy import Row, func, or_, select
 from sqlalchemy.dialects.postgresql import insert
 
 from app.db.models import ArxivCrawlRun, ArxivPaper
 
 
+# 论文列表只需要的列（避免 ORM 实体装载与属性插桩开销）
+_PAPER_LIST_COLUMNS = (
+    ArxivPaper.id,
+    ArxivPaper.arxiv_id,
+    ArxivPaper.title,
+    ArxivPaper.authors,
+    ArxivPaper.subjects,
+    ArxivPaper.abstract,
+    ArxivPaper.detail_title,
+    ArxivPaper.detail_dateline,
+    ArxivPaper.algorithm_phrase,
+    ArxivPaper.metadata_json,
+    ArxivPaper.created_at,
+)
+
+
 class ArxivRepository:
     """封装 arXiv 爬虫相关的数据库操作"""
 
@@ -54,19 +70,28 @@ class ArxivRepository:
         result = self.session.execute(stmt)
         return result.rowcount or len(rows)
 
-    def list_papers(self, skip: int = 0, limit: int = 20, keyword: Optional[str] = None) -> Tuple[int, List[ArxivPaper]]:
-        query = self.session.query(ArxivPaper).order_by(ArxivPaper.created_at.desc())
+    def list_papers(self, skip: int = 0, limit: int = 20, keyword: Optional[str] = None) -> Tuple[int, Sequence[Row]]:
+        filters = []
         if keyword:
             pattern = f"%{keyword}%"
-            query = query.filter(
+            filters.append(
                 or_(
                     ArxivPaper.title.ilike(pattern),
                     ArxivPaper.abstract.ilike(pattern),
                     ArxivPaper.arxiv_id.ilike(pattern),
                 )
             )
-        total = query.count()
-        items = query.offset(skip).limit(limit).all()
+        total = self.session.execute(
+            select(func.count()).select_from(ArxivPaper).where(*filters)
+        ).scalar_one()
+        stmt = (
+            select(*_PAPER_LIST_COLUMNS)
+            .where(*filters)
+            .order_by(ArxivPaper.created_at.desc())
+            .offset(skip)
+            .limit(limit)
+        )
+        items = self.session.execute(stmt).all()
         return total, items
 
     # Read operations
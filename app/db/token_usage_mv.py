@@ -0,0 +1,87 @@
+"""Token 使用按日聚合的物化视图"""
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import Column, DateTime, Integer, String, Table, MetaData, func, select, text
+from app.db.database import engine
+from app.utils.logger import logger
+
+
+TOKEN_USAGE_DAILY_MV = "token_usage_daily_mv"
+
+# 物化视图不归 Base.metadata 管理（create_all 不能创建视图），单独声明以便在查询中引用
+token_usage_daily_mv = Table(
+    TOKEN_USAGE_DAILY_MV,
+    MetaData(),
+    Column("user_id", String),
+    Column("day", DateTime(timezone=True)),
+    Column("stage", String),
+    Column("model", String),
+    Column("prompt_tokens", Integer),
+    Column("completion_tokens", Integer),
+    Column("total_tokens", Integer),
+    Column("record_count", Integer),
+)
+
+_CREATE_MV_SQL = f"""
+CREATE MATERIALIZED VIEW IF NOT EXISTS {TOKEN_USAGE_DAILY_MV} AS
+SELECT
+    user_id,
+    date_trunc('day', created_at) AS day,
+    stage,
+    model,
+    SUM(prompt_tokens) AS prompt_tokens,
+    SUM(completion_tokens) AS completion_tokens,
+    SUM(total_tokens) AS total_tokens,
+    COUNT(*) AS record_count
+FROM token_usage
+GROUP BY 1, 2, 3, 4
+"""
+
+# REFRESH ... CONCURRENTLY 要求物化视图上存在唯一索引
+_CREATE_MV_INDEX_SQL = f"""
+CREATE UNIQUE INDEX IF NOT EXISTS ux_{TOKEN_USAGE_DAILY_MV}
+ON {TOKEN_USAGE_DAILY_MV} (user_id, day, stage, model)
+"""
+
+# 本进程内成功刷新的次数，用作物化视图的数据版本（如 /summary 的 ETag）
+_refresh_version = 0
+# 本进程最近一次成功刷新时数据库的当天零点：早于该时间的各天在物化视图中已完整
+_complete_before: Optional[datetime] = None
+
+
+def ensure_token_usage_daily_mv() -> None:
+    """创建物化视图及其唯一索引（已存在则跳过）"""
+    with engine.connect() as conn:
+        conn.execute(text(_CREATE_MV_SQL))
+        conn.execute(text(_CREATE_MV_INDEX_SQL))
+        conn.commit()
+
+
+def get_token_usage_daily_mv_version() -> int:
+    """获取物化视图的数据版本，每次刷新成功后递增"""
+    return _refresh_version
+
+
+def get_token_usage_daily_mv_complete_before() -> Optional[datetime]:
+    """
+    获取物化视图已完整覆盖的日期上界（不含），本进程尚未成功刷新时返回 None
+
+    刷新开始时已经结束的日期才会完整计入物化视图；刷新前跨过零点时，
+    前一天的数据仍需从明细表读取，否则会漏掉上次刷新之后写入的记录。
+    """
+    return _complete_before
+
+
+def refresh_token_usage_daily_mv() -> None:
+    """刷新物化视图（CONCURRENTLY，不阻塞读取）"""
+    global _refresh_version, _complete_before
+    try:
+        with engine.connect() as conn:
+            # 与刷新在同一事务内取数据库时间，刷新看到的数据不早于该时刻
+            complete_before = conn.execute(select(func.date_trunc('day', func.now()))).scalar_one()
+            conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {TOKEN_USAGE_DAILY_MV}"))
+            conn.commit()
+        _refresh_version += 1
+        _complete_before = complete_before
+    except Exception as e:
+        logger.error(f"Failed to refresh {TOKEN_USAGE_DAILY_MV}: {e}")
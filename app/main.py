@@ -4,6 +4,7 @@ from app.config.settings import settings, proxy_manager
 from app.api.v1.router import api_router
 from app.utils.logger import logger
 from app.db.database import engine, Base
+from app.db.token_usage_mv import ensure_token_usage_daily_mv, refresh_token_usage_daily_mv
 from app.utils.provider_health import check_llm_connectivity
 from app.services.crawler_service import MonthlyArxivSyncService
 from app.core.scheduler import init_scheduler
@@ -46,6 +47,15 @@ async def startup_event():
         logger.error(f"Failed to create database tables: {e}")
         raise
     
+    # 创建 Token 使用统计的物化视图（create_all 不负责视图）
+    try:
+        ensure_token_usage_daily_mv()
+    except Exception as e:
+        logger.error(f"Failed to create token usage materialized view: {e}")
+        raise
+    # 启动时先刷新一次，之后由调度器定期刷新，避免历史数据停留在上次运行时的状态
+    refresh_token_usage_daily_mv()
+    
     # 启动时检查代理可用性
     logger.info("Checking proxy availability...")
     proxy_available = await proxy_manager.is_proxy_available(force_check=True)
@@ -69,9 +79,7 @@ async def startup_event():
     # 初始化 arXiv 爬虫服务与调度
     crawl_service = MonthlyArxivSyncService()
     app.state.crawl_service = crawl_service
-    scheduler = init_scheduler(crawl_service)
-    if scheduler:
-        app.state.scheduler = scheduler
+    app.state.scheduler = init_scheduler(crawl_service)
 
 
 @app.on_event("shutdown")
@@ -99,6 +99,20 @@ class AnthropicService:
             图片内容块字典
         """
         base64_data = AnthropicService.encode_image_to_base64(image_data, media_type)
+        return AnthropicService.create_base64_image_block(base64_data, media_type)
+    
+    @staticmethod
+    def create_base64_image_block(base64_data: str, media_type: str = "image/jpeg") -> Dict[str, Any]:
+        """
+        使用已编码的 base64 字符串创建图片内容块（不再重复编码）
+        
+        Args:
+            base64_data: base64 编码的图片数据
+            media_type: 图片类型 (image/jpeg, image/png, image/gif, image/webp)
+            
+        Returns:
+            图片内容块字典
+        """
         return {
             "type": "image",
             "source": {
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import partial
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, List, Optional
 
 # TODO: Move ArxivCrawler/save_to_json into app/services (see ticket #?)
 from lab.crawl_ai import ArxivCrawler, save_to_json
@@ -39,6 +41,8 @@ class MonthlyArxivSyncService:
         self._session_factory = session_factory
         self._crawler_cls = crawler_cls
         self._lock = asyncio.Lock()
+        # 抓取、解析与入库全部在独立的单线程执行器中完成，避免阻塞 API 所在的事件循环
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="arxiv-crawl")
 
     async def run_once(self, *, persist: bool = True, output_path: Optional[str] = None) -> CrawlResult:
         if self._lock.locked():
@@ -54,12 +58,16 @@ class MonthlyArxivSyncService:
             )
 
         async with self._lock:
-            return await self._execute_run(persist=persist, output_path=output_path)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor,
+                partial(self._execute_run, persist=persist, output_path=output_path),
+            )
 
     def is_running(self) -> bool:
         return self._lock.locked()
 
-    async def _execute_run(self, *, persist: bool, output_path: Optional[str]) -> CrawlResult:
+    def _execute_run(self, *, persist: bool, output_path: Optional[str]) -> CrawlResult:
         start_time = datetime.utcnow()
         session = None
         repo = None
@@ -81,7 +89,7 @@ class MonthlyArxivSyncService:
             session.refresh(crawl_run)
 
         try:
-            result = await self._launch_crawler()
+            result = self._build_crawler().run()
             new_papers = result.get("new_papers") or []
             total_papers = result.get("total_papers") or 0
             hot_phrases = result.get("hot_phrases") or []
@@ -172,11 +180,6 @@ class MonthlyArxivSyncService:
             if session:
                 session.close()
 
-    async def _launch_crawler(self) -> Dict[str, Any]:
-        crawler = self._build_crawler()
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, crawler.run)
-
     def _build_crawler(self) -> ArxivCrawler:
         crawler_kwargs = {
             "base_url": settings.arxiv_base_url,
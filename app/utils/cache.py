@@ -0,0 +1,46 @@
+"""进程内短 TTL 缓存工具"""
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+
+class TTLCache:
+    """
+    简单的进程内 TTL 缓存
+
+    后端以单进程方式运行（start_server.py），因此不引入 Redis，直接在进程内缓存。
+    适合高频轮询、可容忍数秒陈旧的数据；写操作后应调用 delete 主动失效。
+    指定 maxsize 时按最近最少使用（LRU）淘汰，避免长 TTL 的缓存无限增长。
+    """
+
+    def __init__(self, maxsize: Optional[int] = None):
+        self._store: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._maxsize = maxsize
+
+    def get(self, key: str) -> Optional[Any]:
+        """获取缓存值，不存在或已过期返回 None"""
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._store.pop(key, None)
+            return None
+        self._store.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """写入缓存值，ttl 单位为秒"""
+        self._store[key] = (time.monotonic() + ttl, value)
+        self._store.move_to_end(key)
+        if self._maxsize is not None and len(self._store) > self._maxsize:
+            self._store.popitem(last=False)
+
+    def delete(self, *keys: str) -> None:
+        """删除一个或多个缓存键"""
+        for key in keys:
+            self._store.pop(key, None)
+
+
+# 全局缓存实例
+cache = TTLCache()
@@ -0,0 +1,154 @@
+"""异步并发工具"""
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Sequence, Tuple, TypeVar
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def bounded_as_completed(
+    items: Sequence[T],
+    worker: Callable[[T], Awaitable[R]],
+    concurrency: int
+) -> AsyncIterator[Tuple[int, R]]:
+    """
+    固定数量的 worker 从队列中按顺序取出元素并发处理，按完成顺序产出 (元素索引, 结果)
+
+    与"每个元素创建一个 Task 再 gather"相比，同一时间最多只有 concurrency 个协程在运行，
+    其余元素留在队列中等待。worker 抛出的异常在产出时重新抛出；
+    迭代提前结束（异常、取消或调用方 break）时取消所有 worker。
+    """
+    pending: asyncio.Queue = asyncio.Queue()
+    for index, item in enumerate(items):
+        pending.put_nowait((index, item))
+    completed: asyncio.Queue = asyncio.Queue()
+
+    async def run() -> None:
+        while True:
+            try:
+                index, item = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                completed.put_nowait((index, await worker(item), None))
+            except asyncio.CancelledError as e:
+                # worker 自身被取消时直接退出；元素内部等待的 Future 被取消时作为该元素的异常交给调用方
+                if asyncio.current_task().cancelling():
+                    raise
+                completed.put_nowait((index, None, e))
+            except Exception as e:
+                completed.put_nowait((index, None, e))
+
+    workers = [asyncio.create_task(run()) for _ in range(min(concurrency, len(items)))]
+    try:
+        for _ in range(len(items)):
+            index, result, error = await completed.get()
+            if error is not None:
+                raise error
+            yield index, result
+    finally:
+        for task in workers:
+            task.cancel()
+
+
+async def bounded_map(
+    items: Sequence[T],
+    worker: Callable[[T], Awaitable[R]],
+    concurrency: int
+) -> List[R]:
+    """
+    用固定数量的 worker 并发处理所有元素，按输入顺序返回结果（见 bounded_as_completed）
+    """
+    results: List[R] = [None] * len(items)
+    async with aclosing(bounded_as_completed(items, worker, concurrency)) as completed:
+        async for index, result in completed:
+            results[index] = result
+    return results
+
+
+class AsyncRateLimiter:
+    """
+    按固定最小间隔放行请求的异步限速器（容量为 1 的令牌桶）
+
+    并发上限只约束同时进行的请求数，短请求仍可能在瞬间集中发出；
+    限速器把请求均匀摊开，使发送速率保持在 rate 以下。rate <= 0 表示不限速。
+    """
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+
+    async def acquire(self) -> None:
+        """等待到下一个可用的发送时间点"""
+        if not self._interval:
+            return
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class SingleFlight:
+    """
+    合并同一 key 的并发异步调用（single-flight）
+
+    第一个调用方启动任务，调用进行期间同一 key 的其余调用方等待同一任务的结果，不再重复执行。
+    任务运行在独立的 asyncio.Task 中：某个等待方被取消不影响其他等待方，所有等待方都取消后任务随之取消。
+    任务结束后立即移除 key，不缓存结果（结果缓存由调用方自行负责）。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, "_FlightCall"] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[R]]) -> Tuple[R, bool]:
+        """
+        执行或加入 key 对应的调用
+
+        Returns:
+            (结果, 是否为共享结果)；同一次调用中最先拿到结果的等待方 shared 为 False，其余为 True
+            （调用方据此只为一次实际调用计费）
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _FlightCall(asyncio.ensure_future(func()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+
+        call.waiters += 1
+        try:
+            result = await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done() and call.waiters == 1:
+                # 最后一个等待方离开：取消任务，并立即移除 key，之后的调用方重新发起
+                call.task.cancel()
+                self._forget(key, call)
+            raise
+        finally:
+            call.waiters -= 1
+
+        shared = call.claimed
+        call.claimed = True
+        return result, shared
+
+    def _forget(self, key: Hashable, call: "_FlightCall") -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+
+class _FlightCall:
+    """SingleFlight 中进行中的一次调用"""
+
+    __slots__ = ("task", "waiters", "claimed")
+
+    def __init__(self, task: "asyncio.Future"):
+        self.task = task
+        self.waiters = 0
+        self.claimed = False
@@ -2,7 +2,10 @@
 import os
 import json
 import errno
+import shutil
 import stat
+import tempfile
+import time
 from pathlib import Path
 from typing import Optional, Dict, Any
 from datetime import datetime
@@ -11,6 +14,11 @@ from app.config.settings import settings
 from app.utils.logger import logger
 
 
+# 上传文件在处理期间暂存到系统临时目录，统一使用以下前缀，便于清理进程异常退出时遗留的文件
+WORKFLOW_UPLOAD_TEMP_PREFIX = "workflow_upload_"
+VISION_UPLOAD_TEMP_PREFIX = "vision_upload_"
+
+
 def ensure_output_dir() -> Path:
     """确保输出目录存在"""
     output_path = Path(settings.output_dir)
@@ -149,6 +157,32 @@ def save_uploaded_file(session_folder: Path, file_name: str, content: bytes) ->
         raise
 
 
+def copy_uploaded_file(session_folder: Path, file_name: str, source_path: str) -> Path:
+    """
+    把已落盘的上传文件复制到 session/uploaded 文件夹（分块复制，不整体读入内存）
+    
+    Args:
+        session_folder: session 文件夹路径
+        file_name: 文件名
+        source_path: 源文件路径（如上传时写入的临时文件）
+        
+    Returns:
+        保存的文件路径
+    """
+    uploaded_folder = session_folder / "uploaded"
+    uploaded_folder.mkdir(parents=True, exist_ok=True)
+    
+    file_path = uploaded_folder / file_name
+    
+    try:
+        shutil.copyfile(source_path, file_path)
+        logger.info(f"✓ Uploaded file saved: {file_path}")
+        return file_path
+    except Exception as e:
+        logger.error(f"✗ Failed to save uploaded file {file_path}: {str(e)}")
+        raise
+
+
 def save_artifact(session_folder: Path, stage_name: str, artifact_data: Dict[str, Any]) -> Path:
     """
     保存工作流阶段的 artifact（输入输出）到 session/artifact 文件夹
@@ -204,6 +238,35 @@ def save_artifact(session_folder: Path, stage_name: str, artifact_data: Dict[str
         raise
 
 
+def _scan_dir_usage(path: str) -> tuple[int, int]:
+    """
+    递归统计目录下所有文件的总大小和数量
+
+    使用 os.scandir：DirEntry 自带的类型信息免去了逐个 is_dir 的 stat 调用，
+    entry.stat() 的结果也会缓存在 DirEntry 上，每个文件只需一次 stat。
+    不跟随符号链接，与 os.walk 默认行为一致。
+    """
+    total_size = 0
+    file_count = 0
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            total_size += entry.stat().st_size
+                            file_count += 1
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    return total_size, file_count
+
+
 def list_all_sessions(username: Optional[str] = None) -> list[Dict[str, Any]]:
     """
     列出 session 文件夹及其信息
@@ -218,9 +281,6 @@ def list_all_sessions(username: Optional[str] = None) -> list[Dict[str, Any]]:
         - size: 文件夹大小（字节）
         - file_count: 文件数量
     """
-    import os
-    from datetime import datetime
-    
     sessions = []
     
     if username:
@@ -241,41 +301,33 @@ def list_all_sessions(username: Optional[str] = None) -> list[Dict[str, Any]]:
         prefix = ""  # 兼容旧格式
     
     # 递归搜索所有 session 文件夹
-    for item in search_dir.iterdir():
-        if item.is_dir():
-            # 检查是否是 session 文件夹（以 session_ 开头或在用户目录下）
-            if item.name.startswith('session_') or (username and item.is_dir()):
-                try:
-                    # 获取文件夹修改时间作为创建时间
-                    created_time = datetime.fromtimestamp(item.stat().st_mtime)
-                    
-                    # 计算文件夹大小和文件数量
-                    total_size = 0
-                    file_count = 0
-                    for root, dirs, files in os.walk(item):
-                        for file in files:
-                            file_path = Path(root) / file
-                            try:
-                                total_size += file_path.stat().st_size
-                                file_count += 1
-                            except (OSError, PermissionError):
-                                pass
-                    
-                    # 构建 session_id：如果是用户目录，包含用户名路径
-                    if username:
-                        session_id = f"{username}/{item.name}"
-                    else:
-                        session_id = item.name
-                    
-                    sessions.append({
-                        'session_id': session_id,
-                        'created_at': created_time.isoformat(),
-                        'size': total_size,
-                        'file_count': file_count,
-                    })
-                except Exception as e:
-                    logger.warning(f"Failed to get info for session {item.name}: {str(e)}")
-                    continue
+    with os.scandir(search_dir) as it:
+        entries = [entry for entry in it if entry.is_dir()]
+    for item in entries:
+        # 检查是否是 session 文件夹（以 session_ 开头或在用户目录下）
+        if item.name.startswith('session_') or username:
+            try:
+                # 获取文件夹修改时间作为创建时间
+                created_time = datetime.fromtimestamp(item.stat().st_mtime)
+                
+                # 计算文件夹大小和文件数量
+                total_size, file_count = _scan_dir_usage(item.path)
+                
+                # 构建 session_id：如果是用户目录，包含用户名路径
+                if username:
+                    session_id = f"{username}/{item.name}"
+                else:
+                    session_id = item.name
+                
+                sessions.append({
+                    'session_id': session_id,
+                    'created_at': created_time.isoformat(),
+                    'size': total_size,
+                    'file_count': file_count,
+                })
+            except Exception as e:
+                logger.warning(f"Failed to get info for session {item.name}: {str(e)}")
+                continue
     
     # 按创建时间倒序排列（最新的在前）
     sessions.sort(key=lambda x: x['created_at'], reverse=True)
@@ -439,43 +491,46 @@ def get_session_details(session_id: str, username: Optional[str] = None) -> Opti
         # 读取uploaded文件夹中的文件列表
         uploaded_folder = session_folder / "uploaded"
         if uploaded_folder.exists():
-            for uploaded_file in uploaded_folder.iterdir():
-                if uploaded_file.is_file():
-                    try:
-                        file_size = uploaded_file.stat().st_size
-                        result["uploaded_files"].append({
-                            "name": uploaded_file.name,
-                            "size": file_size
-                        })
-                    except Exception as e:
-                        logger.warning(f"Failed to get info for uploaded file {uploaded_file}: {str(e)}")
+            with os.scandir(uploaded_folder) as it:
+                for uploaded_file in it:
+                    if uploaded_file.is_file():
+                        try:
+                            file_size = uploaded_file.stat().st_size
+                            result["uploaded_files"].append({
+                                "name": uploaded_file.name,
+                                "size": file_size
+                            })
+                        except Exception as e:
+                            logger.warning(f"Failed to get info for uploaded file {uploaded_file.path}: {str(e)}")
         
         # 读取generated文件夹中的文件内容
         generated_folder = session_folder / "generated"
         if generated_folder.exists():
             # 常见的generated文件类型
             common_extensions = ['.tex', '.txt', '.md']
-            for generated_file in generated_folder.iterdir():
-                if generated_file.is_file():
-                    try:
-                        # 只读取文本文件
-                        if generated_file.suffix in common_extensions or generated_file.suffix == '':
-                            with open(generated_file, 'r', encoding='utf-8', errors='ignore') as f:
-                                content = f.read()
-                            result["generated_files"][generated_file.name] = {
-                                "content": content,
-                                "size": len(content.encode('utf-8'))
-                            }
-                        else:
-                            # 对于其他文件类型，只记录文件名和大小
-                            file_size = generated_file.stat().st_size
-                            result["generated_files"][generated_file.name] = {
-                                "content": None,  # 非文本文件不读取内容
-                                "size": file_size,
-                                "is_binary": True
-                            }
-                    except Exception as e:
-                        logger.warning(f"Failed to read generated file {generated_file}: {str(e)}")
+            with os.scandir(generated_folder) as it:
+                generated_entries = [entry for entry in it if entry.is_file()]
+            for generated_file in generated_entries:
+                suffix = os.path.splitext(generated_file.name)[1]
+                try:
+                    # 只读取文本文件
+                    if suffix in common_extensions or suffix == '':
+                        with open(generated_file.path, 'r', encoding='utf-8', errors='ignore') as f:
+                            content = f.read()
+                        result["generated_files"][generated_file.name] = {
+                            "content": content,
+                            "size": len(content.encode('utf-8'))
+                        }
+                    else:
+                        # 对于其他文件类型，只记录文件名和大小（DirEntry 已缓存 stat 结果）
+                        file_size = generated_file.stat().st_size
+                        result["generated_files"][generated_file.name] = {
+                            "content": None,  # 非文本文件不读取内容
+                            "size": file_size,
+                            "is_binary": True
+                        }
+                except Exception as e:
+                    logger.warning(f"Failed to read generated file {generated_file.path}: {str(e)}")
         
         return result
     except Exception as e:
@@ -681,3 +736,34 @@ def search_all_sessions_text_files(
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise
 
+
+
+def cleanup_stale_upload_temp_files(max_age_seconds: float) -> int:
+    """
+    删除系统临时目录中超过 max_age_seconds 未修改的上传暂存文件/目录
+
+    正常请求结束时会自行清理；进程被强制终止（SIGKILL、OOM）时 finally 和终结器都不会执行，
+    遗留的文件只能由定时任务兜底清理。
+
+    Returns:
+        删除的文件/目录数量
+    """
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    with os.scandir(tempfile.gettempdir()) as entries:
+        for entry in entries:
+            if not entry.name.startswith((WORKFLOW_UPLOAD_TEMP_PREFIX, VISION_UPLOAD_TEMP_PREFIX)):
+                continue
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime >= cutoff:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.unlink(entry.path)
+                removed += 1
+            except OSError as e:
+                logger.warning(f"Failed to remove stale upload temp file {entry.path}: {str(e)}")
+    if removed:
+        logger.info(f"Removed {removed} stale upload temp files from {tempfile.gettempdir()}")
+    return removed
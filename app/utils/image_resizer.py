@@ -0,0 +1,55 @@
+"""
+图片缩放工具
+在发送给 Vision 模型前把超大图片（手机照片、4K 截图等）等比缩小，减少上传数据量
+"""
+from io import BytesIO
+from PIL import Image, ImageOps
+from app.utils.logger import logger
+
+
+def downscale_image(image_data: bytes, max_dimension: int = 2048, quality: int = 88) -> bytes:
+    """
+    将最长边超过 max_dimension 的图片等比缩小并编码为 JPEG，未超过时原样返回
+
+    Vision 模型本身也会缩放大图，本地先缩小可以省去多余的上传数据。
+    CPU 密集，应在线程中调用。
+
+    Args:
+        image_data: 原始图片数据
+        max_dimension: 最长边的最大像素数，默认 2048
+        quality: JPEG 质量（1-100），默认 88
+
+    Returns:
+        缩小后的 JPEG 数据；无需缩小或无法解析时返回原始数据
+    """
+    try:
+        img = Image.open(BytesIO(image_data))
+        if max(img.size) <= max_dimension:
+            return image_data
+
+        original_size = img.size
+        # 直接在刚打开的图片上 thumbnail：JPEG 可在解码阶段按比例降采样（draft），比先完整解码快得多
+        img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        # 重新编码会丢失 EXIF 方向信息，先按 EXIF 旋转到正确方向
+        img = ImageOps.exif_transpose(img)
+
+        # JPEG 不支持透明度，透明区域铺白色背景
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        output = BytesIO()
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+        downscaled_data = output.getvalue()
+        logger.info(
+            f"Image downscaled: {original_size[0]}x{original_size[1]} -> {img.width}x{img.height}, "
+            f"{len(image_data)} -> {len(downscaled_data)} bytes"
+        )
+        return downscaled_data
+    except Exception as e:
+        logger.error(f"Failed to downscale image: {e}. Using original image.")
+        return image_data
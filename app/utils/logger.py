@@ -1,28 +1,39 @@
+import atexit
 import logging
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener
 from app.config.settings import settings
 
 
+# 所有日志记录先放入队列，由后台线程统一格式化输出：请求协程只做入队，不在请求路径上写 stdout
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+
+# 控制台处理器（只在后台监听线程中使用）
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setLevel(getattr(logging, settings.log_level.upper()))
+
+# 格式化
+_console_handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+))
+
+# 导入时即启动监听线程（脚本与命令行任务同样使用这些 logger），进程退出前输出队列中剩余的日志
+_listener = QueueListener(_log_queue, _console_handler, respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)
+
+
 def setup_logger(name: str = "app") -> logging.Logger:
     """配置日志"""
     logger = logging.getLogger(name)
     logger.setLevel(getattr(logging, settings.log_level.upper()))
     
-    # 控制台处理器
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(getattr(logging, settings.log_level.upper()))
-    
-    # 格式化
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
-    )
-    handler.setFormatter(formatter)
-    
-    logger.addHandler(handler)
+    # 只挂队列处理器，实际输出由后台监听线程完成
+    logger.addHandler(QueueHandler(_log_queue))
     return logger
 
 
 # 全局日志实例
 logger = setup_logger()
-
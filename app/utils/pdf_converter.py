@@ -4,7 +4,7 @@ PDF 转 PNG 工具函数
 """
 import os
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional, Tuple
 import fitz  # PyMuPDF
 from PIL import Image
 from app.utils.logger import logger
@@ -82,3 +82,139 @@ def pdf_to_pngs(
         logger.error(f"Error converting PDF to PNGs: {str(e)}")
         return []
 
+
+def iter_pdf_to_pngs(
+    pdf_path: str,
+    output_dir: str,
+    dpi: int = 300,
+    max_pages: Optional[int] = None
+) -> Iterator[str]:
+    """
+    逐页将 PDF 页面渲染为 PNG 并保存，每保存完一页立即产出其路径
+    
+    与 pdf_to_pngs 相比，调用方可以在后续页面渲染的同时处理已落盘的页面，
+    并且只渲染需要的前 max_pages 页。整个迭代过程只打开一次文档，应在同一个线程中迭代完毕。
+    渲染失败时直接抛出异常。
+    
+    Args:
+        pdf_path: PDF 文件路径
+        output_dir: 输出目录（不存在时自动创建）
+        dpi: 输出图片的 DPI（分辨率），默认 300
+        max_pages: 最多渲染的页数，None 表示全部页面
+        
+    Yields:
+        PNG 文件路径（按页面顺序，文件名如 my_doc_page_1.png）
+    """
+    pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    os.makedirs(output_dir, exist_ok=True)
+    matrix = fitz.Matrix(dpi / 72, dpi / 72)
+    
+    with fitz.open(pdf_path) as pdf_document:
+        page_count = len(pdf_document) if max_pages is None else min(max_pages, len(pdf_document))
+        for page_num in range(page_count):
+            output_path = os.path.join(output_dir, f"{pdf_name}_page_{page_num + 1}.png")
+            pdf_document[page_num].get_pixmap(matrix=matrix).save(output_path)
+            yield output_path
+
+
+def get_pdf_page_count(pdf_path: str) -> int:
+    """
+    获取 PDF 文件的页数
+    
+    Args:
+        pdf_path: PDF 文件路径
+        
+    Returns:
+        页数
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        return len(pdf_document)
+
+
+def extract_pdf_page_texts(pdf_path: str) -> List[str]:
+    """
+    提取 PDF 每一页的文本层（去除首尾空白）
+    
+    扫描件或纯图片页面没有文本层，对应结果为空字符串或极短的文本。
+    
+    Args:
+        pdf_path: PDF 文件路径
+        
+    Returns:
+        每页文本列表（按页面顺序）
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        return [page.get_text("text").strip() for page in pdf_document]
+
+
+def render_pdf_page_to_png(pdf_path: str, page_num: int, dpi: int = 300) -> bytes:
+    """
+    将 PDF 的单个页面渲染为 PNG 二进制数据（不落盘）
+    
+    每次调用独立打开文档，便于在线程中按需逐页渲染，不跨线程共享文档对象。
+    
+    Args:
+        pdf_path: PDF 文件路径
+        page_num: 页面索引（从 0 开始）
+        dpi: 输出图片的 DPI（分辨率），默认 300
+        
+    Returns:
+        PNG 图片的二进制数据
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        pixmap = pdf_document[page_num].get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+        return pixmap.tobytes("png")
+
+
+def render_pdf_page_to_jpeg(pdf_path: str, page_num: int, dpi: int = 150, quality: int = 85) -> bytes:
+    """
+    将 PDF 的单个页面渲染为 JPEG 二进制数据（不落盘）
+    
+    用于 OCR 时比 300 DPI 的 PNG 小得多：150 DPI 足以保证文字清晰，
+    扫描页用有损 JPEG 编码体积也远小于无损 PNG，可大幅减少 Vision 请求的上传数据量。
+    
+    Args:
+        pdf_path: PDF 文件路径
+        page_num: 页面索引（从 0 开始）
+        dpi: 输出图片的 DPI（分辨率），默认 150
+        quality: JPEG 质量（1-100），默认 85
+        
+    Returns:
+        JPEG 图片的二进制数据
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        pixmap = pdf_document[page_num].get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+        return pixmap.tobytes("jpeg", jpg_quality=quality)
+
+
+def iter_pdf_pages_to_jpeg(
+    pdf_path: str,
+    page_nums: Iterable[int],
+    dpi: int = 150,
+    quality: int = 85
+) -> Iterator[Tuple[int, bytes]]:
+    """
+    按给定顺序逐页渲染 PDF 页面为 JPEG，每渲染完一页立即产出
+    
+    整个迭代过程只打开一次文档，应在同一个线程中迭代完毕（不跨线程共享文档对象）。
+    调用方可以在后续页面渲染的同时处理已产出的页面；单页渲染失败时记录日志并跳过该页。
+    
+    Args:
+        pdf_path: PDF 文件路径
+        page_nums: 页面索引（从 0 开始）
+        dpi: 输出图片的 DPI（分辨率），默认 150
+        quality: JPEG 质量（1-100），默认 85
+        
+    Yields:
+        (页面索引, JPEG 图片的二进制数据)
+    """
+    matrix = fitz.Matrix(dpi / 72, dpi / 72)
+    with fitz.open(pdf_path) as pdf_document:
+        for page_num in page_nums:
+            try:
+                pixmap = pdf_document[page_num].get_pixmap(matrix=matrix)
+                image_data = pixmap.tobytes("jpeg", jpg_quality=quality)
+            except Exception as e:
+                logger.error(f"Error rendering PDF page {page_num + 1}: {str(e)}")
+                continue
+            yield page_num, image_data
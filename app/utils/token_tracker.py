@@ -1,5 +1,6 @@
 """Token 使用追踪工具"""
 from typing import Optional, Dict, Any
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 from app.db.models import TokenUsage, User
 from app.utils.logger import logger
@@ -13,7 +14,8 @@ def record_token_usage(
     total_tokens: int = 0,
     model: Optional[str] = None,
     stage: Optional[str] = None,
-    session_id: Optional[str] = None
+    session_id: Optional[str] = None,
+    commit: bool = True
 ) -> TokenUsage:
     """
     记录 token 使用情况到数据库
@@ -27,6 +29,7 @@ def record_token_usage(
         model: 模型名称
         stage: 使用场景（如 paper_overview, latex_paper 等）
         session_id: session ID
+        commit: 是否立即提交；为 False 时只 flush，由后续的 settle_token_usage 在同一事务中提交
         
     Returns:
         TokenUsage 对象
@@ -47,8 +50,11 @@ def record_token_usage(
         )
         
         db.add(token_usage)
-        db.commit()
-        db.refresh(token_usage)
+        if commit:
+            db.commit()
+            db.refresh(token_usage)
+        else:
+            db.flush()
         
         logger.info(
             f"Token usage recorded: user_id={user_id}, stage={stage}, "
@@ -68,7 +74,8 @@ def record_usage_from_dict(
     usage_dict: Dict[str, Any],
     model: Optional[str] = None,
     stage: Optional[str] = None,
-    session_id: Optional[str] = None
+    session_id: Optional[str] = None,
+    commit: bool = True
 ) -> TokenUsage:
     """
     从字典记录 token 使用情况
@@ -85,6 +92,7 @@ def record_usage_from_dict(
         model: 模型名称
         stage: 使用场景
         session_id: session ID
+        commit: 是否立即提交（见 record_token_usage）
         
     Returns:
         TokenUsage 对象
@@ -97,7 +105,8 @@ def record_usage_from_dict(
         total_tokens=usage_dict.get("total_tokens", 0),
         model=model,
         stage=stage,
-        session_id=session_id
+        session_id=session_id,
+        commit=commit
     )
 
 
@@ -105,16 +114,21 @@ def settle_token_usage(
     db: Session,
     user_id: str,
     total_tokens: int,
-    session_id: Optional[str] = None
+    session_id: Optional[str] = None,
+    commit: bool = True
 ) -> Dict[str, Any]:
     """
     结算token使用，从用户余额中扣除（允许欠费）
     
+    余额通过一条 UPDATE ... RETURNING 原子扣减；会话中尚未提交的 token 使用记录
+    （record_token_usage(commit=False)）与扣费在同一事务中提交，不会出现只记录未扣费的情况。
+    
     Args:
         db: 数据库会话
         user_id: 用户 ID
         total_tokens: 本次流程使用的总token数
         session_id: 可选的 session ID（用于日志）
+        commit: 是否立即提交；为 False 时由调用方与任务状态更新等写入一并提交
         
     Returns:
         包含结算结果的字典：
@@ -127,21 +141,22 @@ def settle_token_usage(
         }
     """
     try:
-        # 获取用户
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+        # 更新用户余额（允许负数，即欠费）
+        new_balance = db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(token_balance=User.token_balance - total_tokens)
+            .returning(User.token_balance)
+        ).scalar_one_or_none()
+        if new_balance is None:
             logger.error(f"User not found: {user_id}")
             raise ValueError(f"User not found: {user_id}")
+        if commit:
+            db.commit()
         
-        previous_balance = user.token_balance
-        new_balance = previous_balance - total_tokens
+        previous_balance = new_balance + total_tokens
         is_overdraft = new_balance < 0
         
-        # 更新用户余额（允许负数，即欠费）
-        user.token_balance = new_balance
-        db.commit()
-        db.refresh(user)
-        
         logger.info(
             f"Token settled: user_id={user_id}, session_id={session_id}, "
             f"previous_balance={previous_balance}, tokens_used={total_tokens}, "
@@ -0,0 +1,145 @@
+"""Vision OCR 结果缓存（按图片内容寻址）"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+from app.config.settings import settings
+from app.utils.cache import TTLCache
+from app.utils.logger import logger
+
+
+# 同一张图片在相同提示词/模型/温度下的 OCR 结果可以直接复用（重复上传的 PDF、封面页等）
+_OCR_CACHE_TTL = 7 * 24 * 3600
+
+# 进程内 LRU 作为热点层，SQLite 作为持久层（服务重启后仍可命中）
+_ocr_cache = TTLCache(maxsize=4096)
+_OCR_CACHE_DB_NAME = ".vision_cache.db"
+
+_CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS ocr_cache (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    usage_json TEXT,
+    created_at INTEGER NOT NULL
+)
+"""
+
+_db_conn: Optional[sqlite3.Connection] = None
+_db_lock = threading.Lock()
+
+# 进程内累计的命中/未命中次数（用于观察缓存效果）
+_ocr_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+
+def _get_db() -> Optional[sqlite3.Connection]:
+    """获取（首次调用时创建）持久缓存连接，不可用时返回 None（调用方需持有 _db_lock）"""
+    global _db_conn
+    if _db_conn is None:
+        try:
+            db_path = Path(settings.output_dir) / _OCR_CACHE_DB_NAME
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(db_path), check_same_thread=False)
+            # WAL + synchronous=NORMAL：写入无需每次 fsync，单条读写在微秒到毫秒级
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_CREATE_TABLE_SQL)
+            conn.commit()
+            _db_conn = conn
+        except sqlite3.Error as e:
+            logger.warning(f"Vision OCR persistent cache unavailable: {str(e)}")
+    return _db_conn
+
+
+def ocr_cache_key(
+    image_data: bytes,
+    text_prompt: str,
+    model: Optional[str],
+    temperature: Optional[float]
+) -> str:
+    """根据图片内容哈希及调用参数生成缓存键"""
+    image_hash = hashlib.blake2b(image_data, digest_size=16).hexdigest()
+    prompt_hash = hashlib.sha1(text_prompt.encode("utf-8")).hexdigest()[:16]
+    return f"ocr:{model}:{temperature}:{image_hash}:{prompt_hash}"
+
+
+def _read_persistent(key: str) -> Optional[tuple]:
+    """从 SQLite 持久层读取 (response, created_at)，未命中或不可用时返回 None"""
+    with _db_lock:
+        conn = _get_db()
+        if conn is None:
+            return None
+        try:
+            return conn.execute(
+                "SELECT response, created_at FROM ocr_cache WHERE key = ? AND created_at >= ?",
+                (key, int(time.time()) - _OCR_CACHE_TTL)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read vision OCR cache: {str(e)}")
+            return None
+
+
+def _write_persistent(key: str, text: str, usage: Optional[dict]) -> None:
+    """写入 SQLite 持久层，不可用或失败时仅记录警告"""
+    with _db_lock:
+        conn = _get_db()
+        if conn is None:
+            return
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, response, usage_json, created_at) VALUES (?, ?, ?, ?)",
+                (key, text, json.dumps(usage) if usage else None, int(time.time()))
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write vision OCR cache: {str(e)}")
+
+
+async def get_cached_ocr(key: str) -> Optional[str]:
+    """读取缓存的 OCR 文本，未命中返回 None（SQLite 读取在线程池中执行，不阻塞事件循环）"""
+    text = _ocr_cache.get(key)
+    if text is not None:
+        _ocr_cache_stats["hits"] += 1
+        return text
+
+    row = await asyncio.to_thread(_read_persistent, key)
+    if row is None:
+        _ocr_cache_stats["misses"] += 1
+        return None
+    _ocr_cache_stats["hits"] += 1
+    text, created_at = row
+    _ocr_cache.set(key, text, created_at + _OCR_CACHE_TTL - time.time())
+    return text
+
+
+async def set_cached_ocr(key: str, text: str, usage: Optional[dict] = None) -> None:
+    """写入 OCR 文本（usage 为首次调用的 token 用量，仅留作记录，命中时不重复计费）"""
+    _ocr_cache.set(key, text, _OCR_CACHE_TTL)
+    await asyncio.to_thread(_write_persistent, key, text, usage)
+
+
+def purge_expired_ocr_cache() -> int:
+    """删除持久层中的过期记录，返回删除条数（由调度器定期调用，不在请求路径上执行）"""
+    with _db_lock:
+        conn = _get_db()
+        if conn is None:
+            return 0
+        try:
+            deleted = conn.execute(
+                "DELETE FROM ocr_cache WHERE created_at < ?", (int(time.time()) - _OCR_CACHE_TTL,)
+            ).rowcount
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to purge vision OCR cache: {str(e)}")
+            return 0
+    if deleted:
+        logger.info(f"Purged {deleted} expired vision OCR cache entries")
+    return deleted
+
+
+def get_ocr_cache_stats() -> Dict[str, int]:
+    """返回进程启动以来 OCR 缓存的命中/未命中次数"""
+    return dict(_ocr_cache_stats)
@@ -35,8 +35,8 @@ function TokenUsage() {
     return new Intl.NumberFormat('zh-CN').format(num);
   };
 
-  const formatDate = (dateString: string) => {
-    return new Date(dateString).toLocaleString('zh-CN');
+  const formatDate = (timestamp: number) => {
+    return new Date(timestamp).toLocaleString('zh-CN');
   };
 
   if (loading) {
@@ -733,7 +733,7 @@ export interface TokenUsageDetail {
   total_tokens: number;
   model: string | null;
   stage: string | null;
-  created_at: string;
+  created_at: number;  // 毫秒时间戳
 }
 
 export interface TokenUsageResponse {
@@ -744,6 +744,13 @@ export interface TokenUsageResponse {
   token_balance: number;  // 用户当前token余额
 }
 
+export interface TokenUsagePage {
+  items: TokenUsageDetail[];
+  total: number;  // 记录总数
+  limit: number;
+  offset: number;
+}
+
 export interface TokenBalanceResponse {
   token_balance: number;
   is_overdraft: boolean;  // 是否欠费
@@ -755,8 +762,8 @@ export const tokenUsageApi = {
     return response.data;
   },
   
-  async getAll(limit: number = 100, offset: number = 0): Promise<TokenUsageDetail[]> {
-    const response = await apiClient.get<TokenUsageDetail[]>(`/token-usage/all?limit=${limit}&offset=${offset}`);
+  async getAll(limit: number = 100, offset: number = 0): Promise<TokenUsagePage> {
+    const response = await apiClient.get<TokenUsagePage>(`/token-usage/all?limit=${limit}&offset=${offset}`);
     return response.data;
   },
   
@@ -0,0 +1,71 @@
+"""
+创建 token_usage_daily_mv 物化视图的迁移脚本
+
+使用方法：
+python scripts/add_token_usage_daily_mv.py
+
+此脚本会：
+1. 检查 token_usage 表是否存在
+2. 创建按 (user_id, 日期, stage, model) 聚合的物化视图 token_usage_daily_mv（已存在则跳过）
+3. 创建唯一索引，以支持 REFRESH MATERIALIZED VIEW CONCURRENTLY
+4. 刷新一次物化视图
+
+应用启动时也会自动创建该视图，此脚本用于在不重启服务的情况下手动迁移。
+"""
+import sys
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import inspect
+from app.db.database import engine
+from app.db.token_usage_mv import ensure_token_usage_daily_mv, refresh_token_usage_daily_mv
+from app.utils.logger import logger
+
+
+def add_token_usage_daily_mv():
+    """创建并刷新 token_usage_daily_mv 物化视图"""
+    logger.info("开始检查 token_usage 表...")
+
+    inspector = inspect(engine)
+    if 'token_usage' not in inspector.get_table_names():
+        logger.error("❌ token_usage 表不存在，请先创建数据库表")
+        return False
+
+    try:
+        logger.info("正在创建物化视图 token_usage_daily_mv...")
+        ensure_token_usage_daily_mv()
+        logger.info("✅ 物化视图及唯一索引已就绪")
+
+        logger.info("正在刷新物化视图...")
+        refresh_token_usage_daily_mv()
+        logger.info("✅ 物化视图已刷新")
+        return True
+    except Exception as e:
+        logger.error(f"❌ 创建物化视图时出错: {e}")
+        return False
+
+
+def main():
+    """主函数"""
+    logger.info("=" * 60)
+    logger.info("Token Usage 物化视图迁移脚本")
+    logger.info("=" * 60)
+
+    success = add_token_usage_daily_mv()
+
+    if success:
+        logger.info("=" * 60)
+        logger.info("✅ 迁移完成！")
+        logger.info("=" * 60)
+    else:
+        logger.error("=" * 60)
+        logger.error("❌ 迁移失败！")
+        logger.error("=" * 60)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
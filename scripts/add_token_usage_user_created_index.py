@@ -0,0 +1,71 @@
+"""
+为 token_usage 表添加 (user_id, created_at) 复合索引的迁移脚本
+
+使用方法：
+python scripts/add_token_usage_user_created_index.py
+
+此脚本会：
+1. 检查 token_usage 表是否存在
+2. 使用 CREATE INDEX CONCURRENTLY 创建 ix_token_usage_user_created（不锁表，已存在则跳过）
+
+新部署通过 Base.metadata.create_all 会自动创建该索引，此脚本用于已有数据库。
+创建后可用 EXPLAIN (ANALYZE, BUFFERS) 确认 /token-usage 相关查询走了该索引。
+"""
+import sys
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import inspect, text
+from app.db.database import engine
+from app.utils.logger import logger
+
+
+def add_token_usage_user_created_index():
+    """为 token_usage 表创建 (user_id, created_at) 复合索引"""
+    logger.info("开始检查 token_usage 表...")
+
+    inspector = inspect(engine)
+    if 'token_usage' not in inspector.get_table_names():
+        logger.error("❌ token_usage 表不存在，请先创建数据库表")
+        return False
+
+    # CREATE INDEX CONCURRENTLY 不能在事务中执行，需使用 AUTOCOMMIT
+    # 与模型中的定义保持一致；ORDER BY created_at DESC 可通过反向扫描该索引完成
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        try:
+            logger.info("正在创建索引 ix_token_usage_user_created...")
+            conn.execute(text(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_token_usage_user_created "
+                "ON token_usage (user_id, created_at)"
+            ))
+            logger.info("✅ 索引 ix_token_usage_user_created 已就绪")
+            return True
+        except Exception as e:
+            logger.error(f"❌ 创建索引时出错: {e}")
+            return False
+
+
+def main():
+    """主函数"""
+    logger.info("=" * 60)
+    logger.info("Token Usage 复合索引迁移脚本")
+    logger.info("=" * 60)
+
+    success = add_token_usage_user_created_index()
+
+    if success:
+        logger.info("=" * 60)
+        logger.info("✅ 迁移完成！")
+        logger.info("=" * 60)
+    else:
+        logger.error("=" * 60)
+        logger.error("❌ 迁移失败！")
+        logger.error("=" * 60)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()